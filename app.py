@@ -1,11 +1,14 @@
 import os
 import re
+import time
+import socket
 import asyncio
+import logging
 from dotenv import load_dotenv
 
 from telethon import TelegramClient, events
 
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Bot, Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -16,15 +19,50 @@ from telegram.ext import (
 
 from db import (
     init_db,
-    add_origin_point, remove_origin_point, clear_origin_points,
-    add_origin_state, remove_origin_state, clear_origin_states,
-    set_to_all,
+    add_origin_point, remove_origin_point,
+    add_origin_state, remove_origin_state, clear_origins,
+    add_origin_radius,
+    add_route_rule, remove_route_rule, clear_route_rules,
+    add_filter_rules, remove_filter_rules, clear_filter_rules,
+    toggle_to_all,
     add_destination_state, remove_destination_state, clear_destination_states,
-    get_user_view, get_all_configs
+    get_user_view, match_users, SUB_INDEX, load_index,
+    enqueue_alerts, mark_alerts, resume_pending_alerts,
+    archive_posts, get_last_archived_id, get_archived_posts, get_archived_ids,
+    get_archive_seq, get_archive_changes,
+    enqueue_alerts_many, get_state, set_state, load_fingerprints,
+    get_lane_counts, get_lane_hours,
+    get_config_seq, refresh_index, get_queued_posts, claim_alerts, sweep_outbox,
+    lease_sender_slot, release_sender_slot,
+    set_delivery, delivery_policy,
+    append_latency, get_latency_hists,
+)
+from dispatcher import Dispatcher, SEND_RATE
+from backtest import run_backtest_async, format_report
+from route_parser import parse_post
+from dedup import RouteDeduper, fingerprint, DEDUP_TTL, DEDUP_MAX
+from recent_posts import RecentPosts
+from digest import parse_delivery_arg, describe_delivery
+from routes import parse_route_arg
+from post_filters import FILTER_HELP, parse_filter_arg, parse_filter_remove, describe_filters
+from cities import CANON
+from sub_index import SubscriptionIndex
+from lane_stats import STATS_DEFAULT_DAYS, STATS_MAX_DAYS, since_day, format_stats
+from latency import LatencyLedger, WINDOWS, since_hour, format_latency
+from profiling import (
+    LoopWatchdog, SamplingProfiler, PROFILE_DIR, PROFILE_DEFAULT_SECS, PROFILE_MAX_SECS, format_profile,
+)
+import metrics
+from metrics import (
+    POSTS_SEEN, POSTS_PARSED, POSTS_DUPLICATE, MATCHES,
+    PARSE_SECONDS, MATCH_SECONDS, ENQUEUE_SECONDS,
+    timed_handler,
 )
 
 load_dotenv()
 
+log = logging.getLogger("app")
+
 API_ID = int(os.getenv("API_ID"))
 API_HASH = os.getenv("API_HASH")
 CHANNEL_USERNAME = os.getenv("CHANNEL_USERNAME")
@@ -36,22 +74,79 @@ if not API_ID or not API_HASH or not CHANNEL_USERNAME:
     raise RuntimeError("Missing API_ID/API_HASH/CHANNEL_USERNAME in .env")
 
 SESSION_PATH = os.getenv("SESSION_PATH", "/data/listener_session")
-tele_client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
+# Created by run_telethon(), so only the listening process opens the session file
+tele_client = None
+
+# Process role (docker-compose.split.yml runs one service per role):
+#   all      - everything in one process (default)
+#   listener - Telethon only: archive + dedup, queues posts for the matcher
+#   matcher  - post_queue -> subscription index -> alert outbox
+#   sender   - leases outbox rows and sends them; scale these out
+#   bot      - interactive commands/buttons only
+ROLES = ("all", "listener", "matcher", "sender", "bot")
+ROLE = os.getenv("ROLE", "all").strip().lower()
+if ROLE not in ROLES:
+    raise RuntimeError(f"Invalid ROLE '{ROLE}'. Must be one of: {', '.join(ROLES)}")
+
+MATCHER_POLL = float(os.getenv("MATCHER_POLL", "0.2"))  # secs between idle post_queue polls
+MATCHER_BATCH = 100
+SENDER_POLL = float(os.getenv("SENDER_POLL", "0.25"))   # secs between idle outbox polls
+SENDER_COUNT = int(os.getenv("SENDER_COUNT", "1"))      # senders = shards; they share SEND_RATE
+SENDER_SLOT_LEASE = 60                                   # secs a sender holds its shard unrenewed
+SENDER_CLAIM_BATCH = 200
+OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", "600"))    # secs a sender owns claimed rows (> DIGEST_SECS_MAX)
+OUTBOX_SWEEP_INTERVAL = 60
+
+# Repost suppression (loaded from the DB in main())
+deduper = RouteDeduper()
+
+# Last parsed posts for /testlast (warm-loaded in main(), fed by the listener)
+recent = RecentPosts()
+RECENT_TOPUP_INTERVAL = 1.0   # ROLE=bot: secs between archive reads topping it up
+_recent_topped_at = 0.0
+_recent_seq = 0               # ROLE=bot: archive_seq the buffer has caught up to
+
+# Per-alert delivery latency, flushed in batches by LEDGER.run() (see latency.py)
+LEDGER = LatencyLedger(append_latency)
+LATENCY_DEFAULT_WINDOW = "24h"
+
+# Event-loop lag (started in main()) and the admin /profile sampler (see profiling.py)
+WATCHDOG = LoopWatchdog()
+PROFILER = SamplingProfiler()
+_profile_timer = None   # the pending auto-stop of the current /profile run
+
+# Channel archive: how far back to backfill an empty archive, and the
+# largest /testlast window.
+ARCHIVE_BACKFILL = int(os.getenv("ARCHIVE_BACKFILL", "5000"))
+TESTLAST_MAX_POSTS = 5000
+TESTLAST_MAX_DAYS = 90
+
+# Catch-up replay after restart/disconnect: posts older than this are not alerted
+CATCHUP_MAX_AGE = int(os.getenv("CATCHUP_MAX_AGE", "1800"))    # secs
+CATCHUP_INTERVAL = int(os.getenv("CATCHUP_INTERVAL", "300"))   # secs between gap checks
+CATCHUP_BATCH = 200
 
 # -----------------------
 # Allowlist (PRIVATE BOT)
 # -----------------------
-ALLOWED_USER_IDS_RAW = os.getenv("ALLOWED_USER_IDS", "").strip()
-ALLOWED_USER_IDS = set()
-
-if ALLOWED_USER_IDS_RAW:
-    for x in ALLOWED_USER_IDS_RAW.split(","):
-        x = x.strip()
-        if x:
-            try:
-                ALLOWED_USER_IDS.add(int(x))
-            except ValueError:
-                raise RuntimeError(f"Invalid ALLOWED_USER_IDS entry: '{x}'. Must be integers.")
+def parse_user_ids(env_name: str) -> set:
+    ids = set()
+    raw = os.getenv(env_name, "").strip()
+    if raw:
+        for x in raw.split(","):
+            x = x.strip()
+            if x:
+                try:
+                    ids.add(int(x))
+                except ValueError:
+                    raise RuntimeError(f"Invalid {env_name} entry: '{x}'. Must be integers.")
+    return ids
+
+
+ALLOWED_USER_IDS = parse_user_ids("ALLOWED_USER_IDS")
+
+# Admin-only commands (/backtest ...). Empty => nobody is admin.
+ADMIN_USER_IDS = parse_user_ids("ADMIN_USER_IDS")
 
 def is_allowed(user_id: int) -> bool:
     # If env var is empty => allow everyone (dev mode)
@@ -66,32 +161,41 @@ async def require_allowed(update: Update) -> bool:
         return False
     return True
 
-# Parse: 📍 CITY, ST (2+ times)
-LOC_RE = re.compile(r"📍\s*([A-Z][A-Z\s\.\'-]+?),\s*([A-Z]{2})")
-
+async def require_admin(update: Update) -> bool:
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await update.message.reply_text("⛔ Admin only.")
+        return False
+    return True
 
 # -----------------------
 # Buttons (UI)
 # -----------------------
 BTN_ADD_ORIGIN_CITY = "➕ Add Origin (City and State)"
 BTN_ADD_ORIGIN_STATE = "➕ Add Origin (State)"
+BTN_ADD_ORIGIN_RADIUS = "➕ Add Origin (Radius)"
 BTN_CLEAR_ORIGINS = "🧹 Clear Origins"
 
 BTN_ADD_DEST = "➕ Add Destination State"
 BTN_CLEAR_DEST = "🧹 Clear Destination States"
 BTN_TOGGLE_ALL = "🌎 Toggle Destination: All"
 
+BTN_ADD_ROUTE = "➕ Add Route Rule"
+BTN_CLEAR_ROUTES = "🧹 Clear Route Rules"
+
 BTN_VIEW = "📋 View Settings"
 BTN_TEST50 = "🔎 Test Last 50"
+BTN_DELIVERY = "⏱ Alert Delivery"
 BTN_HELP = "❓ Help"
 
 MAIN_KB = ReplyKeyboardMarkup(
     [
         [BTN_ADD_ORIGIN_CITY, BTN_ADD_ORIGIN_STATE],
+        [BTN_ADD_ORIGIN_RADIUS],
         [BTN_ADD_DEST, BTN_TOGGLE_ALL],
+        [BTN_ADD_ROUTE, BTN_CLEAR_ROUTES],
         [BTN_VIEW, BTN_TEST50],
         [BTN_CLEAR_ORIGINS, BTN_CLEAR_DEST],
-        [BTN_HELP],
+        [BTN_DELIVERY, BTN_HELP],
     ],
     resize_keyboard=True
 )
@@ -105,7 +209,7 @@ def parse_city_state_arg(text: str):
     """
     Accepts:
       "Louisville, KY" OR "Louisville KY"
-    Returns (city, ST) or raises ValueError
+    Returns the canonical (CITY, ST) (see cities.py) or raises ValueError
     """
     text = text.strip()
     if not text:
@@ -126,7 +230,20 @@ def parse_city_state_arg(text: str):
     if len(st) != 2:
         raise ValueError("State must be 2 letters (e.g. OH).")
 
-    return city, st
+    return CANON.canonical(city, st)
+
+
+def parse_radius_arg(text: str):
+    """
+    Accepts:
+      "Louisville, KY, 75" OR "Louisville KY 75" (optionally "75 mi")
+    Returns (city, ST, miles) or raises ValueError
+    """
+    m = re.match(r"^(.*?)[,\s]+(\d+)\s*(?:mi|miles)?\s*$", (text or "").strip(), re.IGNORECASE)
+    if not m:
+        raise ValueError("Use: City, ST, miles")
+    city, st = parse_city_state_arg(m.group(1))
+    return city, st, int(m.group(2))
 
 
 def parse_state_only(text: str) -> str:
@@ -136,9 +253,28 @@ def parse_state_only(text: str) -> str:
     return st
 
 
+# id(view) -> (view, text). db.py replaces a user's view dict on every change
+# instead of mutating it, so identity is a safe key; holding the view keeps
+# its id from being reused.
+_LIST_MEMO = {}
+LIST_MEMO_SIZE = 1024
+
+
 def format_user_list(view: dict) -> str:
+    hit = _LIST_MEMO.get(id(view))
+    if hit is not None and hit[0] is view:
+        return hit[1]
+    text = _render_user_list(view)
+    if len(_LIST_MEMO) >= LIST_MEMO_SIZE:
+        del _LIST_MEMO[next(iter(_LIST_MEMO))]
+    _LIST_MEMO[id(view)] = (view, text)
+    return text
+
+
+def _render_user_list(view: dict) -> str:
     origin_points = view["origin_points"]
     origin_states = view["origin_states"]
+    origin_radius = view["origin_radius"]
     to_all = view["to_all"]
     dest_states = view["destination_states"]
 
@@ -148,38 +284,72 @@ def format_user_list(view: dict) -> str:
         op_disp = "(none)"
 
     os_disp = ", ".join(origin_states) if origin_states else "(none)"
+    if origin_radius:
+        or_disp = "\n".join([f"- {title_city(c)}, {s} ({m} mi)" for c, s, m in origin_radius])
+    else:
+        or_disp = "(none)"
     dest_disp = "ALL STATES ✅" if to_all else (", ".join(dest_states) if dest_states else "(none)")
 
+    routes = [f"- via {s}" for s in view["via_states"]]
+    routes += [f"- stop {title_city(c)}, {s}" for c, s in view["stop_points"]]
+    routes += [f"- lane {p}" for p in view["lanes"]]
+    route_disp = "\n".join(routes) if routes else "(none)"
+    post_filters = describe_filters(view["filters"])
+    filter_disp = "\n".join(post_filters) if post_filters else "(none)"
+
     return (
         f"Origin cities ({len(origin_points)}):\n{op_disp}\n\n"
         f"Origin states ({len(origin_states)}): {os_disp}\n\n"
+        f"Origin radius ({len(origin_radius)}):\n{or_disp}\n\n"
         f"Destination states: {dest_disp}\n\n"
+        f"Route rules ({len(routes)}):\n{route_disp}\n\n"
+        f"Filters ({len(post_filters)}):\n{filter_disp}\n\n"
+        f"Delivery: {describe_delivery(view['delivery'], view['digest_secs'])}\n\n"
     )
 
 
-# -----------------------
-# Matching helpers
-# -----------------------
-def parse_stops(text: str):
+def has_rules(view: dict) -> bool:
+    return has_origin_rules(view) or any(view[k] for k in ("via_states", "stop_points", "lanes"))
+
+
+def has_origin_rules(view: dict) -> bool:
+    return any(view[k] for k in ("origin_points", "origin_states", "origin_radius"))
+
+
+def view_index(view: dict) -> SubscriptionIndex:
     """
-    Returns list of stops [(CITY_UPPER, ST), ...] length >= 2, or [].
+    One-user SubscriptionIndex (user id 0) with this view's rules, so
+    /testlast matches exactly like live alerts (and /stats like their
+    origin/destination part).
     """
-    locs = LOC_RE.findall(text or "")
-    if len(locs) < 2:
-        return []
-    return [(c.strip().upper(), s.strip().upper()) for c, s in locs]
+    routes = [("via", st) for st in view["via_states"]]
+    routes += [("stop", stop) for stop in view["stop_points"]]
+    routes += [("lane", pattern) for pattern in view["lanes"]]
+    index = SubscriptionIndex()
+    index.replace_user(
+        0, view["to_all"], view["origin_points"], view["origin_states"], view["destination_states"],
+        radii=view["origin_radius"], routes=routes, filters=view["filters"],
+    )
+    return index
 
 
-def origin_destination(stops):
+def parse_test_window(arg: str):
     """
-    Origin = first stop, Destination = last stop
+    "/testlast" window: "200" (last N posts) or "30d" (last N days).
+    Returns (limit, days); exactly one is set.
     """
-    return stops[0], stops[-1]
+    arg = arg.strip().lower()
+    if arg.endswith("d"):
+        days = int(arg[:-1])
+        return None, max(1, min(days, TESTLAST_MAX_DAYS))
+    n = int(arg)
+    return max(1, min(n, TESTLAST_MAX_POSTS)), None
 
 
 # -----------------------
 # Commands (optional power users)
 # -----------------------
+@timed_handler
 async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_allowed(update):
         return
@@ -192,6 +362,7 @@ async def start_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(msg, reply_markup=MAIN_KB)
 
 
+@timed_handler
 async def list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_allowed(update):
         return
@@ -200,6 +371,7 @@ async def list_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(format_user_list(view), reply_markup=MAIN_KB)
 
 
+@timed_handler
 async def whoami_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Useful for debugging/allowlist collection.
@@ -210,50 +382,124 @@ async def whoami_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(f"Your Telegram user ID is: {update.effective_user.id}", reply_markup=MAIN_KB)
 
 
+DELIVERY_HELP = (
+    "Send one of:\n"
+    "instant - every match right away\n"
+    "digest 60 - matches within 60s as one short message\n"
+    "first 120 - first match right away, the rest of the next 120s as one message"
+)
+
+
+@timed_handler
+async def delivery_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /delivery instant | digest [secs] | first [secs]
+    """
+    if not await require_allowed(update):
+        return
+    if not context.args:
+        return await update.message.reply_text(DELIVERY_HELP, reply_markup=MAIN_KB)
+    try:
+        mode, secs = parse_delivery_arg(" ".join(context.args))
+        view = await set_delivery(update.effective_user.id, mode, secs)
+    except ValueError as e:
+        return await update.message.reply_text(f"{e}\n\n{DELIVERY_HELP}", reply_markup=MAIN_KB)
+    await update.message.reply_text("✅ Updated delivery.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+
+
+ROUTE_HELP = (
+    "Route rules check EVERY stop and alert on their own. Send one of:\n"
+    "via KY - any stop in KY\n"
+    "stop Louisville, KY - any stop in this city\n"
+    "lane OH>*>CO - stop states in order (* = any stops in between)"
+)
+
+
+@timed_handler
+async def route_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /route via ST | stop City, ST | lane OH>*>CO
+    /route remove <same> | /route clear
+    """
+    if not await require_allowed(update):
+        return
+    uid = update.effective_user.id
+    arg = " ".join(context.args or ())
+    if not arg:
+        return await update.message.reply_text(ROUTE_HELP, reply_markup=MAIN_KB)
+    try:
+        if arg.lower() == "clear":
+            view = await clear_route_rules(uid)
+            done = "✅ Cleared route rules."
+        elif arg.lower().startswith("remove "):
+            view = await remove_route_rule(uid, *parse_route_arg(arg[7:]))
+            done = "✅ Removed route rule."
+        else:
+            view = await add_route_rule(uid, *parse_route_arg(arg))
+            done = "✅ Added route rule."
+    except ValueError as e:
+        return await update.message.reply_text(f"{e}\n\n{ROUTE_HELP}", reply_markup=MAIN_KB)
+    await update.message.reply_text(f"{done}\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+
+
+@timed_handler
+async def filter_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /filter miles 300-900 | days 2 | equipment X | keyword X | exclude X
+    /filter remove miles | remove keyword [X] | /filter clear
+    """
+    if not await require_allowed(update):
+        return
+    uid = update.effective_user.id
+    arg = " ".join(context.args or ())
+    if not arg:
+        return await update.message.reply_text(FILTER_HELP, reply_markup=MAIN_KB)
+    try:
+        if arg.lower() == "clear":
+            view = await clear_filter_rules(uid)
+            done = "✅ Cleared filters."
+        elif arg.lower().startswith("remove "):
+            view = await remove_filter_rules(uid, *parse_filter_remove(arg[7:]))
+            done = "✅ Removed filter."
+        else:
+            view = await add_filter_rules(uid, parse_filter_arg(arg))
+            done = "✅ Added filter."
+    except ValueError as e:
+        return await update.message.reply_text(f"{e}\n\n{FILTER_HELP}", reply_markup=MAIN_KB)
+    await update.message.reply_text(f"{done}\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+
+
+@timed_handler
 async def testlast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_allowed(update):
         return
 
     try:
-        n = int(context.args[0]) if context.args else 20
+        limit, days = parse_test_window(context.args[0] if context.args else "20")
     except ValueError:
-        return await update.message.reply_text("Usage: /testlast 20", reply_markup=MAIN_KB)
-
-    n = max(1, min(n, 200))
+        return await update.message.reply_text("Usage: /testlast 20  or  /testlast 30d", reply_markup=MAIN_KB)
 
     view = await get_user_view(update.effective_user.id)
-    origin_points = set(view["origin_points"])
-    origin_states = set(view["origin_states"])
-    if not origin_points and not origin_states:
-        return await update.message.reply_text("Add at least one Origin city or Origin state first.", reply_markup=MAIN_KB)
-
-    to_all = view["to_all"]
-    dest_states = set(view["destination_states"])
+    if not has_rules(view):
+        return await update.message.reply_text(
+            "Add at least one Origin city, state, radius or route rule first.", reply_markup=MAIN_KB
+        )
+    index = view_index(view)
 
-    msgs = []
-    async for m in tele_client.iter_messages(CHANNEL_USERNAME, limit=n):
-        if m and m.message:
-            msgs.append(m.message)
-    msgs.reverse()
+    since = time.time() - days * 86400 if days else None
+    archived = await recent_posts(limit=limit, since=since)
 
-    def match_text(text: str) -> bool:
-        stops = parse_stops(text)
-        if not stops:
+    def match_post(post) -> bool:
+        if post is None:
             return False
-        (o_city, o_state), (_d_city, d_state) = origin_destination(stops)
+        (o_city, o_state), (_d_city, d_state) = post.origin, post.destination
+        return bool(index.match(o_city, o_state, d_state, post.stops, post))
 
-        origin_ok = ((o_city, o_state) in origin_points) or (o_state in origin_states)
-        if not origin_ok:
-            return False
-
-        if to_all:
-            return True
-        return d_state in dest_states
-
-    matches = [t for t in msgs if match_text(t)]
+    matches = [text for _msg_id, _ts, text, post in archived if match_post(post)]
 
+    scope = f"posts from the last {days} days" if days else "posts"
     header = (
-        f"🔎 Tested last {len(msgs)} posts\n"
+        f"🔎 Tested last {len(archived)} {scope}\n"
         f"✅ Matches: {len(matches)}\n\n"
         f"{format_user_list(view)}"
     )
@@ -272,9 +518,183 @@ async def testlast_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(header + sample_text, reply_markup=MAIN_KB)
 
 
+async def recent_posts(limit: int = None, since: float = None):
+    """
+    /testlast window from the in-memory ring buffer, never Telegram; the
+    archive only for windows larger than the buffer.
+    """
+    global _recent_topped_at, _recent_seq
+    if ROLE == "bot" and time.monotonic() - _recent_topped_at >= RECENT_TOPUP_INTERVAL:
+        # No listener in this process: replay what the listener archived
+        # since (new posts, edits, catch-up gap fills), or reload if that's
+        # more than the buffer holds
+        _recent_topped_at = time.monotonic()
+        changes, _recent_seq = await get_archive_changes(_recent_seq, recent.maxlen)
+        if changes is None:
+            recent.load(await get_archived_posts(limit=recent.maxlen))
+        else:
+            for item in changes:
+                recent.add(*item)
+    posts = recent.last(limit, since)
+    if posts is None:
+        posts = await get_archived_posts(limit=limit, since=since)
+    return posts
+
+
+@timed_handler
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /stats [Nd] [all] -> top lanes over the last N days and the all-time
+    time-of-day histogram, for the user's origin/destination rules (or the
+    whole channel with "all"). Served from the lane rollups (see
+    lane_stats.py), which keep only the first stop and last state of each
+    load, so route rules and post filters are not applied.
+    """
+    if not await require_allowed(update):
+        return
+
+    args = [a.lower() for a in context.args or ()]
+    everyone = "all" in args
+    args = [a for a in args if a != "all"]
+    try:
+        days = int(args[0].rstrip("d")) if args else STATS_DEFAULT_DAYS
+    except ValueError:
+        return await update.message.reply_text(
+            "Usage: /stats 30d  or  /stats 7d all (days apply to top lanes; busiest hours are all time)",
+            reply_markup=MAIN_KB,
+        )
+    days = max(1, min(days, STATS_MAX_DAYS))
+
+    index = None
+    scope = "whole channel"
+    if not everyone:
+        view = await get_user_view(update.effective_user.id)
+        if not has_origin_rules(view):
+            return await update.message.reply_text(
+                "Add at least one Origin city, state or radius first (or try /stats all).", reply_markup=MAIN_KB
+            )
+        index = view_index(view)
+        scope = "your origin/destination rules (route rules and /filter not applied)"
+
+    accepted = {}  # (o_city, o_state, d_state) -> bool
+
+    def accepts(lane) -> bool:
+        if index is None:
+            return True
+        ok = accepted.get(lane)
+        if ok is None:
+            ok = accepted[lane] = bool(index.match(*lane))
+        return ok
+
+    lanes = [lane for lane in await get_lane_counts(since_day(days)) if accepts(lane[:3])]
+    hours = {}
+    for o_city, o_state, d_state, hour, posts in await get_lane_hours():
+        if accepts((o_city, o_state, d_state)):
+            hours[hour] = hours.get(hour, 0) + posts
+
+    await update.message.reply_text(format_stats(lanes, hours, days, scope), reply_markup=MAIN_KB)
+
+
+@timed_handler
+async def backtest_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin: /backtest [N | Nd] -> alerts every user's current filters would
+    have produced over the archived window (default: last 30 days).
+    """
+    if not await require_admin(update):
+        return
+
+    try:
+        limit, days = parse_test_window(context.args[0] if context.args else "30d")
+    except ValueError:
+        return await update.message.reply_text("Usage: /backtest 30d  or  /backtest 5000", reply_markup=MAIN_KB)
+
+    since = time.time() - days * 86400 if days else None
+    posts = await get_archived_posts(limit=limit, since=since)
+    report = await run_backtest_async(posts, SUB_INDEX, is_allowed)
+    await update.message.reply_text("📊 Backtest\n\n" + format_report(report), reply_markup=MAIN_KB)
+
+
+@timed_handler
+async def latency_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin: /latency [1h|6h|24h|7d|30d] -> p50/p95/p99 per stage of alert
+    delivery (channel post -> received -> outbox -> sent), from the hourly
+    latency histograms.
+    """
+    if not await require_admin(update):
+        return
+
+    window = (context.args[0].lower() if context.args else LATENCY_DEFAULT_WINDOW)
+    if window not in WINDOWS:
+        return await update.message.reply_text(
+            "Usage: /latency " + "|".join(WINDOWS), reply_markup=MAIN_KB
+        )
+    hists = await get_latency_hists(since_hour(WINDOWS[window]))
+    await update.message.reply_text(format_latency(hists, window), reply_markup=MAIN_KB)
+
+
+PROFILE_HELP = f"Usage: /profile start [secs, default {PROFILE_DEFAULT_SECS}]  or  /profile stop"
+
+
+async def _finish_profile(update: Update) -> None:
+    try:
+        path = await asyncio.to_thread(PROFILER.stop)
+    except OSError as e:
+        return await update.message.reply_text(
+            f"⚠️ Could not save the profile to {PROFILE_DIR}: {e}\n\n" + format_profile(PROFILER),
+            reply_markup=MAIN_KB,
+        )
+    if path is None:
+        return await update.message.reply_text("Profiler is not running.", reply_markup=MAIN_KB)
+    await update.message.reply_text(format_profile(PROFILER, path), reply_markup=MAIN_KB)
+
+
+@timed_handler
+async def profile_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Admin: /profile start [secs] -> samples this process's event-loop stack
+    for secs (or until /profile stop), then writes the hot stacks to
+    PROFILE_DIR and replies with the top frames.
+    """
+    if not await require_admin(update):
+        return
+
+    global _profile_timer
+    args = [a.lower() for a in context.args or ()]
+    if args[:1] == ["stop"]:
+        if _profile_timer is not None:
+            _profile_timer.cancel()
+            _profile_timer = None
+        return await _finish_profile(update)
+    if args[:1] != ["start"]:
+        status = "running" if PROFILER.running else "stopped"
+        return await update.message.reply_text(f"Profiler {status}.\n{PROFILE_HELP}", reply_markup=MAIN_KB)
+    try:
+        secs = int(args[1]) if len(args) > 1 else PROFILE_DEFAULT_SECS
+    except ValueError:
+        return await update.message.reply_text(PROFILE_HELP, reply_markup=MAIN_KB)
+    secs = max(1, min(secs, PROFILE_MAX_SECS))
+    if PROFILER.running:
+        return await update.message.reply_text("Profiler already running.", reply_markup=MAIN_KB)
+
+    PROFILER.start()
+    await update.message.reply_text(f"🔬 Profiling for {secs}s (/profile stop to end early).", reply_markup=MAIN_KB)
+
+    async def auto_stop():
+        global _profile_timer
+        await asyncio.sleep(secs)
+        # Past this point /profile stop no longer cancels us; it gets "not running"
+        _profile_timer = None
+        await _finish_profile(update)
+
+    _profile_timer = context.application.create_task(auto_stop())
+
+
 # -----------------------
 # Button flows
 # -----------------------
+@timed_handler
 async def menu_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_allowed(update):
         return
@@ -283,13 +703,19 @@ async def menu_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "How to use:\n"
         f"- Tap {BTN_ADD_ORIGIN_CITY} then type: City, ST (example: Cincinnati, OH)\n"
         f"- Tap {BTN_ADD_ORIGIN_STATE} then type: ST (example: OH)\n"
+        f"- Tap {BTN_ADD_ORIGIN_RADIUS} then type: City, ST, miles (example: Louisville, KY, 75)\n"
         f"- Tap {BTN_ADD_DEST} then type: ST (example: CO)\n"
         f"- Tap {BTN_TOGGLE_ALL} to allow all destination states\n"
+        f"- Tap {BTN_ADD_ROUTE} then type: via KY, stop Louisville, KY or lane OH>*>CO (checks every stop)\n"
         f"- Tap {BTN_VIEW} to see your settings\n"
+        "- /stats 30d shows the top lanes (last 30 days) and busiest hours (all time) for your origins\n"
+        "- /filter miles 300-900, days 2, equipment reefer, keyword or exclude narrows your alerts\n"
+        f"- Tap {BTN_DELIVERY} to bundle bursts of matches into one message\n"
     )
     await update.message.reply_text(msg, reply_markup=MAIN_KB)
 
 
+@timed_handler
 async def handle_free_text_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_allowed(update):
         return
@@ -304,9 +730,8 @@ async def handle_free_text_input(update: Update, context: ContextTypes.DEFAULT_T
     if awaiting == "origin_city":
         try:
             city, st = parse_city_state_arg(text)
-            await add_origin_point(uid, city, st)
+            view = await add_origin_point(uid, city, st)
             context.user_data.pop("awaiting", None)
-            view = await get_user_view(uid)
             return await update.message.reply_text("✅ Added origin city.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
         except Exception as e:
             return await update.message.reply_text(
@@ -317,9 +742,8 @@ async def handle_free_text_input(update: Update, context: ContextTypes.DEFAULT_T
     if awaiting == "origin_state":
         try:
             st = parse_state_only(text)
-            await add_origin_state(uid, st)
+            view = await add_origin_state(uid, st)
             context.user_data.pop("awaiting", None)
-            view = await get_user_view(uid)
             return await update.message.reply_text("✅ Added origin state.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
         except Exception as e:
             return await update.message.reply_text(
@@ -327,12 +751,46 @@ async def handle_free_text_input(update: Update, context: ContextTypes.DEFAULT_T
                 reply_markup=ReplyKeyboardRemove()
             )
 
+    if awaiting == "delivery":
+        try:
+            mode, secs = parse_delivery_arg(text)
+            view = await set_delivery(uid, mode, secs)
+            context.user_data.pop("awaiting", None)
+            return await update.message.reply_text("✅ Updated delivery.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+        except Exception as e:
+            return await update.message.reply_text(
+                f"Try again.\n{DELIVERY_HELP}\n({e})",
+                reply_markup=ReplyKeyboardRemove()
+            )
+
+    if awaiting == "origin_radius":
+        try:
+            city, st, miles = parse_radius_arg(text)
+            view = await add_origin_radius(uid, city, st, miles)
+            context.user_data.pop("awaiting", None)
+            return await update.message.reply_text("✅ Added radius origin.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+        except Exception as e:
+            return await update.message.reply_text(
+                f"Try again: City, ST, miles\nExample: Louisville, KY, 75\n({e})",
+                reply_markup=ReplyKeyboardRemove()
+            )
+
+    if awaiting == "route":
+        try:
+            view = await add_route_rule(uid, *parse_route_arg(text))
+            context.user_data.pop("awaiting", None)
+            return await update.message.reply_text("✅ Added route rule.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+        except Exception as e:
+            return await update.message.reply_text(
+                f"Try again.\n{ROUTE_HELP}\n({e})",
+                reply_markup=ReplyKeyboardRemove()
+            )
+
     if awaiting == "dest_state":
         try:
             st = parse_state_only(text)
-            await add_destination_state(uid, st)
+            view = await add_destination_state(uid, st)
             context.user_data.pop("awaiting", None)
-            view = await get_user_view(uid)
             return await update.message.reply_text("✅ Added destination state.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
         except Exception as e:
             return await update.message.reply_text(
@@ -341,6 +799,7 @@ async def handle_free_text_input(update: Update, context: ContextTypes.DEFAULT_T
             )
 
 
+@timed_handler
 async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not await require_allowed(update):
         return
@@ -362,6 +821,13 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply_markup=ReplyKeyboardRemove()
         )
 
+    if text == BTN_ADD_ORIGIN_RADIUS:
+        context.user_data["awaiting"] = "origin_radius"
+        return await update.message.reply_text(
+            "Send Origin Radius as: City, ST, miles\nExample: Louisville, KY, 75",
+            reply_markup=ReplyKeyboardRemove()
+        )
+
     if text == BTN_ADD_DEST:
         context.user_data["awaiting"] = "dest_state"
         return await update.message.reply_text(
@@ -369,22 +835,29 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
             reply_markup=ReplyKeyboardRemove()
         )
 
+    if text == BTN_ADD_ROUTE:
+        context.user_data["awaiting"] = "route"
+        return await update.message.reply_text(ROUTE_HELP, reply_markup=ReplyKeyboardRemove())
+
+    if text == BTN_DELIVERY:
+        context.user_data["awaiting"] = "delivery"
+        return await update.message.reply_text(DELIVERY_HELP, reply_markup=ReplyKeyboardRemove())
+
     if text == BTN_CLEAR_ORIGINS:
-        await clear_origin_points(uid)
-        await clear_origin_states(uid)
-        view = await get_user_view(uid)
+        view = await clear_origins(uid)
         return await update.message.reply_text("✅ Cleared all origins.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
 
     if text == BTN_CLEAR_DEST:
-        await clear_destination_states(uid)
-        view = await get_user_view(uid)
+        view = await clear_destination_states(uid)
         return await update.message.reply_text("✅ Cleared destination states.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
 
+    if text == BTN_CLEAR_ROUTES:
+        view = await clear_route_rules(uid)
+        return await update.message.reply_text("✅ Cleared route rules.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
+
     if text == BTN_TOGGLE_ALL:
-        view = await get_user_view(uid)
-        await set_to_all(uid, not view["to_all"])
-        view2 = await get_user_view(uid)
-        return await update.message.reply_text("✅ Updated destination setting.\n\n" + format_user_list(view2), reply_markup=MAIN_KB)
+        view = await toggle_to_all(uid)
+        return await update.message.reply_text("✅ Updated destination setting.\n\n" + format_user_list(view), reply_markup=MAIN_KB)
 
     if text == BTN_VIEW:
         view = await get_user_view(uid)
@@ -403,69 +876,410 @@ async def handle_menu_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE
 # -----------------------
 # Telethon listener -> bot alerts
 # -----------------------
-@tele_client.on(events.NewMessage(chats=CHANNEL_USERNAME))
+@events.register(events.NewMessage(chats=CHANNEL_USERNAME))
+@timed_handler
 async def on_new_message(event):
+    await process_event(event, edited=False)
+
+
+@events.register(events.MessageEdited(chats=CHANNEL_USERNAME))
+@timed_handler
+async def on_message_edited(event):
+    # Same post_id as the original, so the outbox only accepts users that
+    # newly match after the edit.
+    await process_event(event, edited=True)
+
+
+async def process_event(event, edited: bool):
+    received = time.monotonic()
+    received_at = time.time()
+    POSTS_SEEN.inc()
+
     text = event.raw_text or ""
-    stops = parse_stops(text)
-    if not stops:
+    posted_at = event.date.timestamp() if event.date else time.time()
+    with PARSE_SECONDS.time():
+        post = parse_post(text, msg_id=event.id, posted_at=posted_at)
+
+    fingerprints = []
+    alert_post = dedup_check(post, fingerprints)
+    if ROLE == "listener":
+        # Matching happens in the matcher process; archive + queue in one write
+        if text:
+            queue = [(event.id, edited)] if alert_post is not None else []
+            await archive_posts([(event.id, posted_at, text, post)], fingerprints, queue)
         return
+    await handle_post(event.id, text, alert_post, received, edited, received_at)
+    # Archive after alerts are queued so it never delays them. A post whose
+    # handling failed stays unarchived, so catch_up() retries it.
+    if text:
+        recent.add(event.id, posted_at, text, post)
+        await archive_posts([(event.id, posted_at, text, post)], fingerprints)
 
-    (o_city, o_state), (_d_city, d_state) = origin_destination(stops)
 
-    configs = await get_all_configs()
-    if not configs:
-        return
+def dedup_check(post, fingerprints: list):
+    """
+    Returns post, or None if it repeats a load another message already
+    carried. New fingerprints are appended to `fingerprints` for persisting.
+    """
+    if post is None:
+        return None
+    POSTS_PARSED.inc()
+    fp = fingerprint(post)
+    first_id = deduper.check(fp, post.msg_id)
+    if first_id is not None:
+        POSTS_DUPLICATE.inc()
+        log.info("msg_id=%s repeats msg_id=%s; not alerting", post.msg_id, first_id)
+        return None
+    fingerprints.append((fp, post.msg_id, time.time()))
+    return post
+
+
+def match_post(post):
+    """
+    Returns allowed user_ids whose filters match this post ([] if none).
+    Pure in-memory (subscription index); shared by live and catch-up paths.
+    """
+    # Origin = FIRST stop, Destination = LAST stop
+    (o_city, o_state), (_d_city, d_state) = post.origin, post.destination
 
-    alert = f"🚚 LOAD MATCH\n\n{text}"
+    with MATCH_SECONDS.time():
+        # Only users subscribed to this origin (point or state), or with a
+        # route rule keyed on one of its stops, are candidates; their post
+        # filters (miles, pickup, equipment, keywords) then narrow the list
+        user_ids = match_users(o_city, o_state, d_state, post.stops, post)
 
-    for cfg in configs:
         # Hard block any unauthorized user even if they somehow exist in DB
-        if not is_allowed(cfg["user_id"]):
-            continue
+        user_ids = [uid for uid in user_ids if is_allowed(uid)]
+    MATCHES.inc(amount=len(user_ids))
+    return user_ids
 
-        # Origin match: FIRST stop only
-        origin_ok = ((o_city, o_state) in cfg["origin_points"]) or (o_state in cfg["origin_states"])
-        if not origin_ok:
-            continue
 
-        # Destination match: LAST stop state only
-        if cfg["to_all"] or (d_state in cfg["destination_states"]):
-            try:
-                await bot_app.bot.send_message(chat_id=cfg["user_id"], text=alert)
-            except Exception:
-                pass
+def alert_text(text: str, edited: bool = False) -> str:
+    if edited:
+        return f"🚚 LOAD MATCH (edited post)\n\n{text}"
+    return f"🚚 LOAD MATCH\n\n{text}"
+
+
+async def handle_post(msg_id: int, text: str, post, received: float = None, edited: bool = False,
+                      received_at: float = None):
+    if post is None:
+        return
+    user_ids = match_post(post)
+    if not user_ids:
+        return
+
+    alert = alert_text(text, edited)
+    stamps = None
+    if not edited and received_at is not None and post.posted_at is not None:
+        stamps = (post.posted_at, received_at)
+    matched_at = time.time()
+
+    # Durable first (one batched write), then fan-out on the dispatcher's
+    # sender tasks (rate-limited, retried, acked back to the outbox).
+    with ENQUEUE_SECONDS.time():
+        rows = await enqueue_alerts(msg_id, alert, user_ids, stamps, matched_at)
+    if rows:
+        await dispatcher.submit(
+            msg_id, alert, [u for _, u in rows], [i for i, _ in rows], received,
+            (*stamps, matched_at) if stamps is not None else None,
+        )
+
+
+async def resume_outbox():
+    """
+    Re-queue alerts that were still pending when the process last stopped.
+    """
+    await submit_outbox_rows(await resume_pending_alerts())
+
+
+async def submit_outbox_rows(rows):
+    """
+    rows: [(outbox_id, post_id, user_id, text, stamps)] -> one dispatcher.submit per post.
+    """
+    by_post = {}
+    for outbox_id, post_id, user_id, text, stamps in rows:
+        entry = by_post.setdefault(post_id, (text, stamps, [], []))
+        entry[2].append(user_id)
+        entry[3].append(outbox_id)
+
+    for post_id, (text, stamps, user_ids, outbox_ids) in by_post.items():
+        await dispatcher.submit(post_id, text, user_ids, outbox_ids, stamps=stamps)
 
 
 # -----------------------
 # Run both clients
 # -----------------------
+async def catch_up():
+    """
+    Replays channel posts newer than last_processed_id (bot_state) through the
+    same match -> outbox -> dispatcher path, oldest first.
+
+    - Posts older than CATCHUP_MAX_AGE are archived but not alerted.
+    - Work is batched: per CATCHUP_BATCH posts, one transaction for all outbox
+      rows, one for the archive, then last_processed_id is advanced.
+    - Only catch_up() advances last_processed_id (so a gap the live handler
+      skipped is never jumped over); posts it handled since the previous run
+      are already archived and are skipped before parsing, so they are never
+      re-matched against rules added since.
+    - First run (nothing recorded): backfill the archive with the last
+      ARCHIVE_BACKFILL posts, no alerts.
+    """
+    last_id = int(await get_state("last_processed_id", 0)) or await get_last_archived_id()
+    if last_id:
+        messages = tele_client.iter_messages(CHANNEL_USERNAME, min_id=last_id, reverse=True)
+    else:
+        messages = tele_client.iter_messages(CHANNEL_USERNAME, limit=ARCHIVE_BACKFILL)
+
+    cutoff = time.time() - CATCHUP_MAX_AGE
+    batch = []
+    totals = {"posts": 0, "replayed": 0, "alerts": 0}
+    max_id = last_id
+
+    async def flush():
+        archived, to_alert, queue, fingerprints = [], [], [], []
+        seen = await get_archived_ids([m.id for m in batch]) if last_id else set()
+        for m in batch:
+            if m.id in seen:
+                continue
+            m_id, posted_at, text = m.id, m.date.timestamp(), m.message
+            post = parse_post(text, msg_id=m_id, posted_at=posted_at)
+            archived.append((m_id, posted_at, text, post))
+            post = dedup_check(post, fingerprints)
+            if last_id and post is not None and posted_at >= cutoff:
+                if ROLE == "listener":
+                    queue.append((m_id, False))
+                    continue
+                user_ids = match_post(post)
+                if user_ids:
+                    to_alert.append((m_id, alert_text(text), user_ids))
+
+        results = await enqueue_alerts_many(to_alert) if to_alert else []
+        await archive_posts(archived, fingerprints, queue)
+        if ROLE != "listener":
+            for item in archived:
+                recent.add(*item)
+        await set_state("last_processed_id", max_id)
+
+        for (m_id, alert, _users), rows in zip(to_alert, results):
+            if rows:
+                await dispatcher.submit(m_id, alert, [u for _, u in rows], [i for i, _ in rows])
+                totals["alerts"] += len(rows)
+        totals["posts"] += len(batch)
+        totals["replayed"] += len(to_alert) + len(queue)
+        batch.clear()
+
+    async for m in messages:
+        if not m:
+            continue
+        max_id = max(max_id, m.id)
+        if not m.message:
+            continue
+        batch.append(m)
+        if len(batch) >= CATCHUP_BATCH:
+            await flush()
+    if batch or max_id != last_id:
+        await flush()
+
+    log.info(
+        "catch-up after msg_id=%d: %d posts, %d matched posts, %d alerts queued",
+        last_id, totals["posts"], totals["replayed"], totals["alerts"],
+    )
+
+
+async def periodic_catch_up():
+    """
+    Telethon reconnects silently and may drop updates while offline; a cheap
+    periodic catch-up closes any such gap.
+    """
+    while True:
+        await asyncio.sleep(CATCHUP_INTERVAL)
+        try:
+            await catch_up()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            log.exception("periodic catch-up failed")
+
+
 async def run_telethon():
+    global tele_client
+    tele_client = TelegramClient(SESSION_PATH, API_ID, API_HASH)
+    tele_client.add_event_handler(on_new_message)
+    tele_client.add_event_handler(on_message_edited)
     await tele_client.start()
-    await tele_client.run_until_disconnected()
+    poller = asyncio.create_task(periodic_catch_up())
+    try:
+        while True:
+            await catch_up()
+            await tele_client.run_until_disconnected()
+            log.warning("Telethon disconnected; reconnecting in 5s")
+            await asyncio.sleep(5)
+            await tele_client.connect()
+    finally:
+        poller.cancel()
 
 
-async def main():
-    global bot_app
-    await init_db()
+async def run_matcher():
+    """
+    ROLE=matcher: drains post_queue through the subscription index into the
+    outbox. Config changes made by the bot process are pulled in per user
+    via config_changes before each batch.
+    """
+    # seq first, then a fresh load, so no change can fall between the two
+    seq = await get_config_seq()
+    await load_index()
+    while True:
+        seq = await refresh_index(seq)
+        queued = await get_queued_posts(MATCHER_BATCH)
+        if not queued:
+            await asyncio.sleep(MATCHER_POLL)
+            continue
 
-    bot_app = Application.builder().token(BOT_TOKEN).build()
+        to_alert = []
+        for msg_id, edited, text, post, queued_at in queued:
+            if post is None:
+                continue
+            user_ids = match_post(post)
+            if user_ids:
+                # The listener's queue time stands in for "received"
+                stamps = None if edited or post.posted_at is None else (post.posted_at, queued_at)
+                to_alert.append((msg_id, alert_text(text, edited), user_ids, stamps))
+        with ENQUEUE_SECONDS.time():
+            await enqueue_alerts_many(to_alert, dequeue=[m for m, *_ in queued])
 
-    bot_app.add_handler(CommandHandler("start", start_cmd))
-    bot_app.add_handler(CommandHandler("list", list_cmd))
-    bot_app.add_handler(CommandHandler("testlast", testlast_cmd))
-    bot_app.add_handler(CommandHandler("whoami", whoami_cmd))
+
+async def run_sender():
+    """
+    ROLE=sender: leases pending outbox rows and feeds them to a local
+    dispatcher. Run SENDER_COUNT of them: each leases one shard slot and
+    claims only the alerts of users with user_id % SENDER_COUNT == slot, so
+    a chat's pacing and digests stay in one process, and takes SEND_RATE /
+    SENDER_COUNT so together they stay under the bot's global limit. A
+    spare sender waits for a slot whose lease has run out.
+    """
+    global dispatcher
+    bot = Bot(BOT_TOKEN)
+    await bot.initialize()
+    dispatcher = Dispatcher(
+        bot, rate=SEND_RATE / max(1, SENDER_COUNT), ack=mark_alerts, policy=delivery_policy, ledger=LEDGER,
+    )
+    dispatcher.start()
+    ledger_task = asyncio.create_task(LEDGER.run())
+
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    seq = await get_config_seq()
+    await load_index()
+    next_sweep = 0.0
+    slot, next_lease = None, 0.0
+    try:
+        while True:
+            # Delivery policies live in the index; pick up changes from the bot
+            seq = await refresh_index(seq)
+            if time.monotonic() >= next_sweep:
+                await sweep_outbox()
+                next_sweep = time.monotonic() + OUTBOX_SWEEP_INTERVAL
+            if time.monotonic() >= next_lease:
+                held = await lease_sender_slot(worker, SENDER_COUNT, SENDER_SLOT_LEASE)
+                if held != slot:
+                    log.info("sender %s: shard %s of %d", worker, held, SENDER_COUNT)
+                slot = held
+                next_lease = time.monotonic() + SENDER_SLOT_LEASE / 3
+
+            rows = []
+            # Only claim what we can start on soon; leased rows are ours until
+            # OUTBOX_LEASE runs out.
+            if slot is not None and dispatcher.queue.qsize() < SENDER_CLAIM_BATCH:
+                rows = await claim_alerts(worker, SENDER_CLAIM_BATCH, OUTBOX_LEASE, shard=(slot, SENDER_COUNT))
+                await submit_outbox_rows(rows)
+            if len(rows) < SENDER_CLAIM_BATCH:
+                await asyncio.sleep(SENDER_POLL)
+    finally:
+        await dispatcher.stop()
+        await release_sender_slot(worker)
+        ledger_task.cancel()
+        await asyncio.gather(ledger_task, return_exceptions=True)
+        await bot.shutdown()
+
+
+def build_bot_app():
+    app = Application.builder().token(BOT_TOKEN).build()
+
+    app.add_handler(CommandHandler("start", start_cmd))
+    app.add_handler(CommandHandler("list", list_cmd))
+    app.add_handler(CommandHandler("testlast", testlast_cmd))
+    app.add_handler(CommandHandler("whoami", whoami_cmd))
+    app.add_handler(CommandHandler("backtest", backtest_cmd))
+    app.add_handler(CommandHandler("delivery", delivery_cmd))
+    app.add_handler(CommandHandler("route", route_cmd))
+    app.add_handler(CommandHandler("filter", filter_cmd))
+    app.add_handler(CommandHandler("stats", stats_cmd))
+    app.add_handler(CommandHandler("latency", latency_cmd))
+    app.add_handler(CommandHandler("profile", profile_cmd))
 
     # UI handlers (typed input first, then menu buttons)
-    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_free_text_input), group=0)
-    bot_app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu_buttons), group=1)
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_free_text_input), group=0)
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_menu_buttons), group=1)
+    return app
+
+
+async def run_bot():
+    """
+    ROLE=bot: interactive commands only; alerts are sent by the senders.
+    """
+    global bot_app
+    bot_app = build_bot_app()
+    await bot_app.initialize()
+    await bot_app.start()
+    await bot_app.updater.start_polling()
+    await asyncio.Event().wait()
+
+
+async def run_all():
+    global bot_app, dispatcher
+    bot_app = build_bot_app()
+    dispatcher = Dispatcher(bot_app.bot, ack=mark_alerts, policy=delivery_policy, ledger=LEDGER)
 
     await bot_app.initialize()
     await bot_app.start()
+    dispatcher.start()
+    await resume_outbox()
     bot_task = asyncio.create_task(bot_app.updater.start_polling())
     tele_task = asyncio.create_task(run_telethon())
+    ledger_task = asyncio.create_task(LEDGER.run())
+
+    await asyncio.gather(bot_task, tele_task, ledger_task)
 
-    await asyncio.gather(bot_task, tele_task)
+
+async def main():
+    global _recent_seq
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s", level=logging.INFO)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    await init_db()
+    if ROLE in ("all", "listener"):
+        deduper.load(await load_fingerprints(DEDUP_TTL, DEDUP_MAX))
+    if ROLE in ("all", "bot"):
+        # seq first, so no change can fall between it and the load
+        _recent_seq = await get_archive_seq()
+        recent.load(await get_archived_posts(limit=recent.maxlen))
+    await metrics.start_server()
+    watchdog_task = asyncio.create_task(WATCHDOG.run())
+    log.info("starting role=%s", ROLE)
+
+    try:
+        if ROLE == "all":
+            await run_all()
+        elif ROLE == "listener":
+            await run_telethon()
+        elif ROLE == "matcher":
+            await run_matcher()
+        elif ROLE == "sender":
+            await run_sender()
+        else:
+            await run_bot()
+    finally:
+        watchdog_task.cancel()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,184 @@
+"""
+Batch backtest: how many alerts would current filters have produced?
+
+Posts are grouped by their match key (FIRST stop city+state, LAST stop
+state; the full stop list too once any user has a route rule) and each
+distinct key is run once through the same SubscriptionIndex that serves
+live alerts, so a month of posts costs (#distinct lanes x interested
+users), not (#posts x #users). Users with post filters (post_filters.py)
+then have their lane's posts checked one by one; each post's facts are
+derived once however many users check it.
+
+The bot's /backtest uses run_backtest_async(), which yields to the event
+loop every BACKTEST_YIELD_LANES lanes (and BACKTEST_YIELD_POSTS posts) so
+the listener and dispatcher keep running. It stays on the loop thread
+rather than a worker thread because the live index is mutated there.
+
+CLI:
+    python backtest.py --days 30
+    python backtest.py --posts 5000 --user 123456 --json
+"""
+import sys
+import json
+import time
+import asyncio
+import argparse
+from collections import Counter
+
+import db
+from post_filters import PostFacts
+
+SAMPLES_PER_USER = 3
+BACKTEST_YIELD_LANES = 200
+BACKTEST_YIELD_POSTS = 5000
+
+
+def run_backtest(posts, index, user_filter=None):
+    """
+    posts: [(msg_id, posted_at, text, LoadPost or None)] oldest first
+           (the shape db.get_archived_posts() returns)
+    index: a SubscriptionIndex (normally db.SUB_INDEX)
+    user_filter: optional callable(user_id) -> bool (e.g. allowlist)
+
+    Returns a dict:
+      {
+        posts, loads, lanes_tested, elapsed_ms,
+        users: {user_id: {"hits": int, "lanes": Counter((O_ST, D_ST)), "samples": [msg_id, ...]}}
+      }
+    """
+    report = {}
+    for _ in _replay(posts, index, user_filter, report):
+        pass
+    return report
+
+
+async def run_backtest_async(posts, index, user_filter=None):
+    """
+    run_backtest() that yields to the event loop between chunks of work.
+    """
+    report = {}
+    for _ in _replay(posts, index, user_filter, report):
+        await asyncio.sleep(0)
+    return report
+
+
+def _replay(posts, index, user_filter, report: dict):
+    """
+    Generator doing run_backtest()'s work; yields between chunks and fills
+    `report` when done.
+    """
+    started = time.perf_counter()
+
+    # key -> msg_ids (in post order)
+    by_key = {}
+    loads = 0
+    routed = bool(index.routes)
+    filtered = index.filters
+    by_msg = {}    # msg_id -> LoadPost, then PostFacts once first needed
+    for i, (msg_id, _posted_at, _text, post) in enumerate(posts, 1):
+        if i % BACKTEST_YIELD_POSTS == 0:
+            yield
+        if post is None:
+            continue
+        loads += 1
+        if filtered:
+            by_msg[msg_id] = post
+        (o_city, o_state), (_d_city, d_state) = post.origin, post.destination
+        stops = post.stops if routed else ()
+        by_key.setdefault((o_city, o_state, d_state, stops), []).append(msg_id)
+
+    def facts(msg_id):
+        f = by_msg[msg_id]
+        if not isinstance(f, PostFacts):
+            f = by_msg[msg_id] = PostFacts(f)
+        return f
+
+    users = {}
+    for i, ((o_city, o_state, d_state, stops), lane_ids) in enumerate(by_key.items(), 1):
+        if i % BACKTEST_YIELD_LANES == 0:
+            yield
+        for user_id in index.match(o_city, o_state, d_state, stops):
+            if user_filter is not None and not user_filter(user_id):
+                continue
+            check = filtered.get(user_id)
+            msg_ids = lane_ids if check is None else [m for m in lane_ids if check(facts(m))]
+            if not msg_ids:
+                continue
+            u = users.get(user_id)
+            if u is None:
+                u = users[user_id] = {"hits": 0, "lanes": Counter(), "samples": []}
+            u["hits"] += len(msg_ids)
+            u["lanes"][(o_state, d_state)] += len(msg_ids)
+            u["samples"].extend(msg_ids[-SAMPLES_PER_USER:])
+
+    for u in users.values():
+        u["samples"] = sorted(u["samples"])[-SAMPLES_PER_USER:]
+
+    report.update(
+        posts=len(posts),
+        loads=loads,
+        lanes_tested=len(by_key),
+        elapsed_ms=round((time.perf_counter() - started) * 1000, 2),
+        users=users,
+    )
+
+
+def format_report(report: dict, top: int = 20) -> str:
+    lines = [
+        f"Posts: {report['posts']} (loads: {report['loads']}, distinct lanes: {report['lanes_tested']})",
+        f"Users with hits: {len(report['users'])}  [{report['elapsed_ms']} ms]",
+        "",
+    ]
+    ranked = sorted(report["users"].items(), key=lambda kv: kv[1]["hits"], reverse=True)
+    for user_id, u in ranked[:top]:
+        lanes = ", ".join(f"{o}→{d} {n}" for (o, d), n in u["lanes"].most_common(3))
+        lines.append(f"{user_id}: {u['hits']} alerts ({lanes})")
+    if len(ranked) > top:
+        lines.append(f"… and {len(ranked) - top} more users")
+    return "\n".join(lines)
+
+
+def report_as_json(report: dict) -> dict:
+    out = dict(report)
+    out["users"] = {
+        str(user_id): {
+            "hits": u["hits"],
+            "lanes": {f"{o}->{d}": n for (o, d), n in u["lanes"].most_common()},
+            "samples": u["samples"],
+        }
+        for user_id, u in report["users"].items()
+    }
+    return out
+
+
+async def _cli(args):
+    if args.db:
+        db.DB_PATH = args.db
+    await db.init_db()
+    try:
+        since = time.time() - args.days * 86400 if args.days else None
+        posts = await db.get_archived_posts(limit=args.posts, since=since)
+        user_filter = (lambda uid: uid == args.user) if args.user else None
+        report = run_backtest(posts, db.SUB_INDEX, user_filter)
+    finally:
+        await db.close_db()
+
+    if args.json:
+        print(json.dumps(report_as_json(report), indent=2))
+    else:
+        print(format_report(report, top=args.top))
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Backtest user filters against the channel archive.")
+    p.add_argument("--db", help="path to prefs.db (default: $DB_PATH)")
+    p.add_argument("--days", type=int, help="only posts from the last N days")
+    p.add_argument("--posts", type=int, help="only the last N posts")
+    p.add_argument("--user", type=int, help="only this user id")
+    p.add_argument("--top", type=int, default=20)
+    p.add_argument("--json", action="store_true")
+    asyncio.run(_cli(p.parse_args(argv)))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,3 @@
+"""
+Benchmarks and regression corpora. Run modules with `python -m bench.<name>`.
+"""
@@ -0,0 +1,169 @@
+"""
+End-to-end load test: fake channel -> app.on_new_message -> parse, dedup,
+match, outbox -> Dispatcher -> fake Bot API, against a temp DB.
+
+For each population size it reports post -> first/last alert latency
+percentiles (measured from the moment the event is injected to the fake
+send_message call completing) and alert throughput. No Telegram
+credentials are needed; see bench/fake_telegram.py.
+
+    python -m bench.e2e
+    python -m bench.e2e --sizes 1000 --posts 50 --rate 20 --shape burst --retry-rate 0.001
+
+--send-rate defaults far above Telegram's real ~30 msg/s so the run measures
+the app rather than the rate limit; pass --send-rate 30 for the real pacing.
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+# app.py reads these at import time; the fakes never use them
+for _key, _value in (("API_ID", "1"), ("API_HASH", "bench"), ("CHANNEL_USERNAME", "bench"),
+                     ("BOT_TOKEN", "1:bench"), ("METRICS_PORT", "0")):
+    os.environ.setdefault(_key, _value)
+os.environ["ALLOWED_USER_IDS"] = ""
+os.environ["ROLE"] = "all"
+
+import db
+import app
+from dedup import RouteDeduper
+from dispatcher import Dispatcher, SEND_CHAT_INTERVAL
+from bench.run import populate, _git_rev
+from bench.synth import make_posts, make_users
+from bench.fake_telegram import FakeBot, FakeChannel, SHAPES
+
+DRAIN_POLL = 0.1
+
+
+def _pct(values, q: float):
+    return round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 1)
+
+
+def _latency(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return {
+        "n": len(values),
+        "p50_ms": _pct(values, 0.50),
+        "p95_ms": _pct(values, 0.95),
+        "p99_ms": _pct(values, 0.99),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+async def _pending() -> int:
+    async with db.transaction(write=False) as conn:
+        cur = await conn.execute("SELECT COUNT(*) FROM alert_outbox WHERE status='pending'")
+        (n,) = await cur.fetchone()
+    return n
+
+
+async def run_size(size: int, texts, args):
+    bot = FakeBot(
+        latency=args.latency, retry_rate=args.retry_rate, retry_after=args.retry_after,
+        timeout_rate=args.timeout_rate, blocked_rate=args.blocked_rate,
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "e2e.db")
+        await db.init_db()
+        try:
+            await populate(make_users(size))
+            app.deduper = RouteDeduper()
+            app.dispatcher = Dispatcher(
+                bot, workers=args.workers, rate=args.send_rate, chat_interval=args.chat_interval,
+                ack=db.mark_alerts, policy=db.delivery_policy,
+            )
+            app.dispatcher.start()
+
+            channel = FakeChannel(app.on_new_message, rate=args.rate, shape=args.shape, burst=args.burst)
+            started = time.monotonic()
+            errors = await channel.play(texts)
+            ingested = time.monotonic()
+
+            deadline = ingested + args.timeout
+            # Done when every outbox row has been acked (sent or failed)
+            while await _pending() and time.monotonic() < deadline:
+                await asyncio.sleep(DRAIN_POLL)
+            drained = time.monotonic()
+            pending = await _pending()
+            await app.dispatcher.stop()
+        finally:
+            await db.close_db()
+
+    # Alert text -> msg_id (every synthetic post is unique, see main())
+    by_text = {app.alert_text(text): msg_id for msg_id, text in enumerate(texts, 1)}
+    sends = {}
+    for t, _chat_id, text in bot.sent:
+        sends.setdefault(by_text[text], []).append(t)
+    first = [min(ts) - channel.injected[m] for m, ts in sends.items()]
+    last = [max(ts) - channel.injected[m] for m, ts in sends.items()]
+    last_send = max((t for t, _c, _x in bot.sent), default=drained)
+    span = max(1e-9, last_send - started)
+
+    return {
+        "users": size,
+        "posts": len(texts),
+        "posts_alerted": len(sends),
+        "alerts_sent": len(bot.sent),
+        "alerts_pending": pending,
+        "send_errors": bot.errors,
+        "handler_errors": [repr(e) for e in errors[:5]],
+        "ingest_s": round(ingested - started, 2),
+        "wall_s": round(drained - started, 2),
+        "alerts_per_s": round(len(bot.sent) / span, 1),
+        "post_to_first_alert": _latency(first),
+        "post_to_last_alert": _latency(last),
+    }
+
+
+async def run(args):
+    # A unique trailer line keeps every post (and its alert text) distinct
+    texts = [f"{text}\nRef #{i}" for i, text in enumerate(make_posts(args.posts, seed=args.seed), 1)]
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": _git_rev(),
+            "args": vars(args),
+        },
+        "runs": [],
+    }
+    for size in args.sizes:
+        results["runs"].append(await run_size(size, texts, args))
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="End-to-end load test against fake Telegram services.")
+    p.add_argument("--sizes", default="1000,10000,50000", type=lambda s: [int(x) for x in s.split(",") if x.strip()])
+    p.add_argument("--posts", type=int, default=100)
+    p.add_argument("--rate", type=float, default=10.0, help="posts/sec injected")
+    p.add_argument("--shape", default="steady", choices=SHAPES)
+    p.add_argument("--burst", type=int, default=10, help="posts per burst (--shape burst)")
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--workers", type=int, default=8, help="dispatcher sender tasks")
+    p.add_argument("--send-rate", type=float, default=2000.0, help="dispatcher msgs/sec")
+    p.add_argument("--chat-interval", type=float, default=SEND_CHAT_INTERVAL)
+    p.add_argument("--latency", type=float, default=0.005, help="fake send_message secs")
+    p.add_argument("--retry-rate", type=float, default=0.0)
+    p.add_argument("--retry-after", type=int, default=1)
+    p.add_argument("--timeout-rate", type=float, default=0.0)
+    p.add_argument("--blocked-rate", type=float, default=0.0)
+    p.add_argument("--timeout", type=float, default=600.0, help="max secs to drain the outbox")
+    p.add_argument("--out", help="write JSON here instead of stdout")
+    args = p.parse_args(argv)
+
+    payload = json.dumps(asyncio.run(run(args)), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+"""
+Local stand-ins for the two Telegram services the app talks to.
+
+FakeChannel - builds Telethon-like NewMessage events and feeds them to a
+              handler (normally app.on_new_message) at a given rate and burst
+              shape, one task per event like Telethon's dispatcher.
+FakeBot     - a Bot API sink: records every send_message with its time and
+              simulates latency, flood waits (RetryAfter), transient
+              errors (TimedOut) and blocked chats (Forbidden).
+
+Both are seeded so runs are comparable.
+"""
+import time
+import random
+import asyncio
+from datetime import datetime, timezone
+
+from telegram.error import RetryAfter, Forbidden, TimedOut
+
+SHAPES = ("steady", "poisson", "burst")
+
+
+class FakeEvent:
+    """
+    The slice of a Telethon NewMessage event that process_event() reads.
+    """
+    __slots__ = ("id", "raw_text", "date")
+
+    def __init__(self, msg_id: int, text: str, posted_at: float = None):
+        self.id = msg_id
+        self.raw_text = text
+        self.date = datetime.fromtimestamp(posted_at or time.time(), tz=timezone.utc)
+
+
+class FakeChannel:
+    def __init__(self, handler, rate: float = 5.0, shape: str = "steady", burst: int = 10, seed: int = 3):
+        """
+        handler: async callable(event)
+        rate: average posts/sec
+        shape: steady (evenly spaced), poisson (random gaps) or burst
+               (`burst` posts at once, then a pause keeping the average rate)
+        """
+        if shape not in SHAPES:
+            raise ValueError(f"shape must be one of: {', '.join(SHAPES)}")
+        self.handler = handler
+        self.rate = rate
+        self.shape = shape
+        self.burst = max(1, burst)
+        self.rnd = random.Random(seed)
+        self.injected = {}   # msg_id -> time.monotonic() when handed to the handler
+
+    def _gaps(self, n: int):
+        for i in range(n):
+            if self.shape == "steady":
+                yield 1 / self.rate
+            elif self.shape == "poisson":
+                yield self.rnd.expovariate(self.rate)
+            else:
+                yield self.burst / self.rate if (i + 1) % self.burst == 0 else 0.0
+
+    async def play(self, texts, first_id: int = 1):
+        """
+        Injects one event per text; returns once every handler has finished.
+        """
+        tasks = []
+        for (i, text), gap in zip(enumerate(texts), self._gaps(len(texts))):
+            msg_id = first_id + i
+            self.injected[msg_id] = time.monotonic()
+            tasks.append(asyncio.create_task(self.handler(FakeEvent(msg_id, text))))
+            if gap:
+                await asyncio.sleep(gap)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [r for r in results if isinstance(r, BaseException)]
+
+
+class FakeBot:
+    def __init__(self, latency: float = 0.05, retry_rate: float = 0.0, retry_after: int = 1,
+                 timeout_rate: float = 0.0, blocked_rate: float = 0.0, seed: int = 4):
+        """
+        latency: mean secs per send_message (uniform 0.5x-1.5x)
+        retry_rate / timeout_rate: chance a call raises RetryAfter / TimedOut
+        blocked_rate: share of chats that raise Forbidden (decided once per chat)
+        """
+        self.latency = latency
+        self.retry_rate = retry_rate
+        self.retry_after = retry_after
+        self.timeout_rate = timeout_rate
+        self.blocked_rate = blocked_rate
+        self.rnd = random.Random(seed)
+        self.sent = []        # (time.monotonic(), chat_id, text)
+        self.errors = {}      # exception name -> count
+        self._blocked = {}    # chat_id -> bool
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _error(self, exc: Exception):
+        name = type(exc).__name__
+        self.errors[name] = self.errors.get(name, 0) + 1
+        raise exc
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self.latency * self.rnd.uniform(0.5, 1.5))
+        blocked = self._blocked.get(chat_id)
+        if blocked is None:
+            blocked = self._blocked[chat_id] = self.rnd.random() < self.blocked_rate
+        if blocked:
+            self._error(Forbidden("Forbidden: bot was blocked by the user"))
+        roll = self.rnd.random()
+        if roll < self.retry_rate:
+            self._error(RetryAfter(self.retry_after))
+        if roll < self.retry_rate + self.timeout_rate:
+            self._error(TimedOut())
+        self.sent.append((time.monotonic(), chat_id, text))
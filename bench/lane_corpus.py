@@ -0,0 +1,86 @@
+"""
+Regression check for the incremental lane rollups.
+
+Archives batches of synthetic posts, re-archiving msg_ids at random (edits
+that change the lane, turn a load into chatter or back, or change nothing),
+then recounts lanes from the archive and compares them with lane_days,
+lane_hours and what get_lane_counts() / get_lane_hours() serve.
+
+    python -m bench.lane_corpus [batches]
+"""
+import sys
+import time
+import random
+import asyncio
+from collections import Counter
+
+import db
+from lane_stats import lane_row
+from route_parser import parse_post
+from bench.synth import make_post
+from bench.tempdb import temp_db
+
+
+def recount(archived):
+    days, hours = Counter(), Counter()
+    for _msg_id, posted_at, _text, post in archived:
+        if post is not None:
+            day, hour, o_city, o_state, d_state = lane_row(post, posted_at)
+            days[(day, o_city, o_state, d_state)] += 1
+            hours[(o_city, o_state, d_state, hour)] += 1
+    return days, hours
+
+
+async def rollups():
+    async with db.transaction(write=False) as conn:
+        cur = await conn.execute("SELECT day, o_city, o_state, d_state, posts FROM lane_days")
+        days = {tuple(row[:4]): row[4] for row in await cur.fetchall()}
+        cur = await conn.execute("SELECT o_city, o_state, d_state, hour, posts FROM lane_hours")
+        hours = {tuple(row[:4]): row[4] for row in await cur.fetchall()}
+    # Lanes that lost all their posts keep a 0 row
+    return ({k: n for k, n in days.items() if n}, {k: n for k, n in hours.items() if n},
+            min([0, *days.values(), *hours.values()]))
+
+
+async def run(n_batches: int):
+    rnd = random.Random(18)
+    now = time.time()
+    posted = {}   # msg_id -> posted_at; an edit keeps the post's time
+    async with temp_db("lanes.db"):
+        for _ in range(n_batches):
+            items = []
+            for _ in range(rnd.randint(1, 30)):
+                msg_id = rnd.randint(1, 500)
+                posted_at = posted.setdefault(msg_id, now - rnd.uniform(0, 90 * 86400))
+                text = make_post(rnd)
+                items.append((msg_id, posted_at, text, parse_post(text, msg_id, posted_at)))
+            await db.archive_posts(items)
+
+        archived = await db.get_archived_posts()
+        want_days, want_hours = recount(archived)
+        got_days, got_hours, lowest = await rollups()
+        if lowest < 0:
+            raise AssertionError(f"negative rollup count {lowest}")
+        if got_days != dict(want_days):
+            raise AssertionError(f"lane_days drifted:\n  rollup:  {got_days}\n  archive: {dict(want_days)}")
+        if got_hours != dict(want_hours):
+            raise AssertionError(f"lane_hours drifted:\n  rollup:  {got_hours}\n  archive: {dict(want_hours)}")
+
+        lanes = Counter()
+        for (_day, o_city, o_state, d_state), n in want_days.items():
+            lanes[(o_city, o_state, d_state)] += n
+        if {tuple(row[:3]): row[3] for row in await db.get_lane_counts()} != dict(lanes):
+            raise AssertionError("get_lane_counts() disagrees with the archive")
+        if {tuple(row[:4]): row[4] for row in await db.get_lane_hours()} != dict(want_hours):
+            raise AssertionError("get_lane_hours() disagrees with the archive")
+    return len(archived), sum(want_days.values())
+
+
+def main(argv):
+    n_batches = int(argv[1]) if len(argv) > 1 else 300
+    n_posts, n_loads = asyncio.run(run(n_batches))
+    print(f"ok: {n_batches} batches, {n_posts} archived posts, {n_loads} loads")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
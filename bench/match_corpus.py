@@ -0,0 +1,79 @@
+"""
+Regression check for the compiled SubscriptionIndex matchers.
+
+Builds a user population through the db.py mutation API (adds, removes,
+clears, to_all toggles in random order) and checks db.match_users() against
+the pre-index scan over get_all_configs() for every synthetic post, both as
+mutated incrementally and as recompiled by load_index().
+
+    python -m bench.match_corpus [users] [mutations]
+"""
+import sys
+import random
+import asyncio
+
+import db
+from route_parser import parse_post
+from bench.run import _legacy_match
+from bench.synth import CITIES, STATES, make_posts
+from bench.tempdb import temp_db
+
+
+async def mutate(rnd: random.Random, user_id: int):
+    city, st = rnd.choice(CITIES)
+    state = rnd.choice(STATES)
+    op = rnd.randrange(12)
+    if op < 3:
+        await db.add_origin_point(user_id, city, st)
+    elif op < 5:
+        await db.add_origin_state(user_id, state)
+    elif op < 8:
+        await db.add_destination_state(user_id, state)
+    elif op == 8:
+        await db.remove_origin_state(user_id, state)
+    elif op == 9:
+        await db.remove_destination_state(user_id, state)
+    elif op == 10:
+        await db.toggle_to_all(user_id)
+    elif rnd.random() < 0.5:
+        await db.clear_origins(user_id)
+    else:
+        await db.clear_destination_states(user_id)
+
+
+def check(keys, configs, label: str):
+    for key in keys:
+        got = sorted(db.match_users(*key))
+        want = sorted(_legacy_match(configs, *key))
+        if got != want:
+            raise AssertionError(f"{label}: mismatch for {key}:\n  index: {got}\n  scan:  {want}")
+
+
+async def run(n_users: int, n_mutations: int):
+    rnd = random.Random(15)
+    keys = []
+    for text in make_posts(2000, seed=15):
+        post = parse_post(text)
+        if post is not None:
+            (o_city, o_state), (_d, d_state) = post.origin, post.destination
+            keys.append((o_city, o_state, d_state))
+
+    async with temp_db("match.db"):
+        for _ in range(n_mutations):
+            await mutate(rnd, 1_000_000 + rnd.randrange(n_users))
+        configs = await db.get_all_configs()
+        check(keys, configs, "incremental")
+        await db.load_index()
+        check(keys, configs, "load_index")
+    return len(keys), len(configs)
+
+
+def main(argv):
+    n_users = int(argv[1]) if len(argv) > 1 else 300
+    n_mutations = int(argv[2]) if len(argv) > 2 else 3000
+    n_keys, n_configs = asyncio.run(run(n_users, n_mutations))
+    print(f"ok: {n_keys} posts x {n_configs} users, {n_mutations} mutations")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,104 @@
+"""
+Regression check for the schema migrations.
+
+Copies a legacy DB (the repo's unversioned prefs.db by default, never
+modified) to a temp dir, runs init_db() on it and checks that it ends at
+the latest user_version with the same tables, columns and indexes as a
+fresh DB, that its users' user_config rows survive, that a second
+init_db() is a no-op, and that a DB newer than this build is refused.
+
+    python -m bench.migrate_corpus [legacy.db]
+"""
+import os
+import sys
+import sqlite3
+import asyncio
+
+import db
+from bench.tempdb import temp_db
+
+LEGACY_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prefs.db")
+
+
+def _connect(path: str):
+    return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+
+def schema(path: str):
+    """
+    (user_version, {name: (type, normalized sql, columns)}) of a DB file.
+    """
+    conn = _connect(path)
+    try:
+        (version,) = conn.execute("PRAGMA user_version").fetchone()
+        objects = {}
+        for kind, name, sql in conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE name NOT LIKE 'sqlite_%'"
+        ):
+            columns = ()
+            if kind == "table":
+                columns = tuple(sorted(
+                    (col[1], col[2], col[3], col[5])   # name, type, notnull, pk
+                    for col in conn.execute(f"PRAGMA table_info({name})")
+                ))
+            objects[name] = (kind, " ".join((sql or "").split()), columns)
+        return version, objects
+    finally:
+        conn.close()
+
+
+def user_rows(path: str):
+    conn = _connect(path)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE name='user_config'").fetchone():
+            return set()
+        return set(conn.execute("SELECT user_id, to_all FROM user_config"))
+    finally:
+        conn.close()
+
+
+async def run(legacy: str):
+    latest = len(db.MIGRATIONS)
+    async with temp_db("fresh.db") as fresh:
+        want_version, want = schema(fresh)
+    if want_version != latest:
+        raise AssertionError(f"fresh DB at v{want_version}, expected v{latest}")
+
+    before, _ = schema(legacy)
+    users = user_rows(legacy)
+    async with temp_db("legacy.db", source=legacy) as path:
+        version, got = schema(path)
+        if version != latest:
+            raise AssertionError(f"{legacy} migrated to v{version}, expected v{latest}")
+        for name, obj in want.items():
+            if got.get(name) != obj:
+                raise AssertionError(f"{name} differs from a fresh DB:\n  migrated: {got.get(name)}\n  fresh:    {obj}")
+        if not users <= user_rows(path):
+            raise AssertionError(f"user_config rows lost: {users - user_rows(path)}")
+
+        await db.init_db()
+        if schema(path) != (version, got):
+            raise AssertionError("second init_db() changed the schema")
+
+        conn = sqlite3.connect(path)
+        conn.execute(f"PRAGMA user_version = {latest + 1}")
+        conn.commit()
+        conn.close()
+        await db.close_db()
+        try:
+            await db.init_db()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError(f"init_db() accepted a v{latest + 1} DB")
+    return before, latest, len(users)
+
+
+def main(argv):
+    legacy = argv[1] if len(argv) > 1 else LEGACY_DB
+    before, latest, n_users = asyncio.run(run(legacy))
+    print(f"ok: {os.path.basename(legacy)} v{before} -> v{latest}, {n_users} users kept")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,36 @@
+"""
+Micro-benchmark: route_parser vs the original LOC_RE + parse_stops.
+
+    python -m bench.parse_bench [iterations]
+"""
+import sys
+import json
+import timeit
+
+from route_parser import parse_stops, parse_post
+from bench.parse_corpus import CORPUS, legacy_stops
+
+
+def legacy_parse_stops(text: str):
+    locs = legacy_stops(text)
+    return locs if len(locs) >= 2 else []
+
+
+def main(argv):
+    number = int(argv[1]) if len(argv) > 1 else 2000
+    posts = [t for t in CORPUS if t] * 5
+
+    def run(fn):
+        secs = min(timeit.repeat(lambda: [fn(t) for t in posts], number=number, repeat=3))
+        return round(secs / (number * len(posts)) * 1e6, 3)  # µs per post
+
+    print(json.dumps({
+        "posts": len(posts),
+        "legacy_regex_us": run(legacy_parse_stops),
+        "parse_stops_us": run(parse_stops),
+        "parse_post_us": run(parse_post),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
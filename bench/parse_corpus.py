@@ -0,0 +1,87 @@
+"""
+Regression + fuzz corpus for route_parser.
+
+Checks scan_stops() against the original LOC_RE on hand-picked posts and on
+randomly mutated ones, so the single-pass parser never drifts from the regex
+the channel filters were written against.
+
+    python -m bench.parse_corpus [fuzz_iterations]
+"""
+import re
+import sys
+import random
+
+from route_parser import scan_stops, parse_post
+
+# The regex route_parser replaced (app.py / listener_basic.py)
+LEGACY_LOC_RE = re.compile(r"📍\s*([A-Z][A-Z\s\.\'-]+?),\s*([A-Z]{2})")
+
+
+def legacy_stops(text: str):
+    return [(c.strip().upper(), s.strip().upper()) for c, s in LEGACY_LOC_RE.findall(text or "")]
+
+
+CORPUS = [
+    "",
+    "no pins here",
+    "📍 LOUISVILLE, KY\n📍 DENVER, CO",
+    "🔥 LIVE BID\n📍 CINCINNATI, OH\n📍 INDIANAPOLIS, IN\n📍 ST. LOUIS, MO\n🛣 612 mi\n🗓 02/14 08:00",
+    "📍ST LOUIS,MO📍 FT WORTH , TX",
+    "📍 O'FALLON, MO\n📍 WINSTON-SALEM, NC",
+    "📍 COEUR D'ALENE, ID\n📍 SALT LAKE CITY, UT\n📍 LAS VEGAS, NV",
+    "📍 Louisville, KY\n📍 DENVER, CO",           # lowercase city: not a stop
+    "📍 X, KY\n📍 DENVER, CO",                    # 1-char city: not a stop
+    "📍 LOUISVILLE, Ky\n📍 DENVER, CO",           # lowercase state: not a stop
+    "📍 LOUISVILLE KY\n📍 DENVER, CO",            # missing comma
+    "📍 NEW\nYORK, NY\n📍 NEWARK, NJ",            # whitespace (newline) inside city
+    "📍 DENVER, COLORADO\n📍 MIAMI, FL 33101",    # state is first 2 letters
+    "📍📍 DALLAS, TX\n📍 HOUSTON, TX",
+    "📍 DALLAS,\n  TX 📍 HOUSTON,TX",
+    "📍 WILKES-BARRE, PA\n📍 SCRANTON, PA\n📍",
+    "📍 SAN JUAN, PR\n📍 LOS ANGELES, CA\n53' Trailer 1,240 miles 3/5/2026",
+    "📍 A.B, CD📍 EF, GH",
+    "📍  \t  BOISE  , ID\n📍 SPOKANE,\tWA",
+    "prefix 📍 TOLEDO, OH, suffix 📍 AKRON, OH",
+]
+
+_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ abc.,'-\n\t0123456789📍"
+
+
+def fuzz_cases(n: int, seed: int = 1234):
+    rnd = random.Random(seed)
+    for _ in range(n):
+        base = list(rnd.choice(CORPUS))
+        for _ in range(rnd.randint(1, 8)):
+            op = rnd.random()
+            pos = rnd.randint(0, len(base))
+            if op < 0.4:
+                base.insert(pos, rnd.choice(_ALPHABET))
+            elif op < 0.7 and base:
+                del base[min(pos, len(base) - 1)]
+            elif base:
+                base[min(pos, len(base) - 1)] = rnd.choice(_ALPHABET)
+        yield "".join(base)
+
+
+def check(text: str):
+    got = scan_stops(text)
+    want = legacy_stops(text)
+    if got != want:
+        raise AssertionError(f"mismatch for {text!r}:\n  parser: {got}\n  regex:  {want}")
+
+    post = parse_post(text)
+    if (post is None) != (len(want) < 2):
+        raise AssertionError(f"parse_post/2-stop rule mismatch for {text!r}")
+
+
+def main(argv):
+    iterations = int(argv[1]) if len(argv) > 1 else 20000
+    for text in CORPUS:
+        check(text)
+    for text in fuzz_cases(iterations):
+        check(text)
+    print(f"ok: {len(CORPUS)} corpus posts, {iterations} fuzz cases")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,206 @@
+"""
+Hot-path benchmarks: parse, match, DB reads and DB mutations.
+
+Each population size gets a fresh temp DB. Results are printed (or written
+with --out) as JSON so runs can be diffed over time.
+
+    python -m bench.run
+    python -m bench.run --sizes 10,1000 --posts 500 --out bench_output.json
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+import statistics
+
+import db
+from route_parser import parse_stops, parse_post
+from bench.synth import make_posts, make_users
+
+
+def _summary(samples_s):
+    us = sorted(s * 1e6 for s in samples_s)
+    return {
+        "n": len(us),
+        "mean_us": round(statistics.fmean(us), 2),
+        "p50_us": round(us[len(us) // 2], 2),
+        "p95_us": round(us[min(len(us) - 1, int(len(us) * 0.95))], 2),
+        "max_us": round(us[-1], 2),
+    }
+
+
+def time_sync(fn, items):
+    samples = []
+    for item in items:
+        t = time.perf_counter()
+        fn(item)
+        samples.append(time.perf_counter() - t)
+    return _summary(samples)
+
+
+async def time_async(fn, items):
+    samples = []
+    for item in items:
+        t = time.perf_counter()
+        await fn(item)
+        samples.append(time.perf_counter() - t)
+    return _summary(samples)
+
+
+# ---------- Scenarios ----------
+def bench_parse(posts):
+    return {
+        "parse_stops": time_sync(parse_stops, posts),
+        "parse_post": time_sync(parse_post, posts),
+    }
+
+
+def _legacy_match(configs, o_city, o_state, d_state):
+    # The pre-index on_new_message loop, kept as the baseline
+    out = []
+    for cfg in configs:
+        origin_ok = ((o_city, o_state) in cfg["origin_points"]) or (o_state in cfg["origin_states"])
+        if not origin_ok:
+            continue
+        if cfg["to_all"] or (d_state in cfg["destination_states"]):
+            out.append(cfg["user_id"])
+    return out
+
+
+def bench_match(posts, configs):
+    keys = []
+    for text in posts:
+        post = parse_post(text)
+        if post is not None:
+            (o_city, o_state), (_d, d_state) = post.origin, post.destination
+            keys.append((o_city, o_state, d_state))
+
+    hits = sum(len(db.match_users(*k)) for k in keys)
+    return {
+        "matches_per_post": round(hits / max(1, len(keys)), 2),
+        "index_match": time_sync(lambda k: db.match_users(*k), keys),
+        "legacy_loop": time_sync(lambda k: _legacy_match(configs, *k), keys),
+    }
+
+
+async def populate(users):
+    async with db.transaction() as conn:
+        await conn.executemany(
+            "INSERT INTO user_config (user_id, to_all) VALUES (?, ?)",
+            [(u["user_id"], int(u["to_all"])) for u in users],
+        )
+        points = [(u["user_id"], c, s) for u in users for c, s in u["origin_points"]]
+        await conn.executemany(
+            "INSERT OR IGNORE INTO cities (city, state) VALUES (?, ?)",
+            sorted({(c, s) for _u, c, s in points}),
+        )
+        await conn.executemany(
+            "INSERT INTO user_origin_points (user_id, city_id) "
+            "VALUES (?, (SELECT id FROM cities WHERE city=? AND state=?))",
+            points,
+        )
+        await conn.executemany(
+            "INSERT INTO user_origin_states (user_id, state) VALUES (?, ?)",
+            [(u["user_id"], s) for u in users for s in u["origin_states"]],
+        )
+        await conn.executemany(
+            "INSERT INTO user_destination_states (user_id, state) VALUES (?, ?)",
+            [(u["user_id"], s) for u in users for s in u["destination_states"]],
+        )
+    await db.load_index()
+
+
+async def bench_db(users, rounds: int):
+    sample = [u["user_id"] for u in users[:rounds]] or [1]
+    sample = (sample * (rounds // len(sample) + 1))[:rounds]
+
+    async def mutate(uid):
+        await db.add_origin_state(uid, "ZZ")
+        await db.add_origin_point(uid, "BENCH CITY", "ZZ")
+        await db.add_destination_state(uid, "ZZ")
+        await db.clear_origins(uid)
+        await db.clear_destination_states(uid)
+
+    t = time.perf_counter()
+    await db.load_index()
+    load_index_ms = round((time.perf_counter() - t) * 1000, 2)
+
+    return {
+        "get_all_configs": await time_async(lambda _: db.get_all_configs(), range(max(3, rounds // 20))),
+        "load_index_ms": load_index_ms,
+        "get_user_view": await time_async(db.get_user_view, sample),
+        "mutate_add_clear_x5": await time_async(mutate, sample),
+    }
+
+
+async def bench_population(size: int, posts, rounds: int):
+    users = make_users(size)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.DB_PATH = os.path.join(tmp, "bench.db")
+        await db.init_db()
+        try:
+            t = time.perf_counter()
+            await populate(users)
+            populate_ms = round((time.perf_counter() - t) * 1000, 2)
+
+            configs = await db.get_all_configs()
+            return {
+                "users": size,
+                "populate_ms": populate_ms,
+                "match": bench_match(posts, configs),
+                "db": await bench_db(users, rounds),
+            }
+        finally:
+            await db.close_db()
+
+
+def _git_rev():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+
+async def run(sizes, n_posts: int, rounds: int):
+    posts = make_posts(n_posts)
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "posts": n_posts,
+            "rounds": rounds,
+        },
+        "parse": bench_parse(posts),
+        "populations": [],
+    }
+    for size in sizes:
+        results["populations"].append(await bench_population(size, posts, rounds))
+    return results
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="Benchmark parse/match/DB hot paths.")
+    p.add_argument("--sizes", default="10,1000,50000", help="comma-separated user counts")
+    p.add_argument("--posts", type=int, default=2000)
+    p.add_argument("--rounds", type=int, default=200, help="DB calls timed per scenario")
+    p.add_argument("--out", help="write JSON here instead of stdout")
+    args = p.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(",") if x.strip()]
+    results = asyncio.run(run(sizes, args.posts, args.rounds))
+    payload = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
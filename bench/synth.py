@@ -0,0 +1,109 @@
+"""
+Synthetic Live Bid posts and user populations for benchmarks.
+
+Everything is driven by a seeded random.Random so runs are comparable.
+"""
+import random
+
+# (CITY, ST) pool, including the punctuation the channel actually uses
+CITIES = [
+    ("LOUISVILLE", "KY"), ("LEXINGTON", "KY"), ("CINCINNATI", "OH"), ("COLUMBUS", "OH"),
+    ("CLEVELAND", "OH"), ("TOLEDO", "OH"), ("INDIANAPOLIS", "IN"), ("FORT WAYNE", "IN"),
+    ("CHICAGO", "IL"), ("CAROL STREAM", "IL"), ("ST. LOUIS", "MO"), ("O'FALLON", "MO"),
+    ("KANSAS CITY", "MO"), ("DENVER", "CO"), ("COLORADO SPRINGS", "CO"), ("DALLAS", "TX"),
+    ("FT. WORTH", "TX"), ("HOUSTON", "TX"), ("SAN ANTONIO", "TX"), ("EL PASO", "TX"),
+    ("ATLANTA", "GA"), ("JACKSONVILLE", "FL"), ("ORLANDO", "FL"), ("MIAMI", "FL"),
+    ("CHARLOTTE", "NC"), ("WINSTON-SALEM", "NC"), ("GREENSBORO", "NC"), ("NASHVILLE", "TN"),
+    ("MEMPHIS", "TN"), ("KNOXVILLE", "TN"), ("BIRMINGHAM", "AL"), ("LITTLE ROCK", "AR"),
+    ("OKLAHOMA CITY", "OK"), ("TULSA", "OK"), ("PHOENIX", "AZ"), ("TUCSON", "AZ"),
+    ("LAS VEGAS", "NV"), ("RENO", "NV"), ("SALT LAKE CITY", "UT"), ("BOISE", "ID"),
+    ("COEUR D'ALENE", "ID"), ("SPOKANE", "WA"), ("SEATTLE", "WA"), ("PORTLAND", "OR"),
+    ("SACRAMENTO", "CA"), ("LOS ANGELES", "CA"), ("SAN DIEGO", "CA"), ("MINNEAPOLIS", "MN"),
+    ("EAGAN", "MN"), ("DES MOINES", "IA"), ("OMAHA", "NE"), ("MILWAUKEE", "WI"),
+    ("DETROIT", "MI"), ("GRAND RAPIDS", "MI"), ("PITTSBURGH", "PA"), ("WILKES-BARRE", "PA"),
+    ("PHILADELPHIA", "PA"), ("NEWARK", "NJ"), ("KEARNY", "NJ"), ("BALTIMORE", "MD"),
+    ("RICHMOND", "VA"), ("NORFOLK", "VA"), ("ALBANY", "NY"), ("BUFFALO", "NY"),
+    ("SPRINGFIELD", "MA"), ("HARTFORD", "CT"), ("PORTLAND", "ME"), ("ALBUQUERQUE", "NM"),
+    ("BILLINGS", "MT"), ("FARGO", "ND"), ("SIOUX FALLS", "SD"), ("CHEYENNE", "WY"),
+    ("JACKSON", "MS"), ("NEW ORLEANS", "LA"), ("SHREVEPORT", "LA"), ("COLUMBIA", "SC"),
+    ("CHARLESTON", "WV"), ("WICHITA", "KS"),
+]
+
+STATES = sorted({st for _c, st in CITIES})
+
+_HEADERS = ["🔥 LIVE BID", "🚨 NEW LOAD", "⚡️ HOT ROUTE", "LIVE BID ✅", ""]
+_EQUIPMENT = ["53' Trailer", "53 ft Dry Van", "26' Box Truck", "Tractor only", "Reefer"]
+_NOISE = [
+    "Bid fast!", "Team required", "Hazmat: NO", "Drop & hook", "Call dispatch for details",
+    "Rate: DM", "‼️ Urgent ‼️", "Live load / live unload", "#usps #livebid",
+]
+
+
+def _stop_line(rnd: random.Random, city: str, st: str) -> str:
+    # Spacing variations the parser has to cope with
+    sep = rnd.choice([", ", ",", " , ", ",  "])
+    lead = rnd.choice(["📍 ", "📍", "📍  "])
+    return f"{lead}{city}{sep}{st}"
+
+
+def make_post(rnd: random.Random) -> str:
+    """
+    One Live Bid style post: header, 2-6 📍 stops, optional miles/dates/equipment
+    and some noise. ~5% of posts are chatter with no route.
+    """
+    if rnd.random() < 0.05:
+        return rnd.choice(_NOISE) + "\n" + rnd.choice(_NOISE)
+
+    lines = []
+    header = rnd.choice(_HEADERS)
+    if header:
+        lines.append(header)
+
+    for city, st in rnd.sample(CITIES, rnd.randint(2, 6)):
+        lines.append(_stop_line(rnd, city, st))
+
+    if rnd.random() < 0.8:
+        lines.append(f"🛣 {rnd.randint(80, 2800):,} mi")
+    if rnd.random() < 0.7:
+        lines.append(f"🗓 {rnd.randint(1, 12)}/{rnd.randint(1, 28)} {rnd.randint(0, 23):02d}:00")
+    if rnd.random() < 0.6:
+        lines.append(f"🚚 {rnd.choice(_EQUIPMENT)}")
+    for _ in range(rnd.randint(0, 3)):
+        lines.append(rnd.choice(_NOISE))
+    return "\n".join(lines)
+
+
+def make_posts(n: int, seed: int = 1):
+    rnd = random.Random(seed)
+    return [make_post(rnd) for _ in range(n)]
+
+
+def make_users(n: int, seed: int = 2):
+    """
+    Returns n user configs shaped like db.get_all_configs() rows:
+    mixed origin points, origin states, destination states and to_all.
+    """
+    rnd = random.Random(seed)
+    users = []
+    for i in range(n):
+        points = set()
+        states = set()
+        kind = rnd.random()
+        if kind < 0.4:
+            points = set(rnd.sample(CITIES, rnd.randint(1, 4)))
+        elif kind < 0.8:
+            states = set(rnd.sample(STATES, rnd.randint(1, 3)))
+        else:
+            points = set(rnd.sample(CITIES, rnd.randint(1, 2)))
+            states = set(rnd.sample(STATES, rnd.randint(1, 2)))
+
+        to_all = rnd.random() < 0.3
+        dest = set() if to_all else set(rnd.sample(STATES, rnd.randint(1, 6)))
+        users.append({
+            "user_id": 1_000_000 + i,
+            "to_all": to_all,
+            "origin_points": points,
+            "origin_states": states,
+            "destination_states": dest,
+        })
+    return users
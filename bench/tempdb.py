@@ -0,0 +1,27 @@
+"""
+Throwaway databases for the regression checks.
+"""
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+
+import db
+
+
+@asynccontextmanager
+async def temp_db(name: str = "check.db", source: str = None):
+    """
+    Points db.py at a new DB (or a copy of `source`) in a temp dir, runs
+    init_db() and yields its path; closes it and removes the dir on exit.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, name)
+        if source is not None:
+            shutil.copyfile(source, path)
+        db.DB_PATH = path
+        await db.init_db()
+        try:
+            yield path
+        finally:
+            await db.close_db()
@@ -0,0 +1,93 @@
+"""
+Regression check for the write-through view cache.
+
+Runs random db.py mutations (every rule kind, delivery, filters) and after
+each one checks that the view it returned, and the cached view, equal a
+fresh read from the DB. The cache is dropped now and then so both the
+cache-hit and cache-miss write paths are covered.
+
+    python -m bench.view_corpus [mutations]
+"""
+import sys
+import random
+import asyncio
+
+import db
+from post_filters import FILTER_KINDS, parse_filter_arg
+from bench.synth import CITIES, STATES
+from bench.tempdb import temp_db
+
+_FILTERS = ["miles 300-900", "miles 500+", "days 2", "equipment reefer", "keyword hazmat", "exclude team"]
+_LANES = ["OH>*>CO", "KY>TX", "*>IL>*>CA"]
+
+
+async def mutate(rnd: random.Random, user_id: int):
+    city, st = rnd.choice(CITIES)
+    state = rnd.choice(STATES)
+    op = rnd.randrange(20)
+    if op == 0:
+        return await db.add_origin_point(user_id, city, st)
+    if op == 1:
+        return await db.remove_origin_point(user_id, city, st)
+    if op == 2:
+        return await db.clear_origin_points(user_id)
+    if op == 3:
+        return await db.add_origin_state(user_id, state)
+    if op == 4:
+        return await db.remove_origin_state(user_id, state)
+    if op == 5:
+        return await db.clear_origin_states(user_id)
+    if op == 6:
+        return await db.add_origin_radius(user_id, "LOUISVILLE", "KY", rnd.randint(1, 250))
+    if op == 7:
+        return await db.remove_origin_radius(user_id, "LOUISVILLE", "KY")
+    if op == 8:
+        return await db.clear_origins(user_id)
+    if op == 9:
+        return await db.toggle_to_all(user_id)
+    if op == 10:
+        return await db.set_to_all(user_id, rnd.random() < 0.5)
+    if op == 11:
+        return await db.add_destination_state(user_id, state)
+    if op == 12:
+        return await db.remove_destination_state(user_id, state)
+    if op == 13:
+        return await db.clear_destination_states(user_id)
+    if op == 14:
+        kind, key = rnd.choice([("via", state), ("stop", (city, st)), ("lane", rnd.choice(_LANES))])
+        return await db.add_route_rule(user_id, kind, key)
+    if op == 15:
+        return await db.remove_route_rule(user_id, "via", state)
+    if op == 16:
+        return await db.clear_route_rules(user_id)
+    if op == 17:
+        return await db.add_filter_rules(user_id, parse_filter_arg(rnd.choice(_FILTERS)))
+    if op == 18:
+        return await db.remove_filter_rules(user_id, [rnd.choice(FILTER_KINDS)])
+    return await db.set_delivery(user_id, rnd.choice(["instant", "digest", "first"]), rnd.choice([60, 300]))
+
+
+async def run(n_mutations: int):
+    rnd = random.Random(16)
+    async with temp_db("views.db"):
+        for i in range(n_mutations):
+            user_id = rnd.randint(1, 8)
+            if rnd.random() < 0.05:
+                db._VIEWS.clear()
+            view = await mutate(rnd, user_id)
+            async with db.transaction(write=False) as conn:
+                fresh = await db._read_user_view(conn, user_id)
+            if view != fresh or db._VIEWS.get(user_id, fresh) != fresh:
+                raise AssertionError(f"mutation {i} (user {user_id}):\n  view:  {view}\n  fresh: {fresh}")
+            if await db.get_user_view(user_id) != fresh:
+                raise AssertionError(f"mutation {i} (user {user_id}): get_user_view() is stale")
+
+
+def main(argv):
+    n_mutations = int(argv[1]) if len(argv) > 1 else 2000
+    asyncio.run(run(n_mutations))
+    print(f"ok: {n_mutations} mutations")
+
+
+if __name__ == "__main__":
+    main(sys.argv)
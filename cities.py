@@ -0,0 +1,75 @@
+"""
+City name canonicalization.
+
+The channel and users spell the same city several ways ("ST. LOUIS",
+"St Louis", "SAINT LOUIS", "STL"); rules only match if both sides agree, so
+every (city, ST) is resolved to ONE canonical (CITY, ST) before it is
+stored, indexed or matched:
+
+  1. city_key(): upper-case, "." and "-" to spaces, whitespace collapsed,
+     then token rules: ST/STE/FT/MT anywhere -> SAINT/SAINTE/FORT/MOUNT,
+     and a leading N/S/E/W (with more words after it) -> NORTH/SOUTH/EAST/WEST.
+  2. The bundled alias table (city_aliases.csv: alias, state, city) maps
+     established short forms to the real name, per state, via one dict hit.
+     Ambiguous abbreviations live there too, never in the token rules:
+     "PT" is PORT in PT ARTHUR, TX but POINT in PT PLEASANT, WV.
+
+Raw spellings seen recently are memoized, so a stop the channel has used
+before costs a single dict lookup; a new one is O(length of the name).
+"""
+import os
+import csv
+
+CITY_ALIASES_PATH = os.getenv(
+    "CITY_ALIASES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "city_aliases.csv")
+)
+CANON_MEMO_SIZE = 50000
+
+_TOKENS = {"ST": "SAINT", "STE": "SAINTE", "FT": "FORT", "MT": "MOUNT"}
+_LEADING = {"N": "NORTH", "S": "SOUTH", "E": "EAST", "W": "WEST"}
+_PUNCT = str.maketrans({".": " ", "-": " ", "’": "'"})
+
+
+def city_key(city: str) -> str:
+    """
+    "St. Louis" / "ST LOUIS" / "SAINT  LOUIS" -> "SAINT LOUIS".
+    """
+    words = city.upper().translate(_PUNCT).split()
+    if len(words) > 1 and words[0] in _LEADING:
+        words[0] = _LEADING[words[0]]
+    return " ".join(_TOKENS.get(w, w) for w in words)
+
+
+class CityCanon:
+    def __init__(self, aliases=()):
+        """
+        aliases: (alias, ST, city); both names go through city_key().
+        """
+        self._aliases = {}   # (city_key, ST) -> canonical city
+        self._memo = {}      # raw (city, ST) -> canonical (CITY, ST)
+        for alias, st, city in aliases:
+            self._aliases[(city_key(alias), st.strip().upper())] = city_key(city)
+
+    @classmethod
+    def load(cls, path: str = CITY_ALIASES_PATH):
+        with open(path, newline="", encoding="utf-8") as f:
+            return cls((r["alias"], r["state"], r["city"]) for r in csv.DictReader(f))
+
+    def canonical(self, city: str, st: str):
+        """
+        Canonical (CITY, ST) for a city as typed or posted; st must already
+        be upper-case.
+        """
+        raw = (city, st)
+        hit = self._memo.get(raw)
+        if hit is not None:
+            return hit
+        key = city_key(city)
+        hit = (self._aliases.get((key, st), key), st)
+        if len(self._memo) >= CANON_MEMO_SIZE:
+            del self._memo[next(iter(self._memo))]
+        self._memo[raw] = hit
+        return hit
+
+
+CANON = CityCanon.load()
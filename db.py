@@ -1,211 +1,1159 @@
 import os
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+
 import aiosqlite
 
+from sub_index import SubscriptionIndex
+from geo import GAZETTEER, RADIUS_MAX_MILES
+from cities import CANON
+from routes import parse_lane
+from post_filters import merge_filters, replaced_kinds
+from digest import DELIVERY_MODES, DIGEST_SECS_DEFAULT, DIGEST_SECS_MIN, DIGEST_SECS_MAX
+from route_parser import LoadPost
+from lane_stats import lane_row
+from latency import STAGES, bucket, hour_of
+from metrics import timed_db
+
 DB_PATH = os.getenv("DB_PATH", "/data/prefs.db")
 
+# Resident origin -> users index, kept in sync by the mutations below
+SUB_INDEX = SubscriptionIndex()
+
+# user_id -> view dict (see get_user_view), written through by the same
+# mutations. Views are replaced, never mutated in place.
+_VIEWS = {}
+
+# One long-lived connection (one aiosqlite worker thread) for the whole process.
+# Opened by init_db(), closed by close_db().
+_conn = None
+_lock = asyncio.Lock()
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",       # readers never block the writer
+    "PRAGMA synchronous=NORMAL",     # fsync on checkpoint, not on every commit (safe with WAL)
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-8000",       # ~8 MB page cache
+)
+
+# config_changes rows kept; a reader further behind than this reloads everything
+CONFIG_CHANGES_KEEP = 10000
 
-def norm_city(city: str) -> str:
-    return city.strip().upper()
+
+def norm_city(city: str, st: str) -> str:
+    """
+    Canonical spelling of a city in (normalized) state st; see cities.py.
+    """
+    return CANON.canonical(city, st)[0]
 
 
 def norm_state(st: str) -> str:
     return st.strip().upper()
 
 
+# ---------- Connection ----------
+@timed_db
 async def init_db():
-    async with aiosqlite.connect(DB_PATH) as db:
-        # Keep user_config minimal. (If your old DB already has from_scope, that's fine; we just ignore it.)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_config (
-            user_id INTEGER PRIMARY KEY,
-            to_all INTEGER NOT NULL DEFAULT 0
-        )
-        """)
+    global _conn
+    if _conn is None:
+        # isolation_level=None: we issue BEGIN/COMMIT ourselves in transaction()
+        _conn = await aiosqlite.connect(DB_PATH, isolation_level=None)
+        for pragma in PRAGMAS:
+            await _conn.execute(pragma)
 
-        # Origin points by exact city+state
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_origin_points (
-            user_id INTEGER NOT NULL,
-            city TEXT NOT NULL,
-            state TEXT NOT NULL,
-            PRIMARY KEY (user_id, city, state)
-        )
-        """)
+    try:
+        await _migrate()
+        await load_index()
+    except BaseException:
+        # The worker thread would otherwise keep the failed process alive
+        await close_db()
+        raise
 
-        # Origin states (match if FIRST stop state is in this list)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_origin_states (
-            user_id INTEGER NOT NULL,
-            state TEXT NOT NULL,
-            PRIMARY KEY (user_id, state)
-        )
-        """)
 
-        # Destination state list (used only if to_all=0)
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_destination_states (
-            user_id INTEGER NOT NULL,
-            state TEXT NOT NULL,
-            PRIMARY KEY (user_id, state)
-        )
-        """)
+@timed_db
+async def close_db():
+    global _conn
+    if _conn is not None:
+        await _conn.close()
+        _conn = None
+
 
-        await db.commit()
+@asynccontextmanager
+async def transaction(write: bool = True):
+    """
+    Runs the block as ONE transaction on the shared connection:
+    a single commit (and a single WAL append) no matter how many statements.
+    Also used (write=False) for multi-SELECT reads so they see one snapshot.
+    """
+    if _conn is None:
+        raise RuntimeError("init_db() has not been called")
+    async with _lock:
+        await _conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield _conn
+        except BaseException:
+            await _conn.rollback()
+            raise
+        else:
+            await _conn.commit()
 
 
+@asynccontextmanager
+async def user_transaction(user_id: int, changed: bool = True):
+    """
+    Unit of work for one user interaction: ensure_user + mutation + view read
+    all share one transaction.
+    changed: the block edits the user's rules; logged to config_changes.
+    """
+    async with transaction() as db:
+        await _ensure_user(db, user_id)
+        yield db
+        if changed:
+            await db.execute("INSERT INTO config_changes (user_id) VALUES (?)", (user_id,))
+            await db.execute(
+                "DELETE FROM config_changes WHERE seq <= last_insert_rowid() - ?",
+                (CONFIG_CHANGES_KEEP,),
+            )
+
+
+async def _ensure_user(db, user_id: int):
+    await db.execute(
+        "INSERT OR IGNORE INTO user_config (user_id, to_all) VALUES (?, 0)",
+        (user_id,),
+    )
+
+
+@timed_db
 async def ensure_user(user_id: int):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with transaction() as db:
+        await _ensure_user(db, user_id)
+
+
+# ---------- Schema migrations ----------
+async def _migrate():
+    """
+    Applies every MIGRATIONS step newer than the DB's PRAGMA user_version,
+    each in its own transaction together with the version bump, so a failed
+    step leaves the DB at the previous version. The version is re-read under
+    the write lock, so processes starting together migrate only once.
+    """
+    for version, step in enumerate(MIGRATIONS, 1):
+        async with transaction() as db:
+            cur = await db.execute("PRAGMA user_version")
+            (current,) = await cur.fetchone()
+            if current > len(MIGRATIONS):
+                raise RuntimeError(f"DB schema v{current} is newer than this build (v{len(MIGRATIONS)})")
+            if current >= version:
+                continue
+            await step(db)
+            await db.execute(f"PRAGMA user_version = {version}")
+
+
+async def _schema_v1(db):
+    """
+    Baseline: every table as of the first versioned schema. Written with
+    IF NOT EXISTS / _add_column, so it also brings unversioned DBs of any
+    age up to date.
+    """
+    # Keep user_config minimal. (Unversioned DBs may still have from_scope;
+    # _schema_v2 drops it.)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_config (
+        user_id INTEGER PRIMARY KEY,
+        to_all INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    # Alert delivery policy (see digest.py): instant | digest | first
+    await _add_column(db, "user_config", "delivery", "TEXT NOT NULL DEFAULT 'instant'")
+    await _add_column(db, "user_config", "digest_secs", f"INTEGER NOT NULL DEFAULT {DIGEST_SECS_DEFAULT}")
+
+    # Origin points by exact city+state
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_origin_points (
+        user_id INTEGER NOT NULL,
+        city TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (user_id, city, state)
+    )
+    """)
+
+    # Origin states (match if FIRST stop state is in this list)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_origin_states (
+        user_id INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (user_id, state)
+    )
+    """)
+
+    # Radius origins: match if FIRST stop is within miles of this city
+    # (city/state as named in the gazetteer, see geo.py)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_origin_radius (
+        user_id INTEGER NOT NULL,
+        city TEXT NOT NULL,
+        state TEXT NOT NULL,
+        miles INTEGER NOT NULL,
+        PRIMARY KEY (user_id, city, state)
+    )
+    """)
+
+    # Destination state list (used only if to_all=0)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_destination_states (
+        user_id INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (user_id, state)
+    )
+    """)
+
+    # Route rules, matched on EVERY stop (see routes.py):
+    #   via ST, stop CITY+ST, lane pattern over stop states ("OH>*>CO")
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_via_states (
+        user_id INTEGER NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (user_id, state)
+    )
+    """)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_stop_points (
+        user_id INTEGER NOT NULL,
+        city TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (user_id, city, state)
+    )
+    """)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_lanes (
+        user_id INTEGER NOT NULL,
+        pattern TEXT NOT NULL,
+        PRIMARY KEY (user_id, pattern)
+    )
+    """)
+
+    # Alert outbox: one row per (post, user) to deliver.
+    # The post text is stored once in alert_posts, not per user.
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS alert_posts (
+        post_id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        created_at REAL NOT NULL
+    )
+    """)
+
+    # Latency stamps of the post (see latency.py); created_at is "matched".
+    # received_at is NULL for edits, which are left out of the ledger.
+    await _add_column(db, "alert_posts", "posted_at", "REAL")
+    await _add_column(db, "alert_posts", "received_at", "REAL")
+
+    # UNIQUE (post_id, user_id) is the idempotency key: re-matching the same
+    # post (restart, replay, edit) never queues a second alert for a user.
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS alert_outbox (
+        id INTEGER PRIMARY KEY,
+        post_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',   -- pending | sent | failed | expired
+        attempts INTEGER NOT NULL DEFAULT 0,
+        created_at REAL NOT NULL,
+        done_at REAL,
+        UNIQUE (post_id, user_id)
+    )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_outbox_status ON alert_outbox (status, id)"
+    )
+    # Sender-process leases (ROLE=sender): a claimed row is skipped by other
+    # senders until claimed_until, then picked up again if still pending.
+    await _add_column(db, "alert_outbox", "claimed_by", "TEXT")
+    await _add_column(db, "alert_outbox", "claimed_until", "REAL")
+
+    # Listener -> matcher hand-off (ROLE=listener / ROLE=matcher).
+    # The post itself is read from channel_posts.
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS post_queue (
+        msg_id INTEGER PRIMARY KEY,
+        edited INTEGER NOT NULL DEFAULT 0,
+        queued_at REAL NOT NULL
+    )
+    """)
+
+    # One row per user config change, so another process can reload just
+    # those users into its index (see refresh_index()).
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS config_changes (
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL
+    )
+    """)
+
+    # Local archive of channel posts, stored already parsed.
+    # stops/dates are "|"-joined ("CITY,ST|CITY,ST"); NULL stops = not a load.
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS channel_posts (
+        msg_id INTEGER PRIMARY KEY,
+        posted_at REAL NOT NULL,
+        text TEXT NOT NULL,
+        stops TEXT,
+        miles INTEGER,
+        dates TEXT,
+        equipment TEXT
+    )
+    """)
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_channel_posts_time ON channel_posts (posted_at)"
+    )
+
+    # Lane analytics (see lane_stats.py): one row per archived load, plus
+    # rollups kept up to date by archive_posts()
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS lane_posts (
+        msg_id INTEGER PRIMARY KEY,
+        day TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        o_city TEXT NOT NULL,
+        o_state TEXT NOT NULL,
+        d_state TEXT NOT NULL
+    )
+    """)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS lane_days (
+        day TEXT NOT NULL,
+        o_city TEXT NOT NULL,
+        o_state TEXT NOT NULL,
+        d_state TEXT NOT NULL,
+        posts INTEGER NOT NULL,
+        PRIMARY KEY (day, o_city, o_state, d_state)
+    ) WITHOUT ROWID
+    """)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS lane_hours (
+        o_city TEXT NOT NULL,
+        o_state TEXT NOT NULL,
+        d_state TEXT NOT NULL,
+        hour INTEGER NOT NULL,
+        posts INTEGER NOT NULL,
+        PRIMARY KEY (o_city, o_state, d_state, hour)
+    ) WITHOUT ROWID
+    """)
+    await _backfill_lane_stats(db)
+
+    # Alert latency ledger (append-only, flushed in batches) and its
+    # hourly histogram rollup; see latency.py
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS latency_ledger (
+        sent_at REAL NOT NULL,
+        post_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        channel_ms INTEGER NOT NULL,
+        match_ms INTEGER NOT NULL,
+        send_ms INTEGER NOT NULL,
+        total_ms INTEGER NOT NULL
+    )
+    """)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS latency_hist (
+        hour INTEGER NOT NULL,
+        stage TEXT NOT NULL,
+        bucket INTEGER NOT NULL,
+        n INTEGER NOT NULL,
+        PRIMARY KEY (hour, stage, bucket)
+    ) WITHOUT ROWID
+    """)
+
+    # Route fingerprints for repost suppression (see dedup.py)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS post_fingerprints (
+        fp TEXT PRIMARY KEY,
+        msg_id INTEGER NOT NULL,
+        seen_at REAL NOT NULL
+    )
+    """)
+
+    # Small key/value store for process state (e.g. last_processed_id)
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS bot_state (
+        key TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )
+    """)
+
+
+async def _rebuild_table(db, table: str, columns: str, select: str, without_rowid: bool = True):
+    """
+    Recreates `table` with `columns`, filled from `select` (which reads the
+    old table), the usual SQLite way: create new, copy, drop old, rename.
+    """
+    suffix = " WITHOUT ROWID" if without_rowid else ""
+    await db.execute(f"CREATE TABLE {table}_new ({columns}){suffix}")
+    await db.execute(f"INSERT INTO {table}_new {select}")
+    await db.execute(f"DROP TABLE {table}")
+    await db.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+async def _schema_v2(db):
+    """
+    Compact rule tables:
+    - cities interns (CITY, ST) to an integer id; point, radius and stop
+      rules store the id instead of both strings.
+    - Rule tables are WITHOUT ROWID, clustered on (user_id, key), so a
+      user's rules are one range seek; a covering (key, user_id) index on
+      each answers "who has this state/city/lane" without touching the table.
+    - user_config loses the legacy from_scope column.
+    """
+    await db.execute("""
+    CREATE TABLE cities (
+        id INTEGER PRIMARY KEY,
+        city TEXT NOT NULL,
+        state TEXT NOT NULL,
+        UNIQUE (city, state)
+    )
+    """)
+    await db.execute("""
+    INSERT INTO cities (city, state)
+    SELECT city, state FROM user_origin_points
+    UNION SELECT city, state FROM user_origin_radius
+    UNION SELECT city, state FROM user_stop_points
+    ORDER BY 2, 1
+    """)
+
+    await _rebuild_table(
+        db, "user_config",
+        "user_id INTEGER PRIMARY KEY, to_all INTEGER NOT NULL DEFAULT 0, "
+        f"delivery TEXT NOT NULL DEFAULT 'instant', digest_secs INTEGER NOT NULL DEFAULT {DIGEST_SECS_DEFAULT}",
+        "SELECT user_id, to_all, delivery, digest_secs FROM user_config",
+        without_rowid=False,
+    )
+    for table in ("user_origin_points", "user_stop_points"):
+        await _rebuild_table(
+            db, table,
+            "user_id INTEGER NOT NULL, city_id INTEGER NOT NULL, PRIMARY KEY (user_id, city_id)",
+            f"SELECT t.user_id, c.id FROM {table} t JOIN cities c USING (city, state)",
+        )
+        await db.execute(f"CREATE INDEX idx_{table}_city ON {table} (city_id, user_id)")
+    await _rebuild_table(
+        db, "user_origin_radius",
+        "user_id INTEGER NOT NULL, city_id INTEGER NOT NULL, miles INTEGER NOT NULL, "
+        "PRIMARY KEY (user_id, city_id)",
+        "SELECT t.user_id, c.id, t.miles FROM user_origin_radius t JOIN cities c USING (city, state)",
+    )
+    await db.execute("CREATE INDEX idx_user_origin_radius_city ON user_origin_radius (city_id, user_id, miles)")
+    for table, column in (
+        ("user_origin_states", "state"),
+        ("user_destination_states", "state"),
+        ("user_via_states", "state"),
+        ("user_lanes", "pattern"),
+    ):
+        await _rebuild_table(
+            db, table,
+            f"user_id INTEGER NOT NULL, {column} TEXT NOT NULL, PRIMARY KEY (user_id, {column})",
+            f"SELECT user_id, {column} FROM {table}",
+        )
+        await db.execute(f"CREATE INDEX idx_{table}_{column} ON {table} ({column}, user_id)")
+
+
+async def _schema_v3(db):
+    """
+    Canonical city names (cities.py): respells interned cities, merging ids
+    that now name the same city (a user's duplicate rule keeps the surviving
+    id's row), and re-counts the lane rollups under the canonical names.
+    """
+    cur = await db.execute("SELECT id, city, state FROM cities ORDER BY id")
+    keep = {}      # canonical (CITY, ST) -> surviving id
+    merged = []    # (surviving id, merged id)
+    renamed = []   # (canonical city, id)
+    for cid, city, st in await cur.fetchall():
+        canon = CANON.canonical(city, st)
+        first = keep.setdefault(canon, cid)
+        if first != cid:
+            merged.append((first, cid))
+        elif canon[0] != city:
+            renamed.append((canon[0], cid))
+
+    for table in ("user_origin_points", "user_origin_radius", "user_stop_points"):
+        await db.executemany(f"UPDATE OR IGNORE {table} SET city_id=? WHERE city_id=?", merged)
+        await db.executemany(f"DELETE FROM {table} WHERE city_id=?", [(cid,) for _first, cid in merged])
+    await db.executemany("DELETE FROM cities WHERE id=?", [(cid,) for _first, cid in merged])
+    await db.executemany("UPDATE cities SET city=? WHERE id=?", renamed)
+
+    cur = await db.execute("SELECT DISTINCT o_city, o_state FROM lane_posts")
+    respell = [(canon[0], city, st) for city, st in await cur.fetchall()
+               if (canon := CANON.canonical(city, st))[0] != city]
+    if respell:
+        await db.executemany("UPDATE lane_posts SET o_city=? WHERE o_city=? AND o_state=?", respell)
+        await db.execute("DELETE FROM lane_days")
+        await db.execute("DELETE FROM lane_hours")
         await db.execute(
-            "INSERT OR IGNORE INTO user_config (user_id, to_all) VALUES (?, 0)",
-            (user_id,),
+            "INSERT INTO lane_days (day, o_city, o_state, d_state, posts) "
+            "SELECT day, o_city, o_state, d_state, COUNT(*) FROM lane_posts "
+            "GROUP BY day, o_city, o_state, d_state"
         )
-        await db.commit()
+        await db.execute(
+            "INSERT INTO lane_hours (o_city, o_state, d_state, hour, posts) "
+            "SELECT o_city, o_state, d_state, hour, COUNT(*) FROM lane_posts "
+            "GROUP BY o_city, o_state, d_state, hour"
+        )
+
+
+async def _schema_v4(db):
+    """
+    Post filters (see post_filters.py): one row per (kind, value).
+    """
+    await db.execute("""
+    CREATE TABLE user_filters (
+        user_id INTEGER NOT NULL,
+        kind TEXT NOT NULL,
+        value TEXT NOT NULL,
+        PRIMARY KEY (user_id, kind, value)
+    ) WITHOUT ROWID
+    """)
+
+
+async def _schema_v5(db):
+    """
+    channel_posts.archive_seq: bumped on every (re-)archive, so another
+    process can follow edits and gap fills, not just new msg_ids.
+    """
+    await _add_column(db, "channel_posts", "archive_seq", "INTEGER")
+    await db.execute("CREATE INDEX idx_channel_posts_seq ON channel_posts (archive_seq)")
+
+
+# PRAGMA user_version after step i is i + 1. Append only; never edit a
+# step that has shipped.
+MIGRATIONS = (_schema_v1, _schema_v2, _schema_v3, _schema_v4, _schema_v5)
+
+
+async def _add_column(db, table: str, column: str, decl: str):
+    cur = await db.execute(f"PRAGMA table_info({table})")
+    if column not in [r[1] for r in await cur.fetchall()]:
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+# ---------- Cities ----------
+# cities.id of (CITY, ST) as a scalar subquery; NULL (matching nothing) if
+# the city was never interned
+_CITY_ID = "(SELECT id FROM cities WHERE city=? AND state=?)"
+
+
+async def _intern_city(db, city: str, st: str):
+    """
+    Makes sure (city, st) has a cities row; rules then refer to it via _CITY_ID.
+    """
+    await db.execute("INSERT OR IGNORE INTO cities (city, state) VALUES (?, ?)", (city, st))
 
 
 # ---------- Origin (city+state) ----------
+@timed_db
 async def add_origin_point(user_id: int, city: str, st: str):
-    await ensure_user(user_id)
-    city = norm_city(city)
     st = norm_state(st)
+    city = norm_city(city, st)
     if len(st) != 2:
         raise ValueError("State must be 2 letters (e.g. OH).")
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
+        await _intern_city(db, city, st)
         await db.execute(
-            "INSERT OR IGNORE INTO user_origin_points (user_id, city, state) VALUES (?, ?, ?)",
+            f"INSERT OR IGNORE INTO user_origin_points (user_id, city_id) VALUES (?, {_CITY_ID})",
             (user_id, city, st),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.add_point(user_id, city, st)
+    return _store_view(user_id, view, origin_points=_sorted_rows(set(view["origin_points"]) | {(city, st)}))
 
 
+@timed_db
 async def remove_origin_point(user_id: int, city: str, st: str):
-    await ensure_user(user_id)
-    city = norm_city(city)
     st = norm_state(st)
-    async with aiosqlite.connect(DB_PATH) as db:
+    city = norm_city(city, st)
+    async with user_transaction(user_id) as db:
         await db.execute(
-            "DELETE FROM user_origin_points WHERE user_id=? AND city=? AND state=?",
+            f"DELETE FROM user_origin_points WHERE user_id=? AND city_id={_CITY_ID}",
             (user_id, city, st),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.remove_point(user_id, city, st)
+    return _store_view(user_id, view, origin_points=_sorted_rows(set(view["origin_points"]) - {(city, st)}))
 
 
+@timed_db
 async def clear_origin_points(user_id: int):
-    await ensure_user(user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute("DELETE FROM user_origin_points WHERE user_id=?", (user_id,))
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.clear_points(user_id)
+    return _store_view(user_id, view, origin_points=[])
 
 
 # ---------- Origin (states) ----------
+@timed_db
 async def add_origin_state(user_id: int, st: str):
-    await ensure_user(user_id)
     st = norm_state(st)
     if len(st) != 2:
         raise ValueError("State must be 2 letters (e.g. OH).")
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute(
             "INSERT OR IGNORE INTO user_origin_states (user_id, state) VALUES (?, ?)",
             (user_id, st),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.add_state(user_id, st)
+    return _store_view(user_id, view, origin_states=sorted(set(view["origin_states"]) | {st}))
 
 
+@timed_db
 async def remove_origin_state(user_id: int, st: str):
-    await ensure_user(user_id)
     st = norm_state(st)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute(
             "DELETE FROM user_origin_states WHERE user_id=? AND state=?",
             (user_id, st),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.remove_state(user_id, st)
+    return _store_view(user_id, view, origin_states=sorted(set(view["origin_states"]) - {st}))
 
 
+@timed_db
 async def clear_origin_states(user_id: int):
-    await ensure_user(user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute("DELETE FROM user_origin_states WHERE user_id=?", (user_id,))
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.clear_states(user_id)
+    return _store_view(user_id, view, origin_states=[])
+
+
+# ---------- Origin (radius) ----------
+@timed_db
+async def add_origin_radius(user_id: int, city: str, st: str, miles: int):
+    """
+    Adds (or re-sizes) "within `miles` of city, ST". The city must be in the
+    gazetteer; it is stored under the gazetteer's name.
+    """
+    st = norm_state(st)
+    if not 1 <= miles <= RADIUS_MAX_MILES:
+        raise ValueError(f"Radius must be 1-{RADIUS_MAX_MILES} miles.")
+    row = GAZETTEER.lookup(city, st)
+    if row is None:
+        raise ValueError(f"Unknown city: {norm_city(city, st)}, {st}")
+    city, st = GAZETTEER.names[row]
+    async with user_transaction(user_id) as db:
+        await _intern_city(db, city, st)
+        await db.execute(
+            f"INSERT INTO user_origin_radius (user_id, city_id, miles) VALUES (?, {_CITY_ID}, ?) "
+            "ON CONFLICT (user_id, city_id) DO UPDATE SET miles=excluded.miles",
+            (user_id, city, st, miles),
+        )
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.add_radius(user_id, city, st, miles)
+    return _store_view(user_id, view, origin_radius=_sorted_rows([r for r in view["origin_radius"] if r[:2] != (city, st)] + [(city, st, miles)]))
+
+
+@timed_db
+async def remove_origin_radius(user_id: int, city: str, st: str):
+    st = norm_state(st)
+    city = norm_city(city, st)
+    async with user_transaction(user_id) as db:
+        await db.execute(
+            f"DELETE FROM user_origin_radius WHERE user_id=? AND city_id={_CITY_ID}",
+            (user_id, city, st),
+        )
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.remove_radius(user_id, city, st)
+    return _store_view(user_id, view, origin_radius=[r for r in view["origin_radius"] if r[:2] != (city, st)])
+
+
+@timed_db
+async def clear_origins(user_id: int):
+    """
+    Clears origin cities, origin states AND radius origins in one transaction.
+    """
+    async with user_transaction(user_id) as db:
+        await db.execute("DELETE FROM user_origin_points WHERE user_id=?", (user_id,))
+        await db.execute("DELETE FROM user_origin_states WHERE user_id=?", (user_id,))
+        await db.execute("DELETE FROM user_origin_radius WHERE user_id=?", (user_id,))
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.clear_points(user_id)
+    SUB_INDEX.clear_states(user_id)
+    SUB_INDEX.clear_radius(user_id)
+    return _store_view(user_id, view, origin_points=[], origin_states=[], origin_radius=[])
 
 
 # ---------- Destination ----------
+@timed_db
 async def set_to_all(user_id: int, enabled: bool):
-    await ensure_user(user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute(
             "UPDATE user_config SET to_all=? WHERE user_id=?",
             (1 if enabled else 0, user_id),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.set_to_all(user_id, enabled)
+    return _store_view(user_id, view, to_all=bool(enabled))
 
 
+@timed_db
+async def toggle_to_all(user_id: int):
+    """
+    Flips to_all in place (no read-then-write round trip).
+    """
+    async with user_transaction(user_id) as db:
+        cur = await db.execute(
+            "UPDATE user_config SET to_all = 1 - to_all WHERE user_id=? RETURNING to_all",
+            (user_id,),
+        )
+        (to_all,) = await cur.fetchone()
+        to_all = bool(to_all)
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.set_to_all(user_id, to_all)
+    return _store_view(user_id, view, to_all=to_all)
+
+
+@timed_db
 async def add_destination_state(user_id: int, st: str):
-    await ensure_user(user_id)
     st = norm_state(st)
     if len(st) != 2:
         raise ValueError("State must be 2 letters (e.g. CO).")
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute(
             "INSERT OR IGNORE INTO user_destination_states (user_id, state) VALUES (?, ?)",
             (user_id, st),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.add_dest(user_id, st)
+    return _store_view(user_id, view, destination_states=sorted(set(view["destination_states"]) | {st}))
 
 
+@timed_db
 async def remove_destination_state(user_id: int, st: str):
-    await ensure_user(user_id)
     st = norm_state(st)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute(
             "DELETE FROM user_destination_states WHERE user_id=? AND state=?",
             (user_id, st),
         )
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.remove_dest(user_id, st)
+    return _store_view(user_id, view, destination_states=sorted(set(view["destination_states"]) - {st}))
 
 
+@timed_db
 async def clear_destination_states(user_id: int):
-    await ensure_user(user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with user_transaction(user_id) as db:
         await db.execute("DELETE FROM user_destination_states WHERE user_id=?", (user_id,))
-        await db.commit()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.clear_dest(user_id)
+    return _store_view(user_id, view, destination_states=[])
 
 
-# ---------- Views ----------
-async def get_user_view(user_id: int):
-    await ensure_user(user_id)
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute(
-            "SELECT to_all FROM user_config WHERE user_id=?",
-            (user_id,),
+# ---------- Route rules ----------
+# kind (see routes.py) -> (table, key column, view key)
+_ROUTE_TABLES = {
+    "via": ("user_via_states", "state", "via_states"),
+    "stop": ("user_stop_points", "city_id", "stop_points"),
+    "lane": ("user_lanes", "pattern", "lanes"),
+}
+
+
+def _route_key(kind: str, key):
+    """
+    Validated/normalized key: ST for via, (CITY, ST) for stop, canonical lane.
+    """
+    if kind == "via":
+        key = norm_state(key)
+        if len(key) != 2:
+            raise ValueError("State must be 2 letters (e.g. KY).")
+        return key
+    if kind == "stop":
+        st = norm_state(key[1])
+        city = norm_city(key[0], st)
+        if len(st) != 2:
+            raise ValueError("State must be 2 letters (e.g. KY).")
+        return city, st
+    if kind == "lane":
+        return parse_lane(key)
+    raise ValueError(f"Unknown route rule: {kind}")
+
+
+def _route_view(view: dict, kind: str, keys):
+    """
+    {view key: sorted keys} for a _store_view() call.
+    """
+    name = _ROUTE_TABLES[kind][2]
+    return {name: _sorted_rows(keys) if kind == "stop" else sorted(keys)}
+
+
+def _route_value(kind: str, key):
+    """
+    (SQL expression, params) for a rule's key column.
+    """
+    if kind == "stop":
+        return _CITY_ID, key
+    return "?", (key,)
+
+
+@timed_db
+async def add_route_rule(user_id: int, kind: str, key):
+    key = _route_key(kind, key)
+    table, column, name = _ROUTE_TABLES[kind]
+    value, params = _route_value(kind, key)
+    async with user_transaction(user_id) as db:
+        if kind == "stop":
+            await _intern_city(db, *key)
+        await db.execute(
+            f"INSERT OR IGNORE INTO {table} (user_id, {column}) VALUES (?, {value})",
+            (user_id, *params),
         )
-        (to_all,) = await cur.fetchone()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.add_route(user_id, kind, key)
+    return _store_view(user_id, view, **_route_view(view, kind, set(view[name]) | {key}))
 
-        cur2 = await db.execute(
-            "SELECT city, state FROM user_origin_points WHERE user_id=? ORDER BY state, city",
-            (user_id,),
+
+@timed_db
+async def remove_route_rule(user_id: int, kind: str, key):
+    key = _route_key(kind, key)
+    table, column, name = _ROUTE_TABLES[kind]
+    value, params = _route_value(kind, key)
+    async with user_transaction(user_id) as db:
+        await db.execute(
+            f"DELETE FROM {table} WHERE user_id=? AND {column}={value}",
+            (user_id, *params),
         )
-        origin_points = await cur2.fetchall()
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.remove_route(user_id, kind, key)
+    return _store_view(user_id, view, **_route_view(view, kind, set(view[name]) - {key}))
 
-        cur3 = await db.execute(
-            "SELECT state FROM user_origin_states WHERE user_id=? ORDER BY state",
-            (user_id,),
+
+@timed_db
+async def clear_route_rules(user_id: int):
+    async with user_transaction(user_id) as db:
+        for table, _column, _name in _ROUTE_TABLES.values():
+            await db.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.clear_routes(user_id)
+    return _store_view(user_id, view, via_states=[], stop_points=[], lanes=[])
+
+
+# ---------- Post filters ----------
+@timed_db
+async def add_filter_rules(user_id: int, rules):
+    """
+    rules: [(kind, value)] from post_filters.parse_filter_arg(). Miles and
+    days replace the user's previous value; the list kinds accumulate.
+    """
+    async with user_transaction(user_id) as db:
+        await db.executemany(
+            "DELETE FROM user_filters WHERE user_id=? AND kind=?",
+            [(user_id, kind) for kind in replaced_kinds(rules)],
+        )
+        await db.executemany(
+            "INSERT OR IGNORE INTO user_filters (user_id, kind, value) VALUES (?, ?, ?)",
+            [(user_id, kind, value) for kind, value in rules],
         )
-        origin_states = [r[0] for r in await cur3.fetchall()]
+        view = await _cached_view(db, user_id)
+        # Over the per-kind cap raises here and rolls the write back
+        filters, _replaced = merge_filters(view["filters"], rules)
+    SUB_INDEX.set_filters(user_id, filters)
+    return _store_view(user_id, view, filters=filters)
 
-        cur4 = await db.execute(
-            "SELECT state FROM user_destination_states WHERE user_id=? ORDER BY state",
-            (user_id,),
+
+@timed_db
+async def remove_filter_rules(user_id: int, kinds, value: str = None):
+    """
+    Removes `value` (or, if None, every value) of each kind in kinds.
+    """
+    async with user_transaction(user_id) as db:
+        for kind in kinds:
+            if value is None:
+                await db.execute("DELETE FROM user_filters WHERE user_id=? AND kind=?", (user_id, kind))
+            else:
+                await db.execute(
+                    "DELETE FROM user_filters WHERE user_id=? AND kind=? AND value=?",
+                    (user_id, kind, value),
+                )
+        view = await _cached_view(db, user_id)
+    filters = [(k, v) for k, v in view["filters"] if not (k in kinds and value in (None, v))]
+    SUB_INDEX.set_filters(user_id, filters)
+    return _store_view(user_id, view, filters=filters)
+
+
+@timed_db
+async def clear_filter_rules(user_id: int):
+    async with user_transaction(user_id) as db:
+        await db.execute("DELETE FROM user_filters WHERE user_id=?", (user_id,))
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.set_filters(user_id, ())
+    return _store_view(user_id, view, filters=[])
+
+
+# ---------- Delivery policy ----------
+@timed_db
+async def set_delivery(user_id: int, mode: str, digest_secs: int = DIGEST_SECS_DEFAULT):
+    if mode not in DELIVERY_MODES:
+        raise ValueError(f"Mode must be one of: {', '.join(DELIVERY_MODES)}")
+    if not DIGEST_SECS_MIN <= digest_secs <= DIGEST_SECS_MAX:
+        raise ValueError(f"Window must be {DIGEST_SECS_MIN}-{DIGEST_SECS_MAX} seconds.")
+    async with user_transaction(user_id) as db:
+        await db.execute(
+            "UPDATE user_config SET delivery=?, digest_secs=? WHERE user_id=?",
+            (mode, digest_secs, user_id),
         )
-        dest_states = [r[0] for r in await cur4.fetchall()]
+        view = await _cached_view(db, user_id)
+    SUB_INDEX.set_delivery(user_id, mode, digest_secs)
+    return _store_view(user_id, view, delivery=mode, digest_secs=digest_secs)
+
+
+def delivery_policy(user_id: int):
+    """
+    (mode, digest_secs) for users with a non-instant policy, else None.
+    Served from SUB_INDEX; used by the dispatcher per alert.
+    """
+    return SUB_INDEX.delivery.get(user_id)
+
+
+# ---------- Views ----------
+async def _read_user_view(db, user_id: int):
+    cur = await db.execute(
+        "SELECT to_all, delivery, digest_secs FROM user_config WHERE user_id=?",
+        (user_id,),
+    )
+    to_all, delivery, digest_secs = await cur.fetchone()
+
+    cur2 = await db.execute(
+        "SELECT c.city, c.state FROM user_origin_points p JOIN cities c ON c.id = p.city_id "
+        "WHERE p.user_id=? ORDER BY c.state, c.city",
+        (user_id,),
+    )
+    origin_points = await cur2.fetchall()
+
+    cur3 = await db.execute(
+        "SELECT state FROM user_origin_states WHERE user_id=? ORDER BY state",
+        (user_id,),
+    )
+    origin_states = [r[0] for r in await cur3.fetchall()]
+
+    cur5 = await db.execute(
+        "SELECT c.city, c.state, r.miles FROM user_origin_radius r JOIN cities c ON c.id = r.city_id "
+        "WHERE r.user_id=? ORDER BY c.state, c.city",
+        (user_id,),
+    )
+    origin_radius = [(c, s, m) for c, s, m in await cur5.fetchall()]
+
+    cur4 = await db.execute(
+        "SELECT state FROM user_destination_states WHERE user_id=? ORDER BY state",
+        (user_id,),
+    )
+    dest_states = [r[0] for r in await cur4.fetchall()]
+
+    cur6 = await db.execute(
+        "SELECT state FROM user_via_states WHERE user_id=? ORDER BY state",
+        (user_id,),
+    )
+    via_states = [r[0] for r in await cur6.fetchall()]
+
+    cur7 = await db.execute(
+        "SELECT c.city, c.state FROM user_stop_points p JOIN cities c ON c.id = p.city_id "
+        "WHERE p.user_id=? ORDER BY c.state, c.city",
+        (user_id,),
+    )
+    stop_points = [(c, s) for c, s in await cur7.fetchall()]
+
+    cur8 = await db.execute(
+        "SELECT pattern FROM user_lanes WHERE user_id=? ORDER BY pattern",
+        (user_id,),
+    )
+    lanes = [r[0] for r in await cur8.fetchall()]
+
+    cur9 = await db.execute(
+        "SELECT kind, value FROM user_filters WHERE user_id=? ORDER BY kind, value",
+        (user_id,),
+    )
+    filters = [(k, v) for k, v in await cur9.fetchall()]
 
     return {
         "to_all": bool(to_all),
         "origin_points": [(c, s) for c, s in origin_points],
         "origin_states": origin_states,
+        "origin_radius": origin_radius,
         "destination_states": dest_states,
+        "via_states": via_states,
+        "stop_points": stop_points,
+        "lanes": lanes,
+        "filters": filters,
+        "delivery": delivery,
+        "digest_secs": digest_secs,
     }
 
 
+async def _cached_view(db, user_id: int):
+    view = _VIEWS.get(user_id)
+    if view is None:
+        view = await _read_user_view(db, user_id)
+    return view
+
+
+def _store_view(user_id: int, view: dict, **changes):
+    """
+    Write-through: caches a NEW dict with `changes` applied (the old one is
+    left untouched, so it is safe to memoize on view identity).
+    Callers read `view` with _cached_view() AFTER their write, in the same
+    transaction, and pass the full new value of each key they changed,
+    computed from `view` idempotently: on a cache hit `view` predates the
+    write, on a miss it already includes it, and both must give the same
+    result.
+    """
+    view = _VIEWS[user_id] = {**view, **changes}
+    return view
+
+
+def _sorted_rows(rows):
+    """
+    (city, state[, miles]) rows in the views' ORDER BY state, city.
+    """
+    return sorted(rows, key=lambda r: (r[1], r[0]))
+
+
+@timed_db
+async def get_user_view(user_id: int):
+    """
+    Served from the view cache; reads the DB only on the user's first access.
+    """
+    view = _VIEWS.get(user_id)
+    if view is None:
+        async with user_transaction(user_id, changed=False) as db:
+            view = await _read_user_view(db, user_id)
+        _VIEWS[user_id] = view
+    return view
+
+
+# Rule rows in SubscriptionIndex.load() order (see _fetch_config_rows);
+# city ids are resolved to (CITY, ST) here
+_CONFIG_QUERIES = (
+    "SELECT user_id, to_all, delivery, digest_secs FROM user_config",
+    "SELECT t.user_id, c.city, c.state FROM user_origin_points t JOIN cities c ON c.id = t.city_id",
+    "SELECT user_id, state FROM user_origin_states",
+    "SELECT user_id, state FROM user_destination_states",
+    "SELECT t.user_id, c.city, c.state, t.miles FROM user_origin_radius t JOIN cities c ON c.id = t.city_id",
+)
+
+
+async def _fetch_config_rows(db, where: str = "", params=()):
+    """
+    (cfg_rows, op_rows, os_rows, ds_rows, or_rows, route_rows, filter_rows);
+    `where` (on user_id) narrows every query.
+    """
+    rows = []
+    for sql in _CONFIG_QUERIES:
+        cur = await db.execute(sql + where, params)
+        rows.append(await cur.fetchall())
+    rows.append(await _fetch_route_rows(db, where, params))
+    cur = await db.execute("SELECT user_id, kind, value FROM user_filters" + where, params)
+    rows.append(await cur.fetchall())
+    return rows
+
+
+async def _fetch_route_rows(db, where: str = "", params=()):
+    """
+    [(user_id, kind, key)] from the route rule tables (SubscriptionIndex.load shape).
+    """
+    rows = []
+    for kind, (table, column, _name) in _ROUTE_TABLES.items():
+        if kind == "stop":
+            sql = f"SELECT t.user_id, c.city, c.state FROM {table} t JOIN cities c ON c.id = t.city_id"
+        else:
+            sql = f"SELECT user_id, {column} FROM {table}"
+        cur = await db.execute(sql + where, params)
+        for user_id, *key in await cur.fetchall():
+            rows.append((user_id, kind, tuple(key) if kind == "stop" else key[0]))
+    return rows
+
+
+@timed_db
+async def load_index():
+    """
+    (Re)build SUB_INDEX from the DB. Called once by init_db().
+    """
+    async with transaction(write=False) as db:
+        rows = await _fetch_config_rows(db)
+    SUB_INDEX.load(*rows)
+    _VIEWS.clear()
+
+
+@timed_db
+async def get_config_seq() -> int:
+    async with transaction(write=False) as db:
+        cur = await db.execute("SELECT MAX(seq) FROM config_changes")
+        (seq,) = await cur.fetchone()
+    return seq or 0
+
+
+@timed_db
+async def refresh_index(after_seq: int) -> int:
+    """
+    Applies config changes made by other processes (seq > after_seq) to
+    SUB_INDEX, reloading only the users that changed. Returns the new seq.
+    Falls back to a full load_index() if the change log no longer reaches
+    back to after_seq.
+    """
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            "SELECT MIN(seq), MAX(seq) FROM config_changes WHERE seq > ?",
+            (after_seq,),
+        )
+        first, last = await cur.fetchone()
+        if last is None:
+            return after_seq
+        if first != after_seq + 1:
+            # seqs are contiguous, so a gap means rows we never saw were pruned
+            full = True
+        else:
+            full = False
+            cur = await db.execute(
+                "SELECT DISTINCT user_id FROM config_changes WHERE seq > ?",
+                (after_seq,),
+            )
+            ids = json.dumps([r[0] for r in await cur.fetchall()])
+            rows = await _fetch_config_rows(
+                db, " WHERE user_id IN (SELECT value FROM json_each(?))", (ids,)
+            )
+
+    if full:
+        await load_index()
+        return last
+
+    cfg_rows, op_rows, os_rows, ds_rows, or_rows, route_rows, filter_rows = rows
+    rules = {uid: (bool(to_all), [], [], [], (mode, secs), [], [], []) for uid, to_all, mode, secs in cfg_rows}
+    for uid, city, st in op_rows:
+        rules[uid][1].append((city, st))
+    for uid, st in os_rows:
+        rules[uid][2].append(st)
+    for uid, st in ds_rows:
+        rules[uid][3].append(st)
+    for uid, city, st, miles in or_rows:
+        rules[uid][5].append((city, st, miles))
+    for uid, kind, key in route_rows:
+        rules[uid][6].append((kind, key))
+    for uid, kind, value in filter_rows:
+        rules[uid][7].append((kind, value))
+    for uid in json.loads(ids):
+        _VIEWS.pop(uid, None)
+        SUB_INDEX.replace_user(uid, *rules.get(uid, (False, (), (), ())))
+    return last
+
+
+def match_users(o_city: str, o_state: str, d_state: str, stops=(), post=None):
+    """
+    User ids whose rules match a post with this FIRST stop and LAST stop state
+    (and, given all its `stops`, route rules on any stop; given the LoadPost,
+    post filters).
+    Served from SUB_INDEX (no DB access).
+    """
+    return SUB_INDEX.match(o_city, o_state, d_state, stops, post)
+
+
+@timed_db
 async def get_all_configs():
     """
     Returns list of dicts:
@@ -214,23 +1162,14 @@ async def get_all_configs():
         to_all,
         origin_points(set of (CITY_UPPER, ST)),
         origin_states(set of ST),
+        origin_radius(set of (CITY_UPPER, ST, miles)),
         destination_states(set of ST)
       }
 
-    Only includes users with at least one origin rule (point or state).
+    Only includes users with at least one origin rule (point, state or radius).
     """
-    async with aiosqlite.connect(DB_PATH) as db:
-        cur = await db.execute("SELECT user_id, to_all FROM user_config")
-        cfg_rows = await cur.fetchall()
-
-        cur2 = await db.execute("SELECT user_id, city, state FROM user_origin_points")
-        op_rows = await cur2.fetchall()
-
-        cur3 = await db.execute("SELECT user_id, state FROM user_origin_states")
-        os_rows = await cur3.fetchall()
-
-        cur4 = await db.execute("SELECT user_id, state FROM user_destination_states")
-        ds_rows = await cur4.fetchall()
+    async with transaction(write=False) as db:
+        cfg_rows, op_rows, os_rows, ds_rows, or_rows, *_rules = await _fetch_config_rows(db)
 
     op_map = {}
     for user_id, city, st in op_rows:
@@ -244,12 +1183,17 @@ async def get_all_configs():
     for user_id, st in ds_rows:
         ds_map.setdefault(user_id, set()).add(st)
 
+    or_map = {}
+    for user_id, city, st, miles in or_rows:
+        or_map.setdefault(user_id, set()).add((city, st, miles))
+
     out = []
-    for user_id, to_all in cfg_rows:
+    for user_id, to_all, _mode, _secs in cfg_rows:
         origin_points = op_map.get(user_id, set())
         origin_states = os_map.get(user_id, set())
+        origin_radius = or_map.get(user_id, set())
 
-        if not origin_points and not origin_states:
+        if not origin_points and not origin_states and not origin_radius:
             continue
 
         out.append({
@@ -257,6 +1201,610 @@ async def get_all_configs():
             "to_all": bool(to_all),
             "origin_points": origin_points,
             "origin_states": origin_states,
+            "origin_radius": origin_radius,
             "destination_states": ds_map.get(user_id, set()),
         })
-    return out
\ No newline at end of file
+    return out
+
+
+# ---------- Bot state ----------
+@timed_db
+async def get_state(key: str, default=None):
+    async with transaction(write=False) as db:
+        cur = await db.execute("SELECT value FROM bot_state WHERE key=?", (key,))
+        row = await cur.fetchone()
+    return row[0] if row else default
+
+
+@timed_db
+async def set_state(key: str, value):
+    async with transaction() as db:
+        await db.execute(
+            "INSERT INTO bot_state (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value=excluded.value",
+            (key, str(value)),
+        )
+
+
+# ---------- Alert outbox ----------
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_RESUME_MAX_AGE = int(os.getenv("OUTBOX_RESUME_MAX_AGE", "3600"))  # secs
+OUTBOX_KEEP_DAYS = 7
+
+
+async def _enqueue(db, post_id: int, text: str, user_ids, now: float, stamps=None):
+    # An edited post keeps its post_id; later alerts carry the new text (and
+    # no latency stamps). Re-enqueueing the same text (a replay) leaves the
+    # row, and the stamps of its still-pending alerts, alone.
+    posted_at, received_at = stamps if stamps is not None else (None, None)
+    await db.execute(
+        "INSERT INTO alert_posts (post_id, text, created_at, posted_at, received_at) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (post_id) DO UPDATE SET text=excluded.text, received_at=NULL "
+        "WHERE alert_posts.text IS NOT excluded.text",
+        (post_id, text, now, posted_at, received_at),
+    )
+    cur = await db.execute(
+        """
+        INSERT INTO alert_outbox (post_id, user_id, created_at)
+        SELECT ?, value, ? FROM json_each(?)
+        WHERE true
+        ON CONFLICT (post_id, user_id) DO NOTHING
+        RETURNING id, user_id
+        """,
+        (post_id, now, json.dumps(list(user_ids))),
+    )
+    return await cur.fetchall()
+
+
+@timed_db
+async def enqueue_alerts(post_id: int, text: str, user_ids, stamps=None, now: float = None):
+    """
+    Records the alerts for one post in ONE transaction (post text once, all
+    (post_id, user_id) rows in a single INSERT ... SELECT).
+    stamps: (posted_at, received_at) for the latency ledger, None for edits.
+    now: match time (default: time.time()).
+    Returns [(outbox_id, user_id)] for rows that were newly queued; users that
+    already have a row for this post are skipped (idempotent).
+    """
+    async with transaction() as db:
+        return await _enqueue(db, post_id, text, user_ids, now or time.time(), stamps)
+
+
+@timed_db
+async def enqueue_alerts_many(items, dequeue=()):
+    """
+    Same as enqueue_alerts() for many posts at once (catch-up replay, matcher):
+    items = [(post_id, text, user_ids)] or [(post_id, text, user_ids, stamps)],
+    all in ONE transaction.
+    dequeue: post_queue msg_ids handled by this batch, removed in the same
+    transaction.
+    Returns one [(outbox_id, user_id)] list per item.
+    """
+    now = time.time()
+    dequeue = list(dequeue)
+    async with transaction() as db:
+        results = [await _enqueue(db, *item[:3], now, *item[3:]) for item in items]
+        if dequeue:
+            await db.execute(
+                "DELETE FROM post_queue WHERE msg_id IN (SELECT value FROM json_each(?))",
+                (json.dumps(dequeue),),
+            )
+    return results
+
+
+@timed_db
+async def mark_alerts(sent_ids, failed_ids):
+    """
+    Batched delivery acks from the dispatcher.
+    """
+    if not sent_ids and not failed_ids:
+        return
+    now = time.time()
+    async with transaction() as db:
+        if sent_ids:
+            await db.executemany(
+                "UPDATE alert_outbox SET status='sent', done_at=? WHERE id=?",
+                [(now, i) for i in sent_ids],
+            )
+        if failed_ids:
+            await db.executemany(
+                "UPDATE alert_outbox SET status='failed', done_at=? WHERE id=?",
+                [(now, i) for i in failed_ids],
+            )
+
+
+async def _sweep_outbox(db, now: float):
+    await db.execute(
+        "UPDATE alert_outbox SET status='expired', done_at=? "
+        "WHERE status='pending' AND created_at < ?",
+        (now, now - OUTBOX_RESUME_MAX_AGE),
+    )
+    await db.execute(
+        "UPDATE alert_outbox SET status='failed', done_at=? "
+        "WHERE status='pending' AND attempts >= ?",
+        (now, OUTBOX_MAX_ATTEMPTS),
+    )
+
+    cutoff = now - OUTBOX_KEEP_DAYS * 86400
+    await db.execute(
+        "DELETE FROM alert_outbox WHERE status != 'pending' AND created_at < ?",
+        (cutoff,),
+    )
+    await db.execute(
+        "DELETE FROM alert_posts WHERE created_at < ? "
+        "AND post_id NOT IN (SELECT post_id FROM alert_outbox)",
+        (cutoff,),
+    )
+
+
+@timed_db
+async def resume_pending_alerts():
+    """
+    Called on startup: returns still-pending alerts as
+    [(outbox_id, post_id, user_id, text, stamps)] in queue order (stamps as
+    in _stamps()).
+
+    Each resume counts as an attempt, so a row that keeps crashing the process
+    is given up after OUTBOX_MAX_ATTEMPTS. Rows older than
+    OUTBOX_RESUME_MAX_AGE are expired (the load is gone by now).
+    Also prunes finished rows older than OUTBOX_KEEP_DAYS.
+    """
+    now = time.time()
+    async with transaction() as db:
+        await _sweep_outbox(db, now)
+        await db.execute(
+            "UPDATE alert_outbox SET attempts = attempts + 1 WHERE status='pending'"
+        )
+        cur = await db.execute(
+            """
+            SELECT o.id, o.post_id, o.user_id, p.text, p.posted_at, p.received_at, p.created_at
+            FROM alert_outbox o JOIN alert_posts p ON p.post_id = o.post_id
+            WHERE o.status='pending'
+            ORDER BY o.id
+            """
+        )
+        return [(*row[:4], _stamps(*row[4:])) for row in await cur.fetchall()]
+
+
+def _stamps(posted_at, received_at, matched_at):
+    """
+    (posted, received, matched) for the latency ledger, or None.
+    """
+    if posted_at is None or received_at is None:
+        return None
+    return posted_at, received_at, matched_at
+
+
+@timed_db
+async def sweep_outbox():
+    """
+    Expiry/give-up/prune pass of resume_pending_alerts() without the resume;
+    run periodically by sender processes.
+    """
+    async with transaction() as db:
+        await _sweep_outbox(db, time.time())
+
+
+@timed_db
+async def lease_sender_slot(worker: str, count: int, lease: float):
+    """
+    Sender processes: the shard slot (0..count-1) this worker holds for the
+    next `lease` seconds, or None while other live senders hold them all.
+    Renews the worker's slot if it has one, else takes a free or expired
+    one, so a dead sender's shard passes to a replacement. Kept in bot_state
+    as sender_slot:<n> = "<worker> <until>".
+    """
+    now = time.time()
+    async with transaction() as db:
+        cur = await db.execute("SELECT key, value FROM bot_state WHERE key LIKE 'sender_slot:%'")
+        held = {}
+        for key, value in await cur.fetchall():
+            owner, _, until = value.rpartition(" ")
+            held[int(key.split(":", 1)[1])] = (owner, float(until))
+        mine = [n for n in range(count) if n in held and held[n][0] == worker]
+        free = [n for n in range(count) if n not in held or held[n][1] < now]
+        slot = (mine or free or [None])[0]
+        if slot is not None:
+            await db.execute(
+                "INSERT INTO bot_state (key, value) VALUES (?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value=excluded.value",
+                (f"sender_slot:{slot}", f"{worker} {now + lease}"),
+            )
+    return slot
+
+
+@timed_db
+async def release_sender_slot(worker: str):
+    async with transaction() as db:
+        await db.execute(
+            "DELETE FROM bot_state WHERE key LIKE 'sender_slot:%' AND value LIKE ? || ' %'",
+            (worker,),
+        )
+
+
+@timed_db
+async def claim_alerts(worker: str, limit: int, lease: float, shard=None):
+    """
+    Sender processes: leases up to `limit` pending alerts for `lease` seconds
+    and returns them as [(outbox_id, post_id, user_id, text, stamps)] in queue order.
+    Rows leased by another sender are skipped until their lease runs out, so
+    a crashed sender's alerts are picked up again. Each claim is an attempt.
+    shard: (slot, count) -> only users with user_id % count == slot, so each
+    chat is paced and digested by one sender.
+    """
+    now = time.time()
+    where, params = "", ()
+    if shard is not None:
+        slot, count = shard
+        where, params = "AND user_id % ? = ?", (count, slot)
+    async with transaction() as db:
+        cur = await db.execute(
+            f"""
+            UPDATE alert_outbox
+            SET claimed_by=?, claimed_until=?, attempts = attempts + 1
+            WHERE id IN (
+                SELECT id FROM alert_outbox
+                WHERE status='pending' AND attempts < ? AND created_at >= ?
+                  AND (claimed_until IS NULL OR claimed_until < ?) {where}
+                ORDER BY id LIMIT ?
+            )
+            RETURNING id, post_id, user_id
+            """,
+            (worker, now + lease, OUTBOX_MAX_ATTEMPTS, now - OUTBOX_RESUME_MAX_AGE, now, *params, limit),
+        )
+        rows = await cur.fetchall()
+        if not rows:
+            return []
+        cur = await db.execute(
+            "SELECT post_id, text, posted_at, received_at, created_at FROM alert_posts "
+            "WHERE post_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(sorted({r[1] for r in rows})),),
+        )
+        posts = {row[0]: (row[1], _stamps(*row[2:])) for row in await cur.fetchall()}
+    rows.sort()
+    return [(i, post_id, user_id, *posts[post_id]) for i, post_id, user_id in rows]
+
+
+# ---------- Channel archive ----------
+def _encode_stops(stops) -> str:
+    return "|".join(f"{c},{s}" for c, s in stops)
+
+
+def _decode_stops(raw: str):
+    # Canonicalized again: rows archived before cities.py kept the raw spelling
+    return tuple(CANON.canonical(*part.rsplit(",", 1)) for part in raw.split("|"))
+
+
+def _archive_row(msg_id: int, posted_at: float, text: str, post):
+    if post is None:
+        return (msg_id, posted_at, text, None, None, None, None)
+    return (
+        msg_id, posted_at, text,
+        _encode_stops(post.stops), post.miles,
+        "|".join(post.dates) or None, post.equipment,
+    )
+
+
+def _post_from_row(msg_id, posted_at, text, stops, miles, dates, equipment):
+    if not stops:
+        return None
+    return LoadPost(
+        _decode_stops(stops), miles,
+        tuple(dates.split("|")) if dates else (), equipment,
+        text, msg_id, posted_at,
+    )
+
+
+@timed_db
+async def archive_posts(items, fingerprints=(), queue=()):
+    """
+    items: iterable of (msg_id, posted_at, text, LoadPost or None).
+    fingerprints: iterable of (fp, msg_id, seen_at) first seen in this batch.
+    queue: iterable of (msg_id, edited) to hand to the matcher (post_queue).
+    One transaction for the whole batch; re-archiving a msg_id (edit) replaces it.
+    """
+    items = list(items)
+    rows = [_archive_row(*item) for item in items]
+    fingerprints = list(fingerprints)
+    now = time.time()
+    queue = [(msg_id, int(edited), now) for msg_id, edited in queue]
+    if not rows and not fingerprints:
+        return
+    async with transaction() as db:
+        # Writers are serialized (BEGIN IMMEDIATE), so seqs never interleave
+        cur = await db.execute("SELECT COALESCE(MAX(archive_seq), 0) FROM channel_posts")
+        (seq,) = await cur.fetchone()
+        await db.executemany(
+            "INSERT OR REPLACE INTO channel_posts "
+            "(msg_id, posted_at, text, stops, miles, dates, equipment, archive_seq) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(*row, seq + i) for i, row in enumerate(rows, 1)],
+        )
+        await db.executemany(
+            "INSERT OR REPLACE INTO post_fingerprints (fp, msg_id, seen_at) VALUES (?, ?, ?)",
+            fingerprints,
+        )
+        await db.executemany(
+            "INSERT OR REPLACE INTO post_queue (msg_id, edited, queued_at) VALUES (?, ?, ?)",
+            queue,
+        )
+        await _record_lanes(db, items)
+
+
+@timed_db
+async def load_fingerprints(ttl: float, limit: int):
+    """
+    Fingerprints seen within ttl seconds, oldest first (at most limit).
+    Older rows are deleted.
+    """
+    cutoff = time.time() - ttl
+    async with transaction() as db:
+        await db.execute("DELETE FROM post_fingerprints WHERE seen_at < ?", (cutoff,))
+        cur = await db.execute(
+            "SELECT fp, msg_id, seen_at FROM post_fingerprints ORDER BY seen_at DESC LIMIT ?",
+            (limit,),
+        )
+        rows = await cur.fetchall()
+    rows.reverse()
+    return rows
+
+
+@timed_db
+async def get_last_archived_id() -> int:
+    async with transaction(write=False) as db:
+        cur = await db.execute("SELECT MAX(msg_id) FROM channel_posts")
+        (last,) = await cur.fetchone()
+    return last or 0
+
+
+@timed_db
+async def get_archived_ids(msg_ids) -> set:
+    """
+    The subset of msg_ids already in the archive.
+    """
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            "SELECT msg_id FROM channel_posts WHERE msg_id IN (SELECT value FROM json_each(?))",
+            (json.dumps(list(msg_ids)),),
+        )
+        return {r[0] for r in await cur.fetchall()}
+
+
+@timed_db
+async def get_archived_posts(limit: int = None, since: float = None):
+    """
+    Archived posts, oldest first, as [(msg_id, posted_at, text, LoadPost or None)].
+    limit: newest N posts; since: posts at/after this unix time. (Either or both.)
+    """
+    where = "WHERE posted_at >= ?" if since is not None else ""
+    params = (since,) if since is not None else ()
+    sql = (
+        "SELECT msg_id, posted_at, text, stops, miles, dates, equipment "
+        f"FROM channel_posts {where} ORDER BY msg_id DESC"
+    )
+    if limit is not None:
+        sql += " LIMIT ?"
+        params += (limit,)
+
+    async with transaction(write=False) as db:
+        cur = await db.execute(sql, params)
+        rows = await cur.fetchall()
+
+    return [(row[0], row[1], row[2], _post_from_row(*row)) for row in reversed(rows)]
+
+
+@timed_db
+async def get_archive_seq() -> int:
+    async with transaction(write=False) as db:
+        cur = await db.execute("SELECT MAX(archive_seq) FROM channel_posts")
+        (seq,) = await cur.fetchone()
+    return seq or 0
+
+
+@timed_db
+async def get_archive_changes(after_seq: int, limit: int):
+    """
+    Posts archived or re-archived (edits, catch-up gap fills) after
+    archive_seq `after_seq`, in archive order, as (rows, last seq) with
+    rows shaped like get_archived_posts(). None instead of rows when there
+    are more than `limit` changes.
+    """
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            "SELECT msg_id, posted_at, text, stops, miles, dates, equipment, archive_seq "
+            "FROM channel_posts WHERE archive_seq > ? ORDER BY archive_seq LIMIT ?",
+            (after_seq, limit + 1),
+        )
+        rows = await cur.fetchall()
+        if len(rows) > limit:
+            cur = await db.execute("SELECT MAX(archive_seq) FROM channel_posts")
+            (last,) = await cur.fetchone()
+            return None, last
+    last = rows[-1][7] if rows else after_seq
+    return [(row[0], row[1], row[2], _post_from_row(*row[:7])) for row in rows], last
+
+
+@timed_db
+async def get_queued_posts(limit: int):
+    """
+    Matcher: oldest queued posts as
+    [(msg_id, edited, text, LoadPost or None, queued_at)].
+    Rows stay queued until enqueue_alerts_many(..., dequeue=msg_ids).
+    """
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            """
+            SELECT q.edited, p.msg_id, p.posted_at, p.text, p.stops, p.miles, p.dates, p.equipment, q.queued_at
+            FROM post_queue q JOIN channel_posts p ON p.msg_id = q.msg_id
+            ORDER BY q.queued_at, q.msg_id
+            LIMIT ?
+            """,
+            (limit,),
+        )
+        rows = await cur.fetchall()
+    return [(row[1], bool(row[0]), row[3], _post_from_row(*row[1:8]), row[8]) for row in rows]
+
+
+# ---------- Lane analytics ----------
+async def _record_lanes(db, items):
+    """
+    Counts archived loads into lane_days/lane_hours. lane_posts remembers
+    each msg_id's lane, so re-archiving a post only moves its counts when an
+    edit changed the lane (or made it stop being a load).
+    """
+    ids = json.dumps([item[0] for item in items])
+    cur = await db.execute(
+        "SELECT msg_id, day, hour, o_city, o_state, d_state FROM lane_posts "
+        "WHERE msg_id IN (SELECT value FROM json_each(?))",
+        (ids,),
+    )
+    seen = {row[0]: tuple(row[1:]) for row in await cur.fetchall()}
+
+    delta = {}   # (day, hour, o_city, o_state, d_state) -> +/- posts
+    changed = {}  # msg_id -> its lane after the batch (a batch may hold a msg_id twice)
+    for msg_id, posted_at, _text, post in items:
+        lane = lane_row(post, posted_at) if post is not None else None
+        prev = seen.get(msg_id)
+        if lane == prev:
+            continue
+        seen[msg_id] = changed[msg_id] = lane
+        if prev is not None:
+            delta[prev] = delta.get(prev, 0) - 1
+        if lane is not None:
+            delta[lane] = delta.get(lane, 0) + 1
+    await _apply_lane_delta(db, delta)
+    await db.executemany(
+        "INSERT OR REPLACE INTO lane_posts (msg_id, day, hour, o_city, o_state, d_state) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        [(msg_id, *lane) for msg_id, lane in changed.items() if lane is not None],
+    )
+    await db.executemany(
+        "DELETE FROM lane_posts WHERE msg_id=?",
+        [(msg_id,) for msg_id, lane in changed.items() if lane is None],
+    )
+
+
+async def _apply_lane_delta(db, delta: dict):
+    days, hours = {}, {}
+    for (day, hour, o_city, o_state, d_state), n in delta.items():
+        if n:
+            key = (day, o_city, o_state, d_state)
+            days[key] = days.get(key, 0) + n
+            key = (o_city, o_state, d_state, hour)
+            hours[key] = hours.get(key, 0) + n
+    await db.executemany(
+        "INSERT INTO lane_days (day, o_city, o_state, d_state, posts) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (day, o_city, o_state, d_state) DO UPDATE SET posts = posts + excluded.posts",
+        [(*key, n) for key, n in days.items() if n],
+    )
+    await db.executemany(
+        "INSERT INTO lane_hours (o_city, o_state, d_state, hour, posts) VALUES (?, ?, ?, ?, ?) "
+        "ON CONFLICT (o_city, o_state, d_state, hour) DO UPDATE SET posts = posts + excluded.posts",
+        [(*key, n) for key, n in hours.items() if n],
+    )
+
+
+async def _backfill_lane_stats(db):
+    """
+    One-off: count loads archived before lane analytics existed.
+    """
+    cur = await db.execute("SELECT 1 FROM lane_posts LIMIT 1")
+    if await cur.fetchone() is not None:
+        return
+    cur = await db.execute("SELECT msg_id, posted_at, stops FROM channel_posts WHERE stops IS NOT NULL")
+    items = [(msg_id, posted_at, None, LoadPost(_decode_stops(stops)))
+             for msg_id, posted_at, stops in await cur.fetchall()]
+    if items:
+        await _record_lanes(db, items)
+
+
+@timed_db
+async def get_lane_counts(since_day: str = None):
+    """
+    [(o_city, o_state, d_state, posts)] summed over lane_days from since_day
+    ("YYYY-MM-DD", inclusive; None = all time).
+    """
+    where = "WHERE day >= ?" if since_day is not None else ""
+    params = (since_day,) if since_day is not None else ()
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            "SELECT o_city, o_state, d_state, SUM(posts) FROM lane_days "
+            f"{where} GROUP BY o_city, o_state, d_state HAVING SUM(posts) > 0",
+            params,
+        )
+        return await cur.fetchall()
+
+
+@timed_db
+async def get_lane_hours():
+    """
+    [(o_city, o_state, d_state, hour, posts)], all time.
+    """
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            "SELECT o_city, o_state, d_state, hour, posts FROM lane_hours WHERE posts > 0"
+        )
+        return await cur.fetchall()
+
+
+# ---------- Latency ledger ----------
+LATENCY_LEDGER_KEEP_DAYS = 7
+LATENCY_HIST_KEEP_DAYS = 90
+
+
+@timed_db
+async def append_latency(rows):
+    """
+    rows: [(sent_at, post_id, user_id, channel_ms, match_ms, send_ms, total_ms)]
+    (latency.LatencyLedger). Appends them and adds them to the hourly
+    histograms in one transaction; prunes old rows once per hour.
+    """
+    hist = {}
+    for row in rows:
+        hour = hour_of(row[0])
+        for stage, ms in zip(STAGES, row[3:]):
+            key = (hour, stage, bucket(ms))
+            hist[key] = hist.get(key, 0) + 1
+    now = time.time()
+    async with transaction() as db:
+        await db.executemany(
+            "INSERT INTO latency_ledger "
+            "(sent_at, post_id, user_id, channel_ms, match_ms, send_ms, total_ms) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        await db.executemany(
+            "INSERT INTO latency_hist (hour, stage, bucket, n) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (hour, stage, bucket) DO UPDATE SET n = n + excluded.n",
+            [(*key, n) for key, n in hist.items()],
+        )
+        if hour_of(now) != _latency_pruned_hour[0]:
+            _latency_pruned_hour[0] = hour_of(now)
+            await db.execute(
+                "DELETE FROM latency_ledger WHERE sent_at < ?",
+                (now - LATENCY_LEDGER_KEEP_DAYS * 86400,),
+            )
+            await db.execute(
+                "DELETE FROM latency_hist WHERE hour < ?",
+                (hour_of(now) - LATENCY_HIST_KEEP_DAYS * 24,),
+            )
+
+
+_latency_pruned_hour = [None]
+
+
+@timed_db
+async def get_latency_hists(since_hour: int):
+    """
+    {stage: {bucket: count}} summed over latency_hist from since_hour on.
+    """
+    async with transaction(write=False) as db:
+        cur = await db.execute(
+            "SELECT stage, bucket, SUM(n) FROM latency_hist WHERE hour >= ? GROUP BY stage, bucket",
+            (since_hour,),
+        )
+        rows = await cur.fetchall()
+    out = {}
+    for stage, b, n in rows:
+        out.setdefault(stage, {})[b] = n
+    return out
@@ -0,0 +1,69 @@
+"""
+Repost suppression.
+
+The channel often reposts the same load under a new message id. Each parsed
+post is reduced to a route fingerprint (stop sequence + miles + dates +
+equipment); a bounded LRU with a TTL remembers which msg_id first carried
+each fingerprint. Lookups and inserts are O(1).
+
+The cache is persisted (db.post_fingerprints) and reloaded on startup.
+"""
+import os
+import time
+import hashlib
+from collections import OrderedDict
+
+DEDUP_TTL = int(os.getenv("DEDUP_TTL", str(12 * 3600)))   # secs a fingerprint is remembered
+DEDUP_MAX = int(os.getenv("DEDUP_MAX", "20000"))           # max fingerprints kept
+
+
+def fingerprint(post) -> str:
+    parts = ["|".join(f"{c},{s}" for c, s in post.stops)]
+    parts.append(str(post.miles or ""))
+    parts.append("|".join(post.dates))
+    parts.append(post.equipment or "")
+    # " ".join(split()) folds spacing differences inside city names
+    raw = " ".join("#".join(parts).split())
+    return hashlib.blake2b(raw.encode(), digest_size=8).hexdigest()
+
+
+class RouteDeduper:
+    def __init__(self, maxsize: int = DEDUP_MAX, ttl: float = DEDUP_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._seen = OrderedDict()  # fp -> (msg_id, seen_at), least recently hit first
+
+    def __len__(self):
+        return len(self._seen)
+
+    def load(self, rows):
+        """
+        rows: (fp, msg_id, seen_at) oldest first.
+        """
+        for fp, msg_id, seen_at in rows:
+            self._put(fp, msg_id, seen_at)
+
+    def check(self, fp: str, msg_id: int, now: float = None):
+        """
+        Returns the msg_id that already carried this fingerprint (a repost),
+        or None after recording (fp -> msg_id) as new.
+        The same msg_id seen again (replay, edit) is never a duplicate.
+        """
+        now = time.time() if now is None else now
+        hit = self._seen.get(fp)
+        if hit is not None:
+            first_id, seen_at = hit
+            if now - seen_at <= self.ttl:
+                # A hot lane's reposts keep its fingerprint from being evicted
+                self._seen.move_to_end(fp)
+                if first_id != msg_id:
+                    return first_id
+                return None
+        self._put(fp, msg_id, now)
+        return None
+
+    def _put(self, fp: str, msg_id: int, seen_at: float):
+        self._seen[fp] = (msg_id, seen_at)
+        self._seen.move_to_end(fp)
+        while len(self._seen) > self.maxsize:
+            self._seen.popitem(last=False)
@@ -0,0 +1,147 @@
+"""
+Per-user alert coalescing.
+
+Delivery policies (user_config.delivery):
+  instant - one message per matched post (default)
+  digest  - matches within digest_secs of the first one go out as ONE
+            compact message when the window closes
+  first   - the first match goes out instantly; further matches within
+            digest_secs are collected into one digest
+
+The Coalescer only buffers (text, outbox_id) pairs and runs one timer per
+open window; the outbox rows stay pending until the digest is acked, so a
+restart loses nothing.
+"""
+import asyncio
+
+from route_parser import parse_post
+
+DELIVERY_MODES = ("instant", "digest", "first")
+DIGEST_SECS_DEFAULT = 60
+DIGEST_SECS_MIN = 10
+DIGEST_SECS_MAX = 300      # must stay well under a sender's OUTBOX_LEASE
+DIGEST_MAX_CHARS = 3900    # Telegram caps a message at 4096
+
+
+def parse_delivery_arg(text: str):
+    """
+    "instant" | "digest [secs]" | "first [secs]" -> (mode, secs).
+    Raises ValueError.
+    """
+    parts = (text or "").strip().lower().split()
+    if not parts or parts[0] not in DELIVERY_MODES:
+        raise ValueError(f"Mode must be one of: {', '.join(DELIVERY_MODES)}")
+    mode = parts[0]
+    secs = DIGEST_SECS_DEFAULT
+    if len(parts) > 1:
+        try:
+            secs = int(parts[1].rstrip("s"))
+        except ValueError:
+            raise ValueError("Window must be a number of seconds.") from None
+    if not DIGEST_SECS_MIN <= secs <= DIGEST_SECS_MAX:
+        raise ValueError(f"Window must be {DIGEST_SECS_MIN}-{DIGEST_SECS_MAX} seconds.")
+    return mode, secs
+
+
+def describe_delivery(mode: str, secs: int) -> str:
+    if mode == "digest":
+        return f"digest every {secs}s"
+    if mode == "first":
+        return f"first instant, then digest for {secs}s"
+    return "instant"
+
+
+def _title(city: str) -> str:
+    return " ".join(w.capitalize() for w in city.split())
+
+
+def compact_line(text: str) -> str:
+    """
+    One digest line for an alert: route, miles, first date, equipment.
+    """
+    post = parse_post(text)
+    if post is None:
+        body = [ln for ln in text.splitlines() if ln.strip()]
+        return "• " + (body[-1][:80] if body else "(empty)")
+
+    (o_city, o_st), (d_city, d_st) = post.origin, post.destination
+    parts = [f"{_title(o_city)}, {o_st} → {_title(d_city)}, {d_st}"]
+    if len(post.stops) > 2:
+        parts[0] += f" ({len(post.stops)} stops)"
+    if post.miles:
+        parts.append(f"{post.miles:,} mi")
+    if post.dates:
+        parts.append(post.dates[0])
+    if post.equipment:
+        parts.append(post.equipment.title())
+    return "• " + " · ".join(parts)
+
+
+def format_digest(texts, secs: int):
+    """
+    Returns [(message, count)]: texts rendered as compact lines, split so
+    every message fits under DIGEST_MAX_CHARS.
+    """
+    lines = [compact_line(t) for t in texts]
+    header = f"🚚 {len(lines)} LOAD MATCHES (last {secs}s)\n\n"
+    out, chunk, size = [], [], len(header)
+    for line in lines:
+        if chunk and size + len(line) + 1 > DIGEST_MAX_CHARS:
+            out.append((header + "\n".join(chunk), len(chunk)))
+            chunk, size = [], len(header)
+        chunk.append(line)
+        size += len(line) + 1
+    if chunk:
+        out.append((header + "\n".join(chunk), len(chunk)))
+    return out
+
+
+class _Window:
+    __slots__ = ("secs", "items", "handle")
+
+    def __init__(self, secs: int):
+        self.secs = secs
+        self.items = []      # (text, outbox_id)
+        self.handle = None
+
+
+class Coalescer:
+    def __init__(self, emit):
+        """
+        emit: callable(chat_id, text, outbox_ids) used when a window closes.
+        """
+        self.emit = emit
+        self._open = {}  # chat_id -> _Window
+
+    def offer(self, chat_id: int, mode: str, secs: int, text: str, outbox_id) -> bool:
+        """
+        True if the alert was buffered, False if the caller sends it now.
+        """
+        if mode not in ("digest", "first"):
+            return False
+        w = self._open.get(chat_id)
+        if w is None:
+            w = self._open[chat_id] = _Window(secs)
+            w.handle = asyncio.get_running_loop().call_later(secs, self._flush, chat_id)
+            if mode == "first":
+                return False
+        w.items.append((text, outbox_id))
+        return True
+
+    def _flush(self, chat_id: int):
+        w = self._open.pop(chat_id, None)
+        if w is None or not w.items:
+            return
+        texts = [t for t, _ in w.items]
+        ids = [i for _, i in w.items]
+        for message, n in format_digest(texts, w.secs):
+            self.emit(chat_id, message, [i for i in ids[:n] if i is not None])
+            ids = ids[n:]
+
+    def cancel(self):
+        """
+        Drop open windows; their outbox rows stay pending for the next run.
+        """
+        for w in self._open.values():
+            w.handle.cancel()
+        self._open.clear()
@@ -0,0 +1,309 @@
+"""
+Alert fan-out dispatcher.
+
+A bounded queue feeds several sender tasks so one slow send_message no longer
+delays every user behind it. Sends are paced by a global token bucket
+(Telegram allows a bot ~30 msg/s overall) and a per-chat gap (~1 msg/s per
+chat). Flood waits (RetryAfter) pause the bucket and requeue the alert instead
+of dropping it.
+
+Alerts may carry an outbox row id (db.alert_outbox). Delivery results are
+handed back in batches to an ack callback, so the outbox is updated with one
+write per ACK_INTERVAL instead of one per alert.
+
+Users with a digest delivery policy are routed through a Coalescer
+(digest.py): their matches go out as one compact message per window, and
+that single send acks all the outbox rows it covers.
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+
+from telegram.error import RetryAfter, Forbidden, BadRequest, TimedOut, NetworkError
+
+from digest import Coalescer
+from metrics import SEND_SECONDS, SEND_FAILURES, FANOUT_SECONDS
+
+log = logging.getLogger(__name__)
+
+SEND_RATE = float(os.getenv("SEND_RATE", "30"))                    # msgs/sec, whole bot
+SEND_CHAT_INTERVAL = float(os.getenv("SEND_CHAT_INTERVAL", "1.0"))  # secs between msgs to one chat
+SEND_WORKERS = int(os.getenv("SEND_WORKERS", "8"))
+SEND_QUEUE_SIZE = int(os.getenv("SEND_QUEUE_SIZE", "10000"))
+MAX_ATTEMPTS = 5
+ACK_INTERVAL = 0.5  # secs between batched outbox acks
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """
+        Global flood wait: nobody sends until it expires.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class FanoutStats:
+    """
+    Completion metrics for one post's fan-out.
+    """
+    __slots__ = ("post_id", "total", "sent", "failed", "started", "first_sent", "last_sent", "finished", "stamps")
+
+    def __init__(self, post_id, total: int, started: float = None, stamps=None):
+        self.post_id = post_id
+        self.stamps = stamps   # (posted, received, matched) wall clock, see latency.py
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.started = started if started is not None else time.monotonic()
+        self.first_sent = None
+        self.last_sent = None
+        self.finished = None
+
+    @property
+    def done(self) -> bool:
+        return self.sent + self.failed >= self.total
+
+    def as_dict(self) -> dict:
+        def ms(t):
+            return None if t is None else round((t - self.started) * 1000, 1)
+
+        return {
+            "post_id": self.post_id,
+            "total": self.total,
+            "sent": self.sent,
+            "failed": self.failed,
+            "first_ms": ms(self.first_sent),
+            "last_ms": ms(self.last_sent),
+            "done_ms": ms(self.finished),
+        }
+
+
+class AlertJob:
+    __slots__ = ("chat_id", "text", "attempts", "stats", "outbox_ids", "slot")
+
+    def __init__(self, chat_id: int, text: str, stats: FanoutStats, outbox_ids=()):
+        self.chat_id = chat_id
+        self.text = text
+        self.attempts = 0
+        self.stats = stats
+        self.outbox_ids = outbox_ids  # one id per alert; several for a digest
+        self.slot = None              # reserved per-chat send time while parked
+
+
+class Dispatcher:
+    def __init__(self, bot, workers: int = SEND_WORKERS, rate: float = SEND_RATE,
+                 chat_interval: float = SEND_CHAT_INTERVAL, queue_size: int = SEND_QUEUE_SIZE,
+                 ack=None, policy=None, ledger=None):
+        """
+        ack: optional async callable(sent_outbox_ids, failed_outbox_ids)
+        policy: optional callable(chat_id) -> (delivery_mode, digest_secs) or
+                None for instant delivery
+        ledger: optional latency.LatencyLedger; gets every instant alert sent
+                for a post submitted with stamps
+        """
+        self.bot = bot
+        self.ack = ack
+        self.policy = policy
+        self.ledger = ledger
+        self.coalescer = Coalescer(self._emit_digest)
+        self.workers = workers
+        self.chat_interval = chat_interval
+        self.bucket = TokenBucket(rate)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.recent = deque(maxlen=100)  # last completed FanoutStats
+        self._chat_next = {}             # chat_id -> monotonic time of next allowed send
+        self._acked_sent = []
+        self._acked_failed = []
+        self._tasks = []
+
+    # ---------- Lifecycle ----------
+    def start(self):
+        for i in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"sender-{i}"))
+        if self.ack is not None:
+            self._tasks.append(asyncio.create_task(self._ack_loop(), name="sender-acks"))
+
+    async def stop(self):
+        self.coalescer.cancel()
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        await self._flush_acks()
+
+    # ---------- Producer ----------
+    async def submit(self, post_id, text: str, chat_ids, outbox_ids=None, received: float = None,
+                     stamps=None) -> FanoutStats:
+        """
+        Queue one alert per chat (outbox_ids, if given, is parallel to chat_ids).
+        received: time.monotonic() when the post arrived (fan-out latency origin).
+        stamps: (posted, received, matched) for the latency ledger, or None.
+        Returns the post's FanoutStats right away.
+        Awaits only if the queue is full (backpressure).
+        """
+        chat_ids = list(chat_ids)
+        outbox_ids = list(outbox_ids) if outbox_ids is not None else [None] * len(chat_ids)
+        instant = []
+        for chat_id, outbox_id in zip(chat_ids, outbox_ids):
+            policy = self.policy(chat_id) if self.policy is not None else None
+            if policy is not None and self.coalescer.offer(chat_id, *policy, text, outbox_id):
+                continue
+            instant.append((chat_id, outbox_id))
+
+        stats = FanoutStats(post_id, len(instant), received, stamps)
+        for chat_id, outbox_id in instant:
+            ids = (outbox_id,) if outbox_id is not None else ()
+            await self.queue.put(AlertJob(chat_id, text, stats, ids))
+        return stats
+
+    def _emit_digest(self, chat_id: int, text: str, outbox_ids):
+        job = AlertJob(chat_id, text, FanoutStats("digest", 1), tuple(outbox_ids))
+        asyncio.ensure_future(self.queue.put(job))
+
+    # ---------- Workers ----------
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                # Per-chat pacing: reserve this chat's next slot; if it is in the
+                # future park the job instead of blocking the worker. A parked
+                # job keeps its slot (reserving again would push it back forever).
+                now = time.monotonic()
+                ready_at = job.slot
+                if ready_at is None:
+                    ready_at = max(now, self._chat_next.get(job.chat_id, 0.0))
+                    self._chat_next[job.chat_id] = ready_at + self.chat_interval
+                if ready_at > now:
+                    job.slot = ready_at
+                    self._requeue_later(job, ready_at - now)
+                    continue
+                job.slot = None
+
+                await self.bucket.acquire()
+                await self._send(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("dispatcher worker error (chat_id=%s)", job.chat_id)
+                self._done(job, ok=False)
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, job: AlertJob):
+        job.attempts += 1
+        t = time.perf_counter()
+        try:
+            await self.bot.send_message(chat_id=job.chat_id, text=job.text)
+        except Exception as e:
+            SEND_SECONDS.observe(time.perf_counter() - t)
+            SEND_FAILURES.inc(type(e).__name__)
+            self._failed(job, e)
+        else:
+            SEND_SECONDS.observe(time.perf_counter() - t)
+            self._done(job, ok=True)
+
+    def _failed(self, job: AlertJob, exc: Exception):
+        if isinstance(exc, RetryAfter):
+            delay = _seconds(exc.retry_after)
+            log.warning("flood wait %.1fs (chat_id=%s)", delay, job.chat_id)
+            self.bucket.pause(delay)
+            self._retry(job, delay)
+        elif isinstance(exc, (Forbidden, BadRequest)):
+            # User blocked the bot / chat gone: retrying won't help
+            log.info("alert dropped for chat_id=%s: %s", job.chat_id, exc)
+            self._done(job, ok=False)
+        elif isinstance(exc, (TimedOut, NetworkError)):
+            self._retry(job, min(2 ** job.attempts, 30))
+        else:
+            log.error("send_message to chat_id=%s failed: %r", job.chat_id, exc)
+            self._done(job, ok=False)
+
+    def _retry(self, job: AlertJob, delay: float):
+        if job.attempts >= MAX_ATTEMPTS:
+            log.warning("alert to chat_id=%s failed after %d attempts", job.chat_id, job.attempts)
+            self._done(job, ok=False)
+            return
+        self._requeue_later(job, delay)
+
+    def _requeue_later(self, job: AlertJob, delay: float):
+        loop = asyncio.get_running_loop()
+        loop.call_later(delay, lambda: asyncio.ensure_future(self.queue.put(job)))
+
+    def _done(self, job: AlertJob, ok: bool):
+        if job.outbox_ids:
+            (self._acked_sent if ok else self._acked_failed).extend(job.outbox_ids)
+
+        stats = job.stats
+        now = time.monotonic()
+        if ok:
+            stats.sent += 1
+            if stats.first_sent is None:
+                stats.first_sent = now
+            stats.last_sent = now
+            if stats.stamps is not None and self.ledger is not None:
+                self.ledger.record(stats.post_id, job.chat_id, stats.stamps, time.time())
+        else:
+            stats.failed += 1
+
+        if stats.done and stats.finished is None:
+            stats.finished = now
+            if stats.last_sent is not None:
+                FANOUT_SECONDS.observe(stats.last_sent - stats.started)
+            self.recent.append(stats)
+            log.info("fan-out done: %s", stats.as_dict())
+
+    # ---------- Outbox acks ----------
+    async def _ack_loop(self):
+        while True:
+            await asyncio.sleep(ACK_INTERVAL)
+            try:
+                await self._flush_acks()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                log.exception("outbox ack flush failed")
+
+    async def _flush_acks(self):
+        if self.ack is None or not (self._acked_sent or self._acked_failed):
+            return
+        sent, self._acked_sent = self._acked_sent, []
+        failed, self._acked_failed = self._acked_failed, []
+        try:
+            await self.ack(sent, failed)
+        except BaseException:
+            # Put them back; worst case they are re-sent after a restart (at-least-once)
+            self._acked_sent = sent + self._acked_sent
+            self._acked_failed = failed + self._acked_failed
+            raise
+
+
+def _seconds(value) -> float:
+    # PTB exposes retry_after as int seconds (or timedelta in newer releases)
+    if hasattr(value, "total_seconds"):
+        return value.total_seconds()
+    return float(value)
@@ -0,0 +1,155 @@
+"""
+Offline city gazetteer + radius-origin index.
+
+us_cities.csv (bundled) is loaded once into parallel arrays (lat/lon as
+array('d')), with a dict from canonical (CITY, ST) (see cities.py) to row
+number, so resolving a post's first stop to coordinates is a single dict hit.
+
+Radius rules ("within 75 miles of Louisville, KY") are grouped by their
+centre city. Centres are bucketed on a 1-degree lat/lon grid, and for every
+origin city we memoize the centres within RADIUS_MAX_MILES (with their
+distances). Matching a post is then: memo lookup -> per centre, take the
+prefix of its rules (sorted by radius, largest first) whose radius covers
+that distance. Cost depends on nearby centres, not on the number of users.
+"""
+import os
+import csv
+import math
+from array import array
+
+from cities import CANON
+
+GAZETTEER_PATH = os.getenv(
+    "GAZETTEER_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "us_cities.csv")
+)
+RADIUS_MAX_MILES = 250
+EARTH_RADIUS_MILES = 3958.8
+CELL_DEG = 1.0
+
+def _cell(lat: float, lon: float):
+    return (math.floor(lat / CELL_DEG), math.floor(lon / CELL_DEG))
+
+
+class Gazetteer:
+    def __init__(self, rows):
+        """
+        rows: (CITY, ST, lat, lon)
+        """
+        self.names = []          # row -> (CITY, ST)
+        self.lat = array("d")    # radians
+        self.lon = array("d")
+        self.cos_lat = array("d")
+        self._rows = {}          # canonical (CITY, ST) -> row
+        for city, st, lat, lon in rows:
+            key = CANON.canonical(city, st.upper())
+            if key in self._rows:
+                continue
+            self._rows[key] = len(self.names)
+            self.names.append(key)
+            self.lat.append(math.radians(lat))
+            self.lon.append(math.radians(lon))
+            self.cos_lat.append(math.cos(math.radians(lat)))
+
+    @classmethod
+    def load(cls, path: str = GAZETTEER_PATH):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = [(r["city"], r["state"], float(r["lat"]), float(r["lon"])) for r in csv.DictReader(f)]
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.names)
+
+    def lookup(self, city: str, st: str):
+        """
+        Row number for a city, or None if it isn't in the gazetteer.
+        """
+        return self._rows.get(CANON.canonical(city, st.upper()))
+
+    def distance(self, a: int, b: int) -> float:
+        """
+        Great-circle miles between two rows (haversine).
+        """
+        dlat = self.lat[b] - self.lat[a]
+        dlon = self.lon[b] - self.lon[a]
+        h = math.sin(dlat / 2) ** 2 + self.cos_lat[a] * self.cos_lat[b] * math.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_MILES * math.asin(min(1.0, math.sqrt(h)))
+
+    def cell(self, row: int):
+        return _cell(math.degrees(self.lat[row]), math.degrees(self.lon[row]))
+
+    def cells_within(self, row: int, miles: float):
+        """
+        Grid cells that may hold points within `miles` of row.
+        """
+        lat = math.degrees(self.lat[row])
+        lon = math.degrees(self.lon[row])
+        dlat = miles / 69.0
+        dlon = miles / max(1.0, 69.17 * self.cos_lat[row])
+        lat0, lon0 = _cell(lat - dlat, lon - dlon)
+        lat1, lon1 = _cell(lat + dlat, lon + dlon)
+        for i in range(lat0, lat1 + 1):
+            for j in range(lon0, lon1 + 1):
+                yield (i, j)
+
+
+class RadiusIndex:
+    def __init__(self, gazetteer: Gazetteer):
+        self.gaz = gazetteer
+        self.rules = {}     # centre row -> {user_id: miles}
+        self.grid = {}      # cell -> set(centre row)
+        self._sorted = {}   # centre row -> [(miles, user_id)] largest first (built lazily)
+        self._near = {}     # origin row -> [(centre row, distance)] (reset when centres change)
+
+    def add(self, user_id: int, centre: int, miles: int):
+        users = self.rules.get(centre)
+        if users is None:
+            users = self.rules[centre] = {}
+            self.grid.setdefault(self.gaz.cell(centre), set()).add(centre)
+            self._near.clear()
+        users[user_id] = miles
+        self._sorted.pop(centre, None)
+
+    def remove(self, user_id: int, centre: int):
+        users = self.rules.get(centre)
+        if users is None or users.pop(user_id, None) is None:
+            return
+        self._sorted.pop(centre, None)
+        if not users:
+            del self.rules[centre]
+            cell = self.gaz.cell(centre)
+            self.grid[cell].discard(centre)
+            if not self.grid[cell]:
+                del self.grid[cell]
+            self._near.clear()
+
+    def _centres_near(self, origin: int):
+        near = self._near.get(origin)
+        if near is None:
+            near = []
+            for cell in self.gaz.cells_within(origin, RADIUS_MAX_MILES):
+                for centre in self.grid.get(cell, ()):
+                    d = self.gaz.distance(origin, centre)
+                    if d <= RADIUS_MAX_MILES:
+                        near.append((centre, d))
+            self._near[origin] = near
+        return near
+
+    def match(self, origin: int):
+        """
+        user_ids with a radius rule covering gazetteer row `origin`.
+        """
+        out = set()
+        for centre, d in self._centres_near(origin):
+            ranked = self._sorted.get(centre)
+            if ranked is None:
+                ranked = self._sorted[centre] = sorted(
+                    ((m, u) for u, m in self.rules[centre].items()), reverse=True
+                )
+            for miles, user_id in ranked:
+                if miles < d:
+                    break
+                out.add(user_id)
+        return out
+
+
+GAZETTEER = Gazetteer.load()
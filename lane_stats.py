@@ -0,0 +1,75 @@
+"""
+Lane analytics: which lanes the channel posts, and at what time of day.
+
+Every archived load is recorded once in lane_posts (db.py) and counted into
+two rollups, updated incrementally in the same write as the archive:
+  lane_days  - (day, lane) -> posts      top lanes over a window
+  lane_hours - (lane, hour) -> posts     time-of-day histogram (all time)
+A lane is (FIRST stop city, FIRST stop state, LAST stop state). /stats only
+sums rollup rows, so it stays fast however long the archive gets.
+
+Day/hour are local time of the process (set TZ in the container to change it).
+"""
+import time
+from collections import Counter
+
+STATS_DEFAULT_DAYS = 30
+STATS_MAX_DAYS = 366
+TOP_LANES = 10
+TOP_CITIES = 3
+BAR_WIDTH = 16
+
+
+def bucket(posted_at: float):
+    """
+    Unix time -> ("YYYY-MM-DD", hour) in local time.
+    """
+    lt = time.localtime(posted_at)
+    return time.strftime("%Y-%m-%d", lt), lt.tm_hour
+
+
+def lane_row(post, posted_at: float):
+    """
+    (day, hour, o_city, o_state, d_state) for a LoadPost.
+    """
+    (o_city, o_state), (_d_city, d_state) = post.origin, post.destination
+    return (*bucket(posted_at), o_city, o_state, d_state)
+
+
+def since_day(days: int) -> str:
+    return bucket(time.time() - (days - 1) * 86400)[0]
+
+
+def _title(city: str) -> str:
+    return " ".join(w.capitalize() for w in city.split())
+
+
+def format_stats(lanes, hours, days: int, scope: str) -> str:
+    """
+    lanes: [(o_city, o_state, d_state, posts)] within the window
+    hours: {hour: posts} (all time)
+    """
+    by_pair = Counter()
+    cities = {}
+    for o_city, o_state, d_state, posts in lanes:
+        by_pair[(o_state, d_state)] += posts
+        cities.setdefault((o_state, d_state), Counter())[o_city] += posts
+    total = sum(by_pair.values())
+
+    lines = [f"📈 Lane stats: {scope}", f"Loads in the last {days} days: {total:,}", ""]
+    if by_pair:
+        lines.append("Top lanes:")
+        for (o_state, d_state), posts in by_pair.most_common(TOP_LANES):
+            top = ", ".join(f"{_title(c)} {n}" for c, n in cities[(o_state, d_state)].most_common(TOP_CITIES))
+            lines.append(f"{o_state} → {d_state}: {posts:,} ({top})")
+    else:
+        lines.append("No loads in this window.")
+
+    peak = max(hours.values(), default=0)
+    if peak:
+        lines += ["", "Time of day (all time):"]
+        for hour in range(24):
+            n = hours.get(hour, 0)
+            bar = "▇" * round(BAR_WIDTH * n / peak)
+            lines.append(f"{hour:02d} {bar} {n:,}" if n else f"{hour:02d} ·")
+    return "\n".join(lines)
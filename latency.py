@@ -0,0 +1,151 @@
+"""
+Alert latency ledger.
+
+Every alert sent for a live post carries four wall-clock stamps:
+  posted   - the post's channel timestamp (whole seconds, from Telegram)
+  received - on_new_message got it (listener: when it was queued)
+  matched  - the alert was written to the outbox
+  sent     - send_message returned
+LatencyLedger.record() only appends a tuple to a list; a background task
+flushes the buffer every LATENCY_FLUSH_INTERVAL with ONE transaction
+(db.append_latency) that appends the rows to latency_ledger and folds them
+into hourly histograms (latency_hist), so /latency never scans raw rows.
+
+Stages: channel (posted -> received), match (received -> matched),
+send (matched -> sent), total (posted -> sent). Histogram buckets grow by
+BUCKET_STEP (10%), so reported percentiles are within 10% of the truth.
+
+Not recorded: digests (delayed on purpose) and alerts for edited posts
+(their channel timestamp is the original post's).
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+
+log = logging.getLogger(__name__)
+
+LATENCY_FLUSH_INTERVAL = float(os.getenv("LATENCY_FLUSH_INTERVAL", "5"))  # secs
+LATENCY_BUFFER_MAX = 50000       # rows; newer ones are dropped while the DB is stuck
+STAGES = ("channel", "match", "send", "total")
+WINDOWS = {"1h": 1, "6h": 6, "24h": 24, "7d": 24 * 7, "30d": 24 * 30}
+BUCKET_STEP = 1.1
+_LOG_STEP = math.log(BUCKET_STEP)
+
+
+def bucket(ms: float) -> int:
+    """
+    Histogram bucket for a duration; 0 holds everything under 1 ms.
+    """
+    if ms < 1:
+        return 0
+    return int(math.log(ms) / _LOG_STEP) + 1
+
+
+def bucket_ms(b: int) -> float:
+    """
+    Upper bound of bucket b.
+    """
+    return 1.0 if b == 0 else BUCKET_STEP ** b
+
+
+def stage_ms(posted: float, received: float, matched: float, sent: float):
+    """
+    (channel, match, send, total) in whole ms; clock skew never goes negative.
+    """
+    return tuple(
+        max(0, round((b - a) * 1000))
+        for a, b in ((posted, received), (received, matched), (matched, sent), (posted, sent))
+    )
+
+
+def percentiles(hist: dict, qs=(0.5, 0.95, 0.99)):
+    """
+    hist: {bucket: count} -> [ms at each quantile] (bucket upper bounds).
+    """
+    total = sum(hist.values())
+    if not total:
+        return [None] * len(qs)
+    out = []
+    ranked = sorted(hist.items())
+    for q in qs:
+        need = max(1, math.ceil(q * total))
+        seen = 0
+        for b, n in ranked:
+            seen += n
+            if seen >= need:
+                out.append(bucket_ms(b))
+                break
+    return out
+
+
+def _fmt_ms(ms) -> str:
+    if ms is None:
+        return "-"
+    if ms < 1000:
+        return f"{ms:.0f}ms"
+    return f"{ms / 1000:.1f}s"
+
+
+def format_latency(hists: dict, window: str) -> str:
+    """
+    hists: {stage: {bucket: count}} for the window.
+    """
+    n = sum(hists.get("total", {}).values())
+    lines = [f"⏱ Alert latency, last {window} ({n:,} alerts)", "", "stage: p50 / p95 / p99"]
+    for stage in STAGES:
+        p50, p95, p99 = percentiles(hists.get(stage, {}))
+        lines.append(f"{stage}: {_fmt_ms(p50)} / {_fmt_ms(p95)} / {_fmt_ms(p99)}")
+    lines.append("")
+    lines.append("channel = Telegram post -> received, match = -> outbox, send = -> delivered")
+    return "\n".join(lines)
+
+
+class LatencyLedger:
+    def __init__(self, flush):
+        """
+        flush: async callable(rows) persisting
+               [(sent_at, post_id, user_id, channel_ms, match_ms, send_ms, total_ms)]
+        """
+        self._flush = flush
+        self._buf = []
+
+    def record(self, post_id, user_id: int, stamps, sent: float):
+        """
+        stamps: (posted, received, matched) wall-clock secs.
+        """
+        if len(self._buf) >= LATENCY_BUFFER_MAX:
+            return
+        self._buf.append((sent, post_id, user_id, *stage_ms(*stamps, sent)))
+
+    async def flush(self):
+        if not self._buf:
+            return
+        rows, self._buf = self._buf, []
+        try:
+            await self._flush(rows)
+        except BaseException:
+            self._buf = rows + self._buf
+            raise
+
+    async def run(self, interval: float = LATENCY_FLUSH_INTERVAL):
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.flush()
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    log.exception("latency ledger flush failed")
+        finally:
+            await self.flush()
+
+
+def hour_of(ts: float) -> int:
+    return int(ts // 3600)
+
+
+def since_hour(hours: int) -> int:
+    return hour_of(time.time()) - hours + 1
@@ -0,0 +1,197 @@
+"""
+Tiny Prometheus-style metrics (no client library needed).
+
+Counters and histograms live in process memory; start_server() exposes them
+in the Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics.
+"""
+import os
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))  # 0 disables the endpoint
+
+# Seconds; tuned for a pipeline whose steps range from µs (match) to s (fan-out)
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+REGISTRY = []
+
+
+def _label_str(names, values, extra=None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values tuple -> float
+        REGISTRY.append(self)
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for key, value in self.values.items():
+            yield f"{self.name}{_label_str(self.labels, key)} {value}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values tuple -> [bucket counts..., +Inf count, sum]
+        REGISTRY.append(self)
+
+    def observe(self, value: float, *label_values):
+        s = self.series.get(label_values)
+        if s is None:
+            s = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+        s[bisect_left(self.buckets, value)] += 1
+        s[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t, *label_values)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, s in self.series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, s):
+                cumulative += n
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_label_str(self.labels, key, le)} {cumulative}"
+            cumulative += s[len(self.buckets)]
+            le = 'le="+Inf"'
+            yield f"{self.name}_bucket{_label_str(self.labels, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_label_str(self.labels, key)} {s[-1]}"
+            yield f"{self.name}_count{_label_str(self.labels, key)} {cumulative}"
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- Alert pipeline ----------
+POSTS_SEEN = Counter("usps_posts_seen_total", "Channel posts received")
+POSTS_PARSED = Counter("usps_posts_parsed_total", "Channel posts with a route (2+ stops)")
+POSTS_DUPLICATE = Counter("usps_posts_duplicate_total", "Reposts suppressed by route fingerprint")
+MATCHES = Counter("usps_alert_matches_total", "Matched (post, user) pairs")
+SEND_FAILURES = Counter("usps_send_failures_total", "Failed send_message calls", ["exception"])
+
+PARSE_SECONDS = Histogram("usps_parse_seconds", "Post parse time")
+MATCH_SECONDS = Histogram("usps_match_seconds", "Subscription index lookup time per post")
+ENQUEUE_SECONDS = Histogram("usps_enqueue_seconds", "Outbox write time per post")
+SEND_SECONDS = Histogram("usps_send_seconds", "Single send_message latency")
+FANOUT_SECONDS = Histogram("usps_fanout_seconds", "Post received -> last alert sent")
+
+# ---------- Event loop / call timing ----------
+# Calls slower than these are logged (and counted in usps_slow_calls_total)
+SLOW_DB_SECONDS = float(os.getenv("SLOW_DB_SECONDS", "0.1"))
+SLOW_HANDLER_SECONDS = float(os.getenv("SLOW_HANDLER_SECONDS", "0.5"))
+
+DB_CALL_SECONDS = Histogram("usps_db_call_seconds", "db.py call duration", ["function"])
+HANDLER_SECONDS = Histogram("usps_handler_seconds", "Telethon/bot handler duration", ["handler"])
+SLOW_CALLS = Counter("usps_slow_calls_total", "Calls over their slow threshold", ["kind", "function"])
+LOOP_LAG_SECONDS = Histogram("usps_loop_lag_seconds", "Event loop scheduling delay (see profiling.py)")
+
+
+def timed(histogram: Histogram, kind: str, slow: float):
+    """
+    Decorator factory for coroutines: records histogram{<label>=fn name} and
+    logs calls taking longer than `slow` seconds.
+    """
+    def decorator(fn):
+        name = fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - t
+                histogram.observe(elapsed, name)
+                if elapsed > slow:
+                    SLOW_CALLS.inc(kind, name)
+                    log.warning("slow %s call %s: %.0f ms", kind, name, elapsed * 1000)
+
+        return wrapper
+
+    return decorator
+
+
+# db.py public coroutines: usps_db_call_seconds{function=...}. Not the
+# _helpers(db, ...) they call inside a transaction: that double-counts.
+timed_db = timed(DB_CALL_SECONDS, "db", SLOW_DB_SECONDS)
+# app.py handlers: usps_handler_seconds{handler=...}
+timed_handler = timed(HANDLER_SECONDS, "handler", SLOW_HANDLER_SECONDS)
+
+
+# ---------- HTTP endpoint ----------
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain headers
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """
+    Starts the /metrics endpoint on the running loop. Returns the server
+    (or None when METRICS_PORT=0).
+    """
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    log.info("metrics on http://%s:%d/metrics", host, port)
+    return server
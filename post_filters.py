@@ -0,0 +1,282 @@
+"""
+Post filters: narrow a user's alerts on fields other than the route.
+
+Filter kinds (stored one row per value in user_filters, see db.py):
+  miles_min / miles_max  - trip length range ("miles 300-900", "miles 300+")
+  days                   - pickup (first date in the post) at most N days
+                           after the post
+  equipment              - any of these in the post's equipment phrase
+  keyword                - any of these words in the post text
+  exclude                - none of these words in the post text
+A post that doesn't state miles, dates or equipment passes that check:
+the parser missing a field should never drop an alert.
+
+Filters never add users. SubscriptionIndex.match() runs them only on the
+users its origin/route indexes already selected, and only for users that
+have filters. Each user's filters are compiled once, when they change,
+into a PostFilter: a tuple of checks ordered cheapest first (integer
+compares, then the short equipment phrase, then regex scans of the text).
+The first failing check ends the evaluation. Identical rule sets share one
+PostFilter, and per-post facts (miles, pickup offset) and each distinct
+PostFilter's verdict are worked out once per post, not once per user.
+"""
+import re
+import time
+import weakref
+from functools import lru_cache
+
+FILTER_MAX_VALUES = 20          # per list kind (equipment / keyword / exclude)
+FILTER_MAX_DAYS = 60
+FILTER_MAX_MILES = 10000
+_SINGLE = ("miles_min", "miles_max", "days")          # one value per user; adding replaces
+_LISTS = ("equipment", "keyword", "exclude")
+FILTER_KINDS = _SINGLE + _LISTS
+
+FILTER_HELP = (
+    "Filters narrow your alerts (posts that don't state a field still pass). Send one of:\n"
+    "miles 300-900 or miles 300+ - trip length\n"
+    "days 2 - pickup within 2 days of the post\n"
+    "equipment reefer - any listed equipment\n"
+    "keyword hazmat - any listed word in the post\n"
+    "exclude team - none of these words in the post\n"
+    "Remove with: /filter remove miles (or remove keyword hazmat), /filter clear"
+)
+
+
+def _words(text: str) -> str:
+    value = " ".join((text or "").upper().split())
+    if not value:
+        raise ValueError("Missing value.")
+    if len(value) > 40:
+        raise ValueError("Keep it under 40 characters.")
+    return value
+
+
+def _int(text: str, hi: int) -> int:
+    try:
+        n = int(text.replace(",", ""))
+    except ValueError:
+        raise ValueError(f"Expected a number, got '{text}'.") from None
+    if not 0 <= n <= hi:
+        raise ValueError(f"Use a number from 0 to {hi}.")
+    return n
+
+
+def parse_filter_arg(text: str):
+    """
+    "miles 300-900" | "miles 300+" | "days 2" | "equipment reefer" |
+    "keyword hazmat" | "exclude team" -> [(kind, value)] with value as
+    stored (str). Raises ValueError.
+    """
+    name, _, rest = (text or "").strip().partition(" ")
+    name, rest = name.lower(), rest.strip()
+    if name == "miles":
+        m = re.fullmatch(r"([\d,]+)\s*(?:-\s*([\d,]+)|\+)", rest)
+        if not m:
+            raise ValueError("Use: miles 300-900 or miles 300+")
+        lo = _int(m.group(1), FILTER_MAX_MILES)
+        if m.group(2) is None:
+            return [("miles_min", str(lo))]
+        hi = _int(m.group(2), FILTER_MAX_MILES)
+        if hi < lo:
+            raise ValueError("The first number must be the smaller one.")
+        return [("miles_min", str(lo)), ("miles_max", str(hi))]
+    if name == "days":
+        return [("days", str(_int(rest, FILTER_MAX_DAYS)))]
+    if name in _LISTS:
+        return [(name, _words(rest))]
+    raise ValueError("Start with miles, days, equipment, keyword or exclude.")
+
+
+def parse_filter_remove(text: str):
+    """
+    "miles" | "days" | "keyword" | "keyword hazmat" -> (kinds, value or None).
+    """
+    name, _, rest = (text or "").strip().partition(" ")
+    name = name.lower()
+    if name == "miles":
+        return ("miles_min", "miles_max"), None
+    if name == "days":
+        return ("days",), None
+    if name in _LISTS:
+        return (name,), (_words(rest) if rest.strip() else None)
+    raise ValueError("Remove miles, days, equipment, keyword or exclude.")
+
+
+def replaced_kinds(rules) -> set:
+    """
+    Kinds whose old values adding `rules` replaces (a miles range replaces
+    both ends).
+    """
+    replaced = {kind for kind, _value in rules if kind in _SINGLE}
+    if replaced & {"miles_min", "miles_max"}:
+        replaced |= {"miles_min", "miles_max"}
+    return replaced
+
+
+def merge_filters(current, rules):
+    """
+    A user's filters after adding `rules` -> (sorted rules, kinds replaced).
+    Single-valued kinds replace the old value; list kinds accumulate up to
+    FILTER_MAX_VALUES. Idempotent (current may already include rules).
+    Raises ValueError.
+    """
+    replaced = replaced_kinds(rules)
+    merged = sorted({r for r in current if r[0] not in replaced} | set(rules))
+    for kind in _LISTS:
+        if sum(1 for k, _v in merged if k == kind) > FILTER_MAX_VALUES:
+            raise ValueError(f"At most {FILTER_MAX_VALUES} {kind} filters.")
+    return merged, replaced
+
+
+def describe_filters(rules):
+    """
+    Display lines for [(kind, value)].
+    """
+    by_kind = {}
+    for kind, value in rules:
+        by_kind.setdefault(kind, []).append(value)
+    lines = []
+    if "miles_min" in by_kind or "miles_max" in by_kind:
+        lo = by_kind.get("miles_min", ["0"])[0]
+        hi = by_kind.get("miles_max")
+        lines.append(f"- miles {lo}-{hi[0]}" if hi else f"- miles {lo}+")
+    if "days" in by_kind:
+        lines.append(f"- pickup within {by_kind['days'][0]} days")
+    for kind in _LISTS:
+        if kind in by_kind:
+            lines.append(f"- {kind} " + ", ".join(sorted(by_kind[kind])))
+    return lines
+
+
+# ---------- Per-post facts ----------
+def _pickup_days(post):
+    """
+    Days from the post's date to its first parseable date (MM/DD, MM/DD/YY),
+    or None. A date without a year is taken in the year closest to the post.
+    """
+    if not post.dates:
+        return None
+    posted = time.localtime(post.posted_at if post.posted_at is not None else time.time())
+    today = time.mktime((posted.tm_year, posted.tm_mon, posted.tm_mday, 12, 0, 0, 0, 0, -1))
+    for raw in post.dates:
+        parts = raw.split("/")
+        try:
+            month, day = int(parts[0]), int(parts[1])
+            year = int(parts[2]) % 100 + 2000 if len(parts) > 2 else None
+        except ValueError:
+            continue
+        years = [year] if year is not None else [posted.tm_year - 1, posted.tm_year, posted.tm_year + 1]
+        if not (1 <= month <= 12 and 1 <= day <= 31):
+            continue
+        offsets = [round((time.mktime((y, month, day, 12, 0, 0, 0, 0, -1)) - today) / 86400) for y in years]
+        return min(offsets, key=abs)
+    return None
+
+
+class PostFacts:
+    """
+    The fields filters look at, derived once per post.
+    """
+    __slots__ = ("miles", "equipment", "pickup_days", "text")
+
+    def __init__(self, post):
+        self.miles = post.miles
+        self.equipment = post.equipment
+        self.pickup_days = _pickup_days(post)
+        self.text = post.text or ""
+
+
+# ---------- Compiled filters ----------
+@lru_cache(maxsize=4096)
+def _phrase_re(values):
+    """
+    values: sorted tuple of upper-case phrases.
+    """
+    alts = "|".join(re.escape(v).replace(r"\ ", r"\s+") for v in sorted(values, key=len, reverse=True))
+    return re.compile(rf"(?<!\w)(?:{alts})(?!\w)", re.IGNORECASE)
+
+
+class PostFilter:
+    """
+    One user's compiled filters; call with PostFacts. Never mutated.
+    """
+    __slots__ = ("checks", "__weakref__")
+
+    def __init__(self, checks):
+        self.checks = checks
+
+    def __call__(self, facts: PostFacts) -> bool:
+        for check in self.checks:
+            if not check(facts):
+                return False
+        return True
+
+
+_COMPILED = weakref.WeakValueDictionary()   # sorted rules -> PostFilter in use
+
+
+def compile_filters(rules):
+    """
+    [(kind, value)] -> PostFilter, or None when there is nothing to check.
+    """
+    key = tuple(sorted(set(rules)))
+    if not key:
+        return None
+    compiled = _COMPILED.get(key)
+    if compiled is None:
+        compiled = _COMPILED[key] = _compile(key)
+    return compiled
+
+
+def _compile(rules):
+    by_kind = {}
+    for kind, value in rules:
+        by_kind.setdefault(kind, []).append(value)
+    checks = []
+
+    if "miles_min" in by_kind or "miles_max" in by_kind:
+        lo = int(by_kind.get("miles_min", ["0"])[0])
+        hi = int(by_kind["miles_max"][0]) if "miles_max" in by_kind else float("inf")
+        checks.append(lambda f: f.miles is None or lo <= f.miles <= hi)
+
+    if "days" in by_kind:
+        days = int(by_kind["days"][0])
+        checks.append(lambda f: f.pickup_days is None or f.pickup_days <= days)
+
+    if "equipment" in by_kind:
+        equipment = _phrase_re(tuple(by_kind["equipment"])).search
+        checks.append(lambda f: f.equipment is None or equipment(f.equipment) is not None)
+
+    if "keyword" in by_kind:
+        keyword = _phrase_re(tuple(by_kind["keyword"])).search
+        checks.append(lambda f: keyword(f.text) is not None)
+
+    if "exclude" in by_kind:
+        exclude = _phrase_re(tuple(by_kind["exclude"])).search
+        checks.append(lambda f: exclude(f.text) is None)
+
+    return PostFilter(tuple(checks))
+
+
+def apply_filters(filters: dict, user_ids, post):
+    """
+    The user_ids whose PostFilter (if any) accepts post, in order.
+    filters: user_id -> PostFilter, for users that have filters only.
+    """
+    filtered = filters.keys() & user_ids
+    if not filtered:
+        return user_ids
+    facts = PostFacts(post)
+    verdicts = {}   # PostFilter -> bool, for this post
+    rejected = set()
+    for user_id in filtered:
+        check = filters[user_id]
+        ok = verdicts.get(check)
+        if ok is None:
+            ok = verdicts[check] = check(facts)
+        if not ok:
+            rejected.add(user_id)
+    if not rejected:
+        return user_ids
+    return [user_id for user_id in user_ids if user_id not in rejected]
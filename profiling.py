@@ -0,0 +1,184 @@
+"""
+Event-loop watchdog and on-demand sampling profiler.
+
+Telethon, PTB, the dispatcher and every db.py call share one asyncio loop,
+so anything that blocks it (a sync regex over a huge post, a slow
+aiosqlite hand-off, a big JSON dump) delays live alerts.
+
+LoopWatchdog    - a task sleeping LOOP_LAG_INTERVAL at a time; how late it
+                  wakes up is the loop's scheduling delay, recorded in
+                  usps_loop_lag_seconds and logged above LOOP_LAG_WARN.
+                  A helper thread watches the task's heartbeat: when the
+                  loop has been stuck for LOOP_STALL_SECONDS it logs the
+                  loop thread's stack WHILE it is blocked, so the culprit
+                  is named, not just the delay.
+SamplingProfiler - started/stopped by the admin /profile command: a thread
+                  samples the loop thread's stack every PROFILE_INTERVAL and
+                  counts identical stacks. stop() writes them in collapsed
+                  format ("root;caller;leaf count", one per line, ready for
+                  flamegraph.pl / speedscope) to PROFILE_DIR.
+
+Both only read sys._current_frames() from another thread; nothing is
+hooked into the loop itself, so they cost nothing per call.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+
+from metrics import LOOP_LAG_SECONDS
+
+log = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))    # secs between samples
+LOOP_LAG_WARN = float(os.getenv("LOOP_LAG_WARN", "0.1"))            # log lag above this
+LOOP_STALL_SECONDS = float(os.getenv("LOOP_STALL_SECONDS", "1.0"))  # dump the loop's stack past this
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/data")
+PROFILE_INTERVAL = 0.005          # secs between stack samples
+PROFILE_DEFAULT_SECS = 30
+PROFILE_MAX_SECS = 600
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, warn: float = LOOP_LAG_WARN,
+                 stall: float = LOOP_STALL_SECONDS):
+        self.interval = interval
+        self.warn = warn
+        self.stall = stall
+        self.max_lag = 0.0
+        self._beat = time.monotonic()
+        self._thread_id = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        try:
+            while True:
+                t = loop.time()
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - t - self.interval)
+                self._beat = time.monotonic()
+                LOOP_LAG_SECONDS.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+                if lag > self.warn:
+                    log.warning("event loop lagged %.0f ms", lag * 1000)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        """
+        Helper thread: logs the loop thread's stack once per stall.
+        """
+        reported = None
+        while not self._stop.wait(self.stall / 2):
+            beat = self._beat
+            stuck = time.monotonic() - beat
+            if stuck < self.stall or beat == reported:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                stack = "".join(traceback.format_stack(frame))
+                log.warning("event loop blocked for %.1fs so far; it is at:\n%s", stuck, stack)
+
+
+def _collapse(frame) -> str:
+    """
+    "root;...;leaf" with one "function (file:line)" per frame.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()     # collapsed stack -> samples
+        self.started_at = None
+        self.stopped_at = None
+        self._target = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()   # start() / stop() from the loop and worker threads
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        """
+        Starts sampling the calling thread (call it from the event loop).
+        """
+        with self._lock:
+            if self.running:
+                raise RuntimeError("Profiler already running.")
+            self._target = threading.get_ident()
+            self.stacks = Counter()
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            if frame is not None:
+                self.stacks[_collapse(frame)] += 1
+
+    def stop(self, directory: str = PROFILE_DIR):
+        """
+        Stops sampling and writes the collapsed stacks; returns the file path,
+        or None if it was already stopped. Raises OSError if the file can't be
+        written (sampling has stopped either way). Blocks (file write), so
+        call it via asyncio.to_thread().
+        """
+        with self._lock:
+            if not self.running:
+                return None
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+            self.stopped_at = time.time()
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, time.strftime("profile-%Y%m%d-%H%M%S.txt", time.localtime(self.started_at)))
+            with open(path, "w") as f:
+                for stack, n in self.stacks.most_common():
+                    f.write(f"{stack} {n}\n")
+            return path
+
+    def top(self, n: int = 10):
+        """
+        [(frame, samples)] for the n frames most often on top of the stack.
+        """
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(n)
+
+
+def format_profile(profiler: SamplingProfiler, path: str = None) -> str:
+    """
+    path: where stop() saved the stacks, None if it couldn't.
+    """
+    total = sum(profiler.stacks.values())
+    secs = profiler.stopped_at - profiler.started_at
+    saved = f"Saved to {path}" if path else "Not saved"
+    lines = [f"🔬 Profile: {total:,} samples over {secs:.0f}s", saved, "", "Top frames (self time):"]
+    for frame, count in profiler.top():
+        lines.append(f"{100 * count / max(1, total):5.1f}% {frame}")
+    lines.append("")
+    lines.append("select/_run_once on top = loop idle")
+    return "\n".join(lines)
@@ -0,0 +1,95 @@
+"""
+Recent-post ring buffer.
+
+The last RECENT_POSTS parsed channel posts, kept in memory in msg_id order
+as (msg_id, posted_at, text, LoadPost or None), the shape
+db.get_archived_posts() returns. /testlast and the "Test Last 50" button
+evaluate against it directly: no Telegram call, no DB read, no re-parsing.
+
+Fed by the process that listens (process_event and catch_up hand over the
+LoadPost they just parsed) and warm-loaded from the channel archive once
+at startup. A ROLE=bot process has no listener; before a test it instead
+replays what was archived since its last look (new posts, edits, catch-up
+gap fills; db.get_archive_changes() by archive_seq).
+
+Windows the buffer can't answer (more posts than it holds, or a `since`
+older than its oldest post) fall back to the archive.
+"""
+import os
+from collections import deque
+
+RECENT_POSTS = int(os.getenv("RECENT_POSTS", "5000"))   # posts kept in memory
+
+
+class RecentPosts:
+    def __init__(self, maxlen: int = RECENT_POSTS):
+        self.maxlen = maxlen
+        self._posts = deque(maxlen=maxlen)   # (msg_id, posted_at, text, post), oldest first
+        # True while the buffer holds every archived post (nothing evicted yet)
+        self.complete = False
+
+    def __len__(self):
+        return len(self._posts)
+
+    @property
+    def newest_id(self) -> int:
+        return self._posts[-1][0] if self._posts else 0
+
+    def load(self, rows):
+        """
+        rows: the newest archived posts, oldest first (at most maxlen).
+        """
+        rows = list(rows)
+        self._posts.clear()
+        self._posts.extend(rows)
+        self.complete = len(rows) < self.maxlen
+
+    def add(self, msg_id: int, posted_at: float, text: str, post):
+        """
+        Appends a post; an msg_id already held (edit, catch-up replay) is
+        replaced in place and an older one (catch-up of a gap) is slotted in.
+        """
+        item = (msg_id, posted_at, text, post)
+        posts = self._posts
+        if not posts or msg_id > posts[-1][0]:
+            if len(posts) == self.maxlen:
+                self.complete = False
+            posts.append(item)
+            return
+        # Out of order: scan back from the newest (gaps and edits are recent)
+        for i in range(len(posts) - 1, -1, -1):
+            held = posts[i][0]
+            if held == msg_id:
+                posts[i] = item
+                return
+            if held < msg_id:
+                break
+        else:
+            i = -1
+            if len(posts) == self.maxlen:
+                # Older than everything held in a full buffer
+                self.complete = False
+                return
+        if len(posts) == self.maxlen:
+            posts.popleft()
+            self.complete = False
+            i -= 1
+        posts.insert(i + 1, item)
+
+    def last(self, limit: int = None, since: float = None):
+        """
+        Like db.get_archived_posts(limit, since), or None if the buffer
+        doesn't hold the whole window.
+        """
+        posts = self._posts
+        if since is not None:
+            if not self.complete and (not posts or posts[0][1] >= since):
+                return None
+            out = [p for p in posts if p[1] >= since]
+        else:
+            out = list(posts)
+        if limit is not None:
+            if len(out) < limit and not self.complete and since is None:
+                return None
+            out = out[-limit:]
+        return out
@@ -0,0 +1,100 @@
+"""
+Live Bid post parser.
+
+One left-to-right pass over the post with a single compiled scanner: each
+match is either a 📍 stop or one of the few other fields we recognize
+(miles, dates, equipment), dispatched on the match's group name. parse_post()
+stops come out canonical (cities.py: "ST. LOUIS" -> "SAINT LOUIS"), memoized
+per raw spelling; scan_stops() returns them as written.
+
+Stop syntax is exactly what the old LOC_RE accepted:
+    📍\\s*([A-Z][A-Z\\s\\.\\'-]+?),\\s*([A-Z]{2})
+(greedy here: "," is not in the city class, so greedy == lazy without the
+lazy quantifier's per-character retries). bench/parse_corpus.py keeps the
+two in lockstep.
+"""
+import re
+
+from cities import CANON
+
+_STOP = r"📍\s*(?P<city>[A-Z][A-Z\s.'-]+),\s*(?P<st>[A-Z]{2})"
+
+_STOP_RE = re.compile(_STOP)
+
+# Stops are case-sensitive (like the channel), other fields are not
+_POST_RE = re.compile(
+    _STOP
+    + r"|(?i:(?P<miles>\d{1,3}(?:,\d{3})+|\d+)\s*(?:MI|MILES)\b"
+    r"|(?P<date>\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b)"
+    r"|(?P<equipment>\b(?:53|48|26)\s*(?:'|FT|FOOT)?\s*(?:TRAILER|VAN|DRY VAN|REEFER|BOX TRUCK)"
+    r"|\bTRACTOR\b|\bSTRAIGHT TRUCK\b|\bBOX TRUCK\b|\bREEFER\b|\bSPRINTER\b))"
+)
+
+
+class LoadPost:
+    """
+    One parsed channel post. Origin = FIRST stop, Destination = LAST stop.
+    """
+    __slots__ = ("stops", "miles", "dates", "equipment", "text", "msg_id", "posted_at")
+
+    def __init__(self, stops, miles=None, dates=(), equipment=None, text="", msg_id=None, posted_at=None):
+        self.stops = stops            # tuple of canonical (CITY, ST), len >= 2
+        self.miles = miles            # int or None
+        self.dates = dates            # tuple of "MM/DD" / "MM/DD/YY" strings, in post order
+        self.equipment = equipment    # upper-cased equipment phrase or None
+        self.text = text
+        self.msg_id = msg_id
+        self.posted_at = posted_at    # unix seconds (channel timestamp) or None
+
+    @property
+    def origin(self):
+        return self.stops[0]
+
+    @property
+    def destination(self):
+        return self.stops[-1]
+
+    def __repr__(self):
+        route = " -> ".join(f"{c}, {s}" for c, s in self.stops)
+        return f"LoadPost({self.msg_id}: {route})"
+
+
+def scan_stops(text: str):
+    """
+    Every stop in the post, in order (any count).
+    """
+    return [(m.group(1).strip(), m.group(2)) for m in _STOP_RE.finditer(text or "")]
+
+
+def parse_stops(text: str):
+    """
+    Returns list of stops [(CITY_UPPER, ST), ...] length >= 2, or [].
+    """
+    stops = scan_stops(text)
+    return stops if len(stops) >= 2 else []
+
+
+def parse_post(text: str, msg_id=None, posted_at=None):
+    """
+    Returns a LoadPost, or None if the post has fewer than 2 stops.
+    """
+    text = text or ""
+    stops = []
+    miles = None
+    dates = []
+    equipment = None
+    for m in _POST_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "st":
+            stops.append(CANON.canonical(m.group("city"), m.group("st")))
+        elif kind == "miles":
+            if miles is None:
+                miles = int(m.group("miles").replace(",", ""))
+        elif kind == "date":
+            dates.append(m.group("date"))
+        elif equipment is None:
+            equipment = " ".join(m.group("equipment").upper().split())
+
+    if len(stops) < 2:
+        return None
+    return LoadPost(tuple(stops), miles, tuple(dates), equipment, text, msg_id, posted_at)
@@ -0,0 +1,178 @@
+"""
+Route rules: matching on every stop of a post, not just the first and last.
+
+Rule types (each one alerts on its own, independent of the user's
+origin/destination filters):
+  via ST         - any stop is in ST
+  stop CITY, ST  - any stop is one of the user's cities
+  lane OH>*>CO   - the stop states, in order, fit the pattern. A token is a
+                   state code or "*" (any number of stops, including none);
+                   the pattern covers the whole route, so "OH>CO" is a
+                   two-stop run and "*>KY>*" is "passes through KY".
+
+RouteIndex keys every rule by a stop: via rules by state, stop rules by
+(CITY, ST), lanes by their first state (or last / first concrete state when
+they start with "*"). Matching a post is a constant number of dict lookups per
+stop; each distinct lane pattern seen is checked once (a compiled regex over
+the stop states), no matter how many users share it.
+"""
+import re
+
+LANE_MAX_TOKENS = 12
+_ARROWS = re.compile(r"\s*(?:->|→|>)\s*")
+
+
+def parse_lane(text: str) -> str:
+    """
+    "OH -> * -> CO" / "oh>*>co" -> canonical "OH>*>CO". Raises ValueError.
+    """
+    tokens = []
+    for tok in _ARROWS.split((text or "").strip().upper()):
+        if tok == "*":
+            if tokens and tokens[-1] == "*":
+                continue
+        elif len(tok) != 2 or not tok.isalpha():
+            raise ValueError(f"Lane stops must be 2-letter states or *, got '{tok}'.")
+        tokens.append(tok)
+    if len(tokens) < 2 or tokens.count("*") == len(tokens):
+        raise ValueError("Use at least two stops with a state, e.g. OH>*>CO")
+    if len(tokens) > LANE_MAX_TOKENS:
+        raise ValueError(f"At most {LANE_MAX_TOKENS} stops per lane.")
+    return ">".join(tokens)
+
+
+def parse_route_arg(text: str):
+    """
+    "via KY" | "stop Louisville, KY" | "lane OH>*>CO" -> (kind, value) with
+    value ST, (CITY, ST) or the canonical lane. Raises ValueError.
+    """
+    kind, _, rest = (text or "").strip().partition(" ")
+    kind = kind.lower()
+    rest = rest.strip()
+    if kind == "via":
+        st = rest.upper()
+        if len(st) != 2 or not st.isalpha():
+            raise ValueError("State must be 2 letters (e.g. KY).")
+        return kind, st
+    if kind == "stop":
+        city, sep, st = rest.rpartition(",")
+        if not sep:
+            city, _, st = rest.rpartition(" ")
+        city, st = city.strip().upper(), st.strip().upper()
+        if not city or len(st) != 2 or not st.isalpha():
+            raise ValueError("Use: stop City, ST")
+        return kind, (city, st)
+    if kind == "lane":
+        return kind, parse_lane(rest)
+    raise ValueError("Start with via, stop or lane.")
+
+
+def _lane_key(pattern: str):
+    """
+    Where a lane is filed in RouteIndex: ("first"|"last"|"any", ST).
+    """
+    tokens = pattern.split(">")
+    if tokens[0] != "*":
+        return "first", tokens[0]
+    if tokens[-1] != "*":
+        return "last", tokens[-1]
+    return "any", next(t for t in tokens if t != "*")
+
+
+def _lane_regex(pattern: str):
+    # Matched against "OH>KY>CO>" (every state followed by ">")
+    parts = ["(?:[^>]+>)*" if t == "*" else re.escape(t) + ">" for t in pattern.split(">")]
+    return re.compile("".join(parts))
+
+
+class RouteIndex:
+    def __init__(self):
+        self.via = {}        # ST -> set(user_id)
+        self.stops = {}      # (CITY, ST) -> set(user_id)
+        self.lanes = {}      # pattern -> set(user_id)
+        self.lane_keys = {"first": {}, "last": {}, "any": {}}   # see _lane_key() -> {ST: set(pattern)}
+        self._regex = {}     # pattern -> compiled regex
+        self.users = {}      # user_id -> set((kind, key)) of their rules
+        self._by_kind = {"via": self.via, "stop": self.stops, "lane": self.lanes}
+
+    def __len__(self):
+        return len(self.users)
+
+    def _add(self, kind: str, index: dict, key, user_id: int) -> bool:
+        users = index.setdefault(key, set())
+        if user_id in users:
+            return False
+        users.add(user_id)
+        self.users.setdefault(user_id, set()).add((kind, key))
+        return True
+
+    def _remove(self, kind: str, index: dict, key, user_id: int) -> bool:
+        users = index.get(key)
+        if users is None or user_id not in users:
+            return False
+        users.discard(user_id)
+        if not users:
+            del index[key]
+        rules = self.users[user_id]
+        rules.discard((kind, key))
+        if not rules:
+            del self.users[user_id]
+        return True
+
+    # ---------- Rules ----------
+    def add(self, user_id: int, kind: str, key):
+        """
+        kind/key as returned by parse_route_arg().
+        """
+        if kind == "lane" and key not in self.lanes:
+            where, st = _lane_key(key)
+            self.lane_keys[where].setdefault(st, set()).add(key)
+            self._regex[key] = _lane_regex(key)
+        self._add(kind, self._by_kind[kind], key, user_id)
+
+    def remove(self, user_id: int, kind: str, key):
+        if self._remove(kind, self._by_kind[kind], key, user_id) and kind == "lane" and key not in self.lanes:
+            where, st = _lane_key(key)
+            patterns = self.lane_keys[where][st]
+            patterns.discard(key)
+            if not patterns:
+                del self.lane_keys[where][st]
+            del self._regex[key]
+
+    def clear_user(self, user_id: int):
+        for kind, key in list(self.users.get(user_id, ())):
+            self.remove(user_id, kind, key)
+
+    # ---------- Matching ----------
+    def match(self, stops):
+        """
+        user_ids with a route rule accepting this stop sequence.
+        """
+        out = set()
+        if not self.users:
+            return out
+        states = [st for _city, st in stops]
+        seen = set()
+        for stop, st in zip(stops, states):
+            users = self.stops.get(stop)
+            if users:
+                out |= users
+            if st in seen:
+                continue
+            seen.add(st)
+            users = self.via.get(st)
+            if users:
+                out |= users
+
+        if self.lanes:
+            keys = self.lane_keys
+            patterns = set(keys["first"].get(states[0], ()))
+            patterns.update(keys["last"].get(states[-1], ()))
+            for st in seen:
+                patterns.update(keys["any"].get(st, ()))
+            if patterns:
+                route = ">".join(states) + ">"
+                for pattern in patterns:
+                    if self._regex[pattern].fullmatch(route):
+                        out |= self.lanes[pattern]
+        return out
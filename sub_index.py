@@ -0,0 +1,366 @@
+"""
+In-memory subscription index.
+
+Built once from the DB at startup and kept in sync by the mutation
+functions in db.py (or, in a separate matcher process, by
+db.refresh_index()), so matching a post only touches the users that
+subscribed to its origin instead of every config row.
+Radius origins are served by geo.RadiusIndex, route rules (via / stop /
+lane, matched on every stop) by routes.RouteIndex. Post filters (miles,
+dates, equipment, keywords; see post_filters.py) only ever narrow the
+candidates those produce.
+
+Each user's rules are compiled into one immutable UserMatcher: state sets
+become integer bitmasks (fixed bit per state code), origin cities become
+interned integer ids, and to_all is folded into the destination mask. A
+matcher is rebuilt only when that user's rules change; checking a
+candidate against a post is a single AND.
+"""
+from geo import GAZETTEER, RadiusIndex
+from routes import RouteIndex
+from post_filters import compile_filters, apply_filters
+
+STATE_CODES = (
+    "AL", "AK", "AZ", "AR", "CA", "CO", "CT", "DE", "FL", "GA",
+    "HI", "ID", "IL", "IN", "IA", "KS", "KY", "LA", "ME", "MD",
+    "MA", "MI", "MN", "MS", "MO", "MT", "NE", "NV", "NH", "NJ",
+    "NM", "NY", "NC", "ND", "OH", "OK", "OR", "PA", "RI", "SC",
+    "SD", "TN", "TX", "UT", "VT", "VA", "WA", "WV", "WI", "WY",
+    "DC", "PR", "VI", "GU", "AS", "MP",
+)
+_STATE_BIT = {st: 1 << i for i, st in enumerate(STATE_CODES)}
+_BIT_STATE = {bit: st for st, bit in _STATE_BIT.items()}
+
+ALL_STATES = -1  # destination mask of a to_all user: ANDs non-zero with any bit
+
+# Interned origin points: (CITY_UPPER, ST) <-> small int
+_POINT_ID = {}
+_POINTS = []
+
+
+def state_bit(st: str) -> int:
+    """
+    Bit for a state code. Codes outside STATE_CODES get the next free bit
+    (bounded: codes are two letters).
+    """
+    bit = _STATE_BIT.get(st)
+    if bit is None:
+        bit = _STATE_BIT[st] = 1 << len(_BIT_STATE)
+        _BIT_STATE[bit] = st
+    return bit
+
+
+def states_mask(states) -> int:
+    mask = 0
+    for st in states:
+        mask |= state_bit(st)
+    return mask
+
+
+def mask_states(mask: int):
+    """
+    Inverse of states_mask(), in bit order.
+    """
+    out = []
+    while mask:
+        low = mask & -mask
+        out.append(_BIT_STATE[low])
+        mask ^= low
+    return out
+
+
+def point_id(city: str, st: str) -> int:
+    key = (city, st)
+    pid = _POINT_ID.get(key)
+    if pid is None:
+        pid = _POINT_ID[key] = len(_POINTS)
+        _POINTS.append(key)
+    return pid
+
+
+class UserMatcher:
+    """
+    One user's compiled origin/destination rules. Never mutated; the index
+    swaps in a new one when the user's rules change.
+    """
+    __slots__ = ("user_id", "to_all", "points", "origin_mask", "dest_mask", "accept_mask")
+
+    def __init__(self, user_id: int, to_all: bool = False, points=frozenset(),
+                 origin_mask: int = 0, dest_mask: int = 0):
+        self.user_id = user_id
+        self.to_all = to_all
+        self.points = points              # frozenset of point ids
+        self.origin_mask = origin_mask    # origin states
+        self.dest_mask = dest_mask        # destination states (kept while to_all is on)
+        self.accept_mask = ALL_STATES if to_all else dest_mask
+
+    def replace(self, **changes):
+        fields = {name: getattr(self, name) for name in self.__slots__[1:-1]}
+        fields.update(changes)
+        return UserMatcher(self.user_id, **fields)
+
+
+class SubscriptionIndex:
+    def __init__(self):
+        # Origin side: who cares about a given first stop
+        self.by_point = {}   # point id -> set(user_id)
+        self.by_state = {}   # ST -> set(user_id)
+
+        # Per-user compiled rules (also used to undo index entries on clear_*)
+        self.matchers = {}   # user_id -> UserMatcher
+
+        # Radius origins (see geo.py)
+        self.radius = RadiusIndex(GAZETTEER)
+        self.radii = {}      # user_id -> {gazetteer row: miles}
+
+        # Route rules on any stop (see routes.py); alert on their own
+        self.routes = RouteIndex()
+
+        # Delivery policy, only for users that aren't "instant"
+        self.delivery = {}   # user_id -> (mode, digest_secs)
+
+        # Compiled post filters, only for users that have any
+        self.filters = {}    # user_id -> post_filters.PostFilter
+
+    def _matcher(self, user_id: int) -> UserMatcher:
+        m = self.matchers.get(user_id)
+        if m is None:
+            m = self.matchers[user_id] = UserMatcher(user_id)
+        return m
+
+    def _update(self, user_id: int, **changes):
+        self.matchers[user_id] = self._matcher(user_id).replace(**changes)
+
+    # ---------- Build ----------
+    def load(self, cfg_rows, op_rows, os_rows, ds_rows, or_rows=(), route_rows=(), filter_rows=()):
+        """
+        Rebuild from raw table rows:
+          cfg_rows: (user_id, to_all, delivery, digest_secs)
+          op_rows:  (user_id, city, state)
+          os_rows:  (user_id, state)
+          ds_rows:  (user_id, state)
+          or_rows:  (user_id, city, state, miles)
+          route_rows: (user_id, kind, key) as in routes.parse_route_arg()
+          filter_rows: (user_id, kind, value) as in post_filters.parse_filter_arg()
+        Each user's matcher and filters are compiled once, after all rows are read.
+        """
+        self.__init__()
+        to_all = {}
+        points, origin, dest = {}, {}, {}
+        for user_id, flag, delivery, digest_secs in cfg_rows:
+            to_all[user_id] = bool(flag)
+            self.set_delivery(user_id, delivery, digest_secs)
+        for user_id, city, st in op_rows:
+            pid = point_id(city, st)
+            points.setdefault(user_id, set()).add(pid)
+            self.by_point.setdefault(pid, set()).add(user_id)
+        for user_id, st in os_rows:
+            origin[user_id] = origin.get(user_id, 0) | state_bit(st)
+            self.by_state.setdefault(st, set()).add(user_id)
+        for user_id, st in ds_rows:
+            dest[user_id] = dest.get(user_id, 0) | state_bit(st)
+
+        for user_id in to_all.keys() | points.keys() | origin.keys() | dest.keys():
+            self.matchers[user_id] = UserMatcher(
+                user_id, to_all.get(user_id, False), frozenset(points.get(user_id, ())),
+                origin.get(user_id, 0), dest.get(user_id, 0),
+            )
+        for user_id, city, st, miles in or_rows:
+            self.add_radius(user_id, city, st, miles)
+        for user_id, kind, key in route_rows:
+            self.routes.add(user_id, kind, key)
+        filters = {}
+        for user_id, kind, value in filter_rows:
+            filters.setdefault(user_id, []).append((kind, value))
+        for user_id, rules in filters.items():
+            self.set_filters(user_id, rules)
+
+    # ---------- Origin (city+state) ----------
+    def add_point(self, user_id: int, city: str, st: str):
+        pid = point_id(city, st)
+        m = self._matcher(user_id)
+        if pid not in m.points:
+            self._update(user_id, points=m.points | {pid})
+        self.by_point.setdefault(pid, set()).add(user_id)
+
+    def remove_point(self, user_id: int, city: str, st: str):
+        pid = _POINT_ID.get((city, st))
+        m = self.matchers.get(user_id)
+        if pid is None or m is None or pid not in m.points:
+            return
+        self._update(user_id, points=m.points - {pid})
+        _discard(self.by_point, pid, user_id)
+
+    def clear_points(self, user_id: int):
+        m = self.matchers.get(user_id)
+        if m is None or not m.points:
+            return
+        for pid in m.points:
+            _discard(self.by_point, pid, user_id)
+        self._update(user_id, points=frozenset())
+
+    # ---------- Origin (states) ----------
+    def add_state(self, user_id: int, st: str):
+        m = self._matcher(user_id)
+        bit = state_bit(st)
+        if not m.origin_mask & bit:
+            self._update(user_id, origin_mask=m.origin_mask | bit)
+        self.by_state.setdefault(st, set()).add(user_id)
+
+    def remove_state(self, user_id: int, st: str):
+        m = self.matchers.get(user_id)
+        bit = state_bit(st)
+        if m is None or not m.origin_mask & bit:
+            return
+        self._update(user_id, origin_mask=m.origin_mask & ~bit)
+        _discard(self.by_state, st, user_id)
+
+    def clear_states(self, user_id: int):
+        m = self.matchers.get(user_id)
+        if m is None or not m.origin_mask:
+            return
+        for st in mask_states(m.origin_mask):
+            _discard(self.by_state, st, user_id)
+        self._update(user_id, origin_mask=0)
+
+    # ---------- Origin (radius) ----------
+    def add_radius(self, user_id: int, city: str, st: str, miles: int) -> bool:
+        """
+        False if the city isn't in the gazetteer (rule ignored).
+        """
+        centre = GAZETTEER.lookup(city, st)
+        if centre is None:
+            return False
+        self._matcher(user_id)
+        self.radii.setdefault(user_id, {})[centre] = miles
+        self.radius.add(user_id, centre, miles)
+        return True
+
+    def remove_radius(self, user_id: int, city: str, st: str):
+        centre = GAZETTEER.lookup(city, st)
+        if centre is not None and self.radii.get(user_id, {}).pop(centre, None) is not None:
+            self.radius.remove(user_id, centre)
+
+    def clear_radius(self, user_id: int):
+        for centre in self.radii.pop(user_id, ()):
+            self.radius.remove(user_id, centre)
+
+    # ---------- Destination ----------
+    def set_to_all(self, user_id: int, enabled: bool):
+        if self._matcher(user_id).to_all != bool(enabled):
+            self._update(user_id, to_all=bool(enabled))
+
+    def add_dest(self, user_id: int, st: str):
+        m = self._matcher(user_id)
+        bit = state_bit(st)
+        if not m.dest_mask & bit:
+            self._update(user_id, dest_mask=m.dest_mask | bit)
+
+    def remove_dest(self, user_id: int, st: str):
+        m = self.matchers.get(user_id)
+        bit = state_bit(st)
+        if m is not None and m.dest_mask & bit:
+            self._update(user_id, dest_mask=m.dest_mask & ~bit)
+
+    def clear_dest(self, user_id: int):
+        m = self.matchers.get(user_id)
+        if m is not None and m.dest_mask:
+            self._update(user_id, dest_mask=0)
+
+    # ---------- Route rules ----------
+    def add_route(self, user_id: int, kind: str, key):
+        self.routes.add(user_id, kind, key)
+
+    def remove_route(self, user_id: int, kind: str, key):
+        self.routes.remove(user_id, kind, key)
+
+    def clear_routes(self, user_id: int):
+        self.routes.clear_user(user_id)
+
+    # ---------- Post filters ----------
+    def set_filters(self, user_id: int, rules):
+        """
+        Recompiles the user's filters from their full [(kind, value)] list.
+        """
+        compiled = compile_filters(rules)
+        if compiled is None:
+            self.filters.pop(user_id, None)
+        else:
+            self.filters[user_id] = compiled
+
+    # ---------- Delivery ----------
+    def set_delivery(self, user_id: int, mode: str, digest_secs: int):
+        if mode == "instant":
+            self.delivery.pop(user_id, None)
+        else:
+            self.delivery[user_id] = (mode, digest_secs)
+
+    # ---------- Whole user ----------
+    def replace_user(self, user_id: int, to_all: bool, points, states, dests,
+                     delivery=("instant", 0), radii=(), routes=(), filters=()):
+        """
+        Swap in one user's full rule set (changes made by another process).
+        """
+        self.clear_points(user_id)
+        self.clear_states(user_id)
+        self.clear_radius(user_id)
+        self.clear_routes(user_id)
+
+        pids = frozenset(point_id(city, st) for city, st in points)
+        for pid in pids:
+            self.by_point.setdefault(pid, set()).add(user_id)
+        for st in states:
+            self.by_state.setdefault(st, set()).add(user_id)
+        self.matchers[user_id] = UserMatcher(user_id, bool(to_all), pids, states_mask(states), states_mask(dests))
+
+        self.set_delivery(user_id, *delivery)
+        for city, st, miles in radii:
+            self.add_radius(user_id, city, st, miles)
+        for kind, key in routes:
+            self.routes.add(user_id, kind, key)
+        self.set_filters(user_id, filters)
+
+    # ---------- Matching ----------
+    def match(self, o_city: str, o_state: str, d_state: str, stops=(), post=None):
+        """
+        Returns user_ids whose origin rules accept the FIRST stop and whose
+        destination rules accept the LAST stop state, plus (if the post's
+        `stops` are given) users with a route rule accepting them.
+        Given the LoadPost, users whose post filters reject it are dropped.
+        Cost is proportional to the number of candidates only.
+        """
+        pid = _POINT_ID.get((o_city, o_state))
+        by_point = self.by_point.get(pid) if pid is not None else None
+        by_state = self.by_state.get(o_state)
+        if by_point and by_state:
+            candidates = by_point | by_state
+        else:
+            candidates = by_point or by_state or ()
+
+        if self.radius.rules:
+            origin = GAZETTEER.lookup(o_city, o_state)
+            if origin is not None:
+                near = self.radius.match(origin)
+                if near:
+                    candidates = near.union(candidates)
+
+        d_bit = state_bit(d_state)
+        matchers = self.matchers
+        out = [user_id for user_id in candidates if matchers[user_id].accept_mask & d_bit]
+
+        if stops and self.routes.users:
+            routed = self.routes.match(stops)
+            if routed:
+                out = list(routed.union(out))
+        if post is not None and self.filters and out:
+            out = apply_filters(self.filters, out, post)
+        return out
+
+
+def _discard(index: dict, key, user_id: int):
+    users = index.get(key)
+    if users is None:
+        return
+    users.discard(user_id)
+    if not users:
+        del index[key]